@@ -4,13 +4,16 @@ This Streamlit app allows users to generate recommendations using
 collaborative filtering and content-based filtering models.
 """
 
+import functools
 import os
 from pathlib import Path
-import pickle
 import pandas as pd
 import streamlit as st
 from dotenv import load_dotenv
 from  src.project_pipeline.aws_utils import load_from_s3
+from src.project_pipeline import (ann_index, batching, cbf_features, cf_scoring, data_loader,
+                                  interactions, metrics, model_export, model_registry,
+                                  rec_index, service, shared_artifacts)
 import src.project_pipeline.load_config as lc
 
 # Load configuration and environment variables
@@ -23,34 +26,171 @@ aws_access_key = os.getenv("aws_access_key_id")
 aws_secret_access_key = os.getenv("aws_secret_access_key")
 aws_region = os.getenv("aws_region")
 bucket_name = config["aws"]["bucket_name"]
+service_url = os.getenv("RECOMMENDER_SERVICE_URL")
+metrics_file = Path(os.getenv("APP_METRICS_FILE", "metrics/app_metrics.prom"))
+shared_config = config.get("shared_artifacts") or {}
 
 @st.cache_resource
+def get_registry():
+    """
+    Create the model registry shared by every session of the app.
+
+    Returns:
+    - ModelRegistry: The registry holding the latest version of each artifact.
+    """
+    return model_registry.ModelRegistry(config["registry"]["check_interval_seconds"])
+
+def get_artifact(path, loader):
+    """
+    Get the latest loaded version of an artifact, reloading it in the background
+    once the pipeline or an S3 download publishes a new version.
+
+    Parameters:
+    - path (Path): The path of the artifact.
+    - loader: The function loading the artifact from its path.
+
+    Returns:
+    - tuple: The version of the artifact and the artifact itself.
+    """
+    return get_registry().get(path, loader)
+
+def defer(loader):
+    """
+    Wrap an artifact loader so that, with shared artifacts enabled, only the worker
+    publishing the shared scoring arrays loads the artifact.
+
+    Parameters:
+    - loader: The function loading the artifact from its path.
+
+    Returns:
+    - function: The loader itself, or a loader returning the load to run when needed.
+    """
+    if not shared_config.get("enabled"):
+        return loader
+    return lambda path: functools.partial(loader, path)
+
+def resolve(artifact):
+    """
+    Run the load of an artifact deferred by defer.
+
+    Parameters:
+    - artifact: A loaded artifact or a deferred load.
+
+    Returns:
+    - The loaded artifact.
+    """
+    return artifact() if isinstance(artifact, functools.partial) else artifact
+
+def share(name, model_key, build):
+    """
+    Map the scoring arrays of a model published by the first worker, publishing them
+    if this worker is the first, when shared artifacts are enabled.
+
+    Parameters:
+    - name (str): Name of the shared arrays.
+    - model_key (tuple): Versions of the inputs of build, identical in every worker.
+    - build: Function building the arrays.
+
+    Returns:
+    - dict: The arrays, mapped read-only when shared.
+    """
+    if not shared_config.get("enabled"):
+        return build()
+    return shared_artifacts.attach_or_publish(name, model_key, build, shared_config.get("root"),
+                                              shared_config["wait_seconds"])
+
 def load_model(model_path):
     """
     Load a machine learning model from the specified path.
 
+    Exported models are preferred: the SVD export needs only NumPy and the
+    content-based export imports xgboost when it is first selected.
+
     Parameters:
-    - model_path (str): The path to the model file.
+    - model_path (Path): The path to the model file or exported model directory.
 
     Returns:
     - model: The loaded machine learning model.
     """
-    with open(model_path, "rb") as file:
-        return pickle.load(file)
+    with metrics.timed("app_model_load_seconds"):
+        return model_export.load_model_artifact(Path(model_path))
 
-def load_data(data_path):
+def load_recommendation_index(index_dir):
+    """
+    Memory-map the precomputed top-N index of a model.
+
+    Parameters:
+    - index_dir (Path): The directory holding the index files.
+
+    Returns:
+    - dict: The loaded index, or None if it has not been built.
+    """
+    with metrics.timed("app_load_index_seconds"):
+        return rec_index.load_index(index_dir)
+
+def load_data(data_path, columns=None):
     """
     Load data from the specified path.
 
+    Columnar artifacts are memory-mapped and only the requested columns are
+    read; older pickled artifacts are still supported.
+
     Parameters:
     - data_path (str): The path to the data file.
+    - columns (tuple): The columns to load, or None for all columns.
 
     Returns:
     - pd.DataFrame: The loaded data.
     """
-    return pd.read_pickle(data_path)
+    with metrics.timed("app_load_data_seconds"):
+        return data_loader.read_frame(Path(data_path),
+                                      None if columns is None else list(columns),
+                                      as_category=True)
+
+def data_columns():
+    """
+    List the columns of the data read by the app: the ids and the content-based features.
 
-def make_content_based_predictions(user_id, df_with_one_hot, pipeline):
+    Returns:
+    - tuple: The column names.
+    """
+    cbf_config = config["model_building"][1]["CBF"][0]["model"]
+    text_columns = cbf_config["text_params"]
+    if isinstance(text_columns, str):
+        text_columns = [text_columns]
+    return ("user_id", "product_id", *cbf_config["numeric_params"], *text_columns)
+
+@st.cache_resource(max_entries=2)
+def load_cbf_features(_pipeline, _df_with_one_hot, _interactions,
+                      model_key):  # pylint: disable=unused-argument
+    """
+    Build the product-level feature store of a content-based model once per model.
+    With shared artifacts enabled, the store is published once and mapped by every
+    worker; the interaction index is memory-mapped already and is not republished.
+
+    Parameters:
+    - _pipeline: The trained content-based filtering pipeline (not hashed by Streamlit).
+    - _df_with_one_hot (pd.DataFrame): The dataframe containing one-hot encoded data.
+    - _interactions (dict): The user-item interaction index, or None if not built.
+    - model_key (tuple): Versions of the pipeline, data and interactions, used as the cache key.
+
+    Returns:
+    - dict: The feature store built by cbf_features.build_feature_store.
+    """
+    def build():
+        with metrics.timed("app_cbf_feature_store_seconds"):
+            store = cbf_features.build_feature_store(resolve(_pipeline),
+                                                     resolve(_df_with_one_hot), _interactions)
+        return {key: value for key, value in store.items() if key != "interactions"}
+
+    if _interactions is None:
+        # Without the interaction index the store holds a dict of rated products per user
+        return build()
+    store = share("cbf_store", model_key, build)
+    store["interactions"] = _interactions
+    return store
+
+def make_content_based_predictions(user_id, df_with_one_hot, pipeline, model_key=None):
     """
     Generate content-based recommendations for a given user.
 
@@ -58,39 +198,86 @@ def make_content_based_predictions(user_id, df_with_one_hot, pipeline):
     - user_id (str): The ID of the user for whom recommendations are to be generated.
     - df_with_one_hot (pd.DataFrame): The dataframe containing one-hot encoded data.
     - pipeline: The trained content-based filtering pipeline.
+    - model_key (tuple): Versions of the pipeline and data; defaults to the pipeline identity.
 
     Returns:
     - list: A list of recommendation dictionaries, 
     each containing "product_id" and "predicted_rating".
     """
-    all_product_ids = df_with_one_hot["product_id"].unique()
+    # Rated products are masked through the interaction index in O(degree)
+    interactions_version, user_interactions = get_artifact(Path("artifacts/Data/interactions"),
+                                                           interactions.load_interactions)
+    store_key = (id(pipeline) if model_key is None else model_key, interactions_version)
+    store = load_cbf_features(pipeline, df_with_one_hot, user_interactions, store_key)
 
-    user_interactions = df_with_one_hot[df_with_one_hot["user_id"] == user_id]["product_id"].values
-    unrated_product_ids = [product_id for product_id in all_product_ids
-                            if product_id not in user_interactions]
+    num_recs = 10
+    # Sessions asking at the same time share one ranking call
+    batcher = get_cbf_batcher(store, store_key)
+    return batcher.submit([user_id], num_recs)[0]
 
-    x_new = df_with_one_hot[df_with_one_hot["product_id"].isin(unrated_product_ids)]
-    x_new = x_new.drop(columns=["rating", "user_id"])
+@st.cache_resource(max_entries=2)
+def get_cbf_batcher(_store, store_key):  # pylint: disable=unused-argument
+    """
+    Create the micro-batcher shared by every session for one content-based feature store.
 
-    predictions = pipeline.predict(x_new)
+    Concurrent requests are masked and ranked together on the cached product scores.
 
-    predicted_ratings = pd.DataFrame({"product_id": x_new["product_id"],
-                                       "predicted_rating": predictions})
-    predicted_ratings.sort_values(by="predicted_rating", ascending=False, inplace=True)
-    predicted_ratings = predicted_ratings.drop_duplicates(subset=["product_id"])
+    Parameters:
+    - _store (dict): The feature store built by cbf_features.build_feature_store.
+    - store_key (tuple): Versions of the feature store inputs, used as the cache key.
 
-    num_recs = 10
-    recommendations = []
-    for _, row in predicted_ratings.head(num_recs).iterrows():
-        recommendation = {
-            "product_id": row["product_id"],
-            "predicted_rating": row["predicted_rating"]
-        }
-        recommendations.append(recommendation)
+    Returns:
+    - MicroBatcher: Batcher whose key is the number of recommendations.
+    """
+    return batching.from_config(
+        lambda num_recs, user_ids: cbf_features.recommend_batch(_store, user_ids, num_recs),
+        config.get("batching"), "app_cbf")
+
+@st.cache_resource(max_entries=2)
+def load_cf_factors(_model, _df_with_one_hot, model_key):  # pylint: disable=unused-argument
+    """
+    Extract the scoring arrays of a collaborative filtering model once per model.
 
-    return recommendations
+    Parameters:
+    - _model: The collaborative filtering model (not hashed by Streamlit).
+    - _df_with_one_hot (pd.DataFrame): The dataframe holding the product catalog.
+    - model_key (tuple): Versions of the model and data, used as the cache key.
 
-def generate_cf_recommendations(model, user_id, df_with_one_hot):
+    Returns:
+    - dict: The factor arrays built by cf_scoring.extract_svd_factors, mapped from the
+      copy shared by every worker when shared artifacts are enabled.
+    """
+    def build():
+        with metrics.timed("app_cf_factor_extraction_seconds"):
+            return cf_scoring.extract_svd_factors(
+                resolve(_model), resolve(_df_with_one_hot)["product_id"].unique())
+
+    return share("cf_factors", model_key, build)
+
+@st.cache_resource(max_entries=2)
+def get_cf_batcher(_factors, _ann, batcher_key):  # pylint: disable=unused-argument
+    """
+    Create the micro-batcher shared by every session for one collaborative filtering model.
+
+    Concurrent requests are scored with one user-factor by item-factor matrix product,
+    or one ANN search when the index is enabled.
+
+    Parameters:
+    - _factors (dict): The factor arrays built by cf_scoring.extract_svd_factors.
+    - _ann (dict): The ANN index, or None to score every product.
+    - batcher_key (tuple): Versions of the model, data and ANN index, used as the cache key.
+
+    Returns:
+    - MicroBatcher: Batcher whose key is the number of recommendations.
+    """
+    def score(num_recs, user_ids):
+        if _ann is not None:
+            return ann_index.recommend_batch(_factors, _ann, user_ids, num_recs,
+                                             config["ann_index"]["nprobe"])
+        return cf_scoring.recommend_batch(_factors, user_ids, num_recs)
+    return batching.from_config(score, config.get("batching"), "app_cf")
+
+def generate_cf_recommendations(model, user_id, df_with_one_hot, model_key=None):
     """
     Generates collaborative filtering recommendations based on the selected model and user input.
 
@@ -98,53 +285,89 @@ def generate_cf_recommendations(model, user_id, df_with_one_hot):
     - model: The collaborative filtering model.
     - user_id (str): The ID of the user for whom recommendations are to be generated.
     - df_with_one_hot (pd.DataFrame): The dataframe containing one-hot encoded data.
+    - model_key (tuple): Versions of the model and data; defaults to the model identity.
 
     Returns:
     None
     """
-    predictions = []
-    for product_id in df_with_one_hot["product_id"].unique():
-        pred = model.predict(uid=user_id, iid=str(product_id))
-        predictions.append((product_id, pred.est))
-
-
-
-    predicted_ratings = pd.DataFrame(predictions, columns=["product_id", "predicted_rating"])
-    predicted_ratings.sort_values(by="predicted_rating", ascending=False, inplace=True)
-    predicted_ratings = predicted_ratings.drop_duplicates(subset=["product_id"])
-
     num_recs = 10
-    top_recommendations = predicted_ratings.head(num_recs)
+    _, index = get_artifact(Path("artifacts/Recommendation_Index/Collaborative_Filtering"),
+                            load_recommendation_index)
+    with metrics.timed("app_cf_scoring_seconds"):
+        top_recommendations = rec_index.lookup(index, user_id, num_recs)
+        if top_recommendations is None:
+            model_key = id(model) if model_key is None else model_key
+            factors = load_cf_factors(model, df_with_one_hot, model_key)
+            ann_version, ann = None, None
+            if config["ann_index"]["enabled"]:
+                ann_version, ann = get_artifact(Path("artifacts/Collaborative_Filtering/ann_index"),
+                                                ann_index.load_ann_index)
+            # Sessions asking at the same time share one scoring call
+            batcher = get_cf_batcher(factors, ann, (model_key, ann_version))
+            top_recommendations = pd.DataFrame(batcher.submit([user_id], num_recs)[0],
+                                               columns=["product_id", "predicted_rating"])
     st.write(f"Top {num_recs} recommendations for user {user_id}:")
     st.dataframe(top_recommendations)
 
 
-def generate_cbf_recommendations(user_id, df_with_one_hot):
+def generate_cbf_recommendations(user_id, df_with_one_hot, data_version=None):
     """
     Generates content-based filtering recommendations based on the selected model and user input.
 
     Parameters:
     - user_id (str): The ID of the user for whom recommendations are to be generated.
     - df_with_one_hot (pd.DataFrame): The dataframe containing one-hot encoded data.
+    - data_version (tuple): Version of the data, part of the feature store cache key.
 
     Returns:
     None
     """
-    content_based_model_path = Path("artifacts/Content_Based_Filtering/best_cbf.pkl")
+    content_based_model_path = model_export.preferred_artifact(
+        Path("artifacts/Content_Based_Filtering/best_cbf"),
+        Path("artifacts/Content_Based_Filtering/best_cbf.pkl"))
     if not content_based_model_path.exists():
         st.error(f"Model file not found: {content_based_model_path}")
         return
 
-    content_based_pipeline = load_model(content_based_model_path)
-    st.write("Content Based Filtering model loaded successfully!")
-    recommendations = make_content_based_predictions(user_id, df_with_one_hot,
-                                                     content_based_pipeline)
     num_recs = 10
+    _, index = get_artifact(Path("artifacts/Recommendation_Index/Content_Based_Filtering"),
+                            load_recommendation_index)
+    with metrics.timed("app_cbf_scoring_seconds"):
+        recommendations = rec_index.lookup(index, user_id, num_recs)
+        if recommendations is None:
+            model_version, content_based_pipeline = get_artifact(content_based_model_path,
+                                                                 defer(load_model))
+            st.write("Content Based Filtering model loaded successfully!")
+            recommendations = make_content_based_predictions(
+                user_id, df_with_one_hot, content_based_pipeline, (model_version, data_version))
     st.write(f"Top {num_recs} recommendations for user {user_id}:")
     st.write(pd.DataFrame(recommendations))
 
 
-def generate_recommendations(model_choice, user_id, model, df_with_one_hot):
+def generate_service_recommendations(model_choice, user_id):
+    """
+    Fetches recommendations from the standalone recommendation service.
+
+    Parameters:
+    - model_choice (str): The choice of model for generating recommendations.
+    - user_id (str): The ID of the user for whom recommendations are to be generated.
+
+    Returns:
+    None
+    """
+    model = "cf" if model_choice == "Collaborative Filtering" else "cbf"
+    num_recs = 10
+    try:
+        recommendations = service.request_recommendations(service_url, model, [user_id],
+                                                          num_recs)
+    except (OSError, ValueError) as error:
+        st.error(f"Recommendation service unavailable: {error}")
+        return
+    st.write(f"Top {num_recs} recommendations for user {user_id}:")
+    st.dataframe(pd.DataFrame(recommendations[user_id]))
+
+
+def generate_recommendations(model_choice, user_id, model, df_with_one_hot, model_key=None):
     """
     Generates recommendations based on the selected model and user input.
 
@@ -153,14 +376,19 @@ def generate_recommendations(model_choice, user_id, model, df_with_one_hot):
     - user_id (str): The ID of the user for whom recommendations are to be generated.
     - model: The collaborative filtering model object.
     - df_with_one_hot (pd.DataFrame): The dataframe containing one-hot encoded data.
+    - model_key (tuple): Versions of the selected model and of the data.
 
     Returns:
     None
     """
-    if model_choice == "Collaborative Filtering":
-        generate_cf_recommendations(model, user_id, df_with_one_hot)
+    if service_url:
+        generate_service_recommendations(model_choice, user_id)
+    elif model_choice == "Collaborative Filtering":
+        generate_cf_recommendations(model, user_id, df_with_one_hot, model_key)
     elif model_choice == "Content Based Filtering":
-        generate_cbf_recommendations(user_id, df_with_one_hot)
+        generate_cbf_recommendations(user_id, df_with_one_hot,
+                                     None if model_key is None else model_key[1])
+    metrics.write_metrics(metrics_file)
 
 
 
@@ -170,9 +398,14 @@ def main():
     """
     st.title("Recommender System Interface")
 
-    data_path = Path("artifacts/Data/final_df.pkl")
-    if data_path.exists():
-        df_with_one_hot = load_data(data_path)
+    data_path = Path("artifacts/Data/final_df")
+    columns = data_columns()
+    if data_path.exists() or data_path.with_suffix(".pkl").exists():
+        # The columnar data is a directory; older artifacts are a single pickle
+        data_file = data_path if data_path.exists() else data_path.with_suffix(".pkl")
+        # With shared artifacts, only the worker publishing the scoring arrays reads the data
+        data_version, df_with_one_hot = get_artifact(
+            data_file, defer(lambda _: load_data(data_path, columns)))
     else:
         st.error("Data file not found. Please check your setup.")
         return
@@ -180,9 +413,11 @@ def main():
     if st.button("Download Artifacts from S3"):
         target_directories = ["artifacts_Collaborative_Filtering",
                         "artifacts_Content_Based_Filtering",
-                              "artifacts_Data"]
+                              "artifacts_Data",
+                              "artifacts_Recommendation_Index"]
         load_from_s3(aws_access_key, aws_secret_access_key,
-                     aws_region, bucket_name, target_directories)
+                     aws_region, bucket_name, target_directories,
+                     transfer=config["aws"]["transfer"] if config["aws"].get("sync") else None)
         st.session_state["models_downloaded"] = True
 
     # Check if models are downloaded before proceeding
@@ -190,11 +425,15 @@ def main():
         model_choice = st.selectbox("Select Model",
                                     ["Collaborative Filtering", "Content Based Filtering"])
         model_paths = {
-            "Collaborative Filtering": Path("artifacts/Collaborative_Filtering/best_cf.pkl"),
-            "Content Based Filtering": Path("artifacts/Content_Based_Filtering/best_cbf.pkl")
+            "Collaborative Filtering": model_export.preferred_artifact(
+                Path("artifacts/Collaborative_Filtering/best_cf.npz"),
+                Path("artifacts/Collaborative_Filtering/best_cf.pkl")),
+            "Content Based Filtering": model_export.preferred_artifact(
+                Path("artifacts/Content_Based_Filtering/best_cbf"),
+                Path("artifacts/Content_Based_Filtering/best_cbf.pkl"))
         }
         if model_paths[model_choice].exists():
-            model = load_model(model_paths[model_choice])
+            model_version, model = get_artifact(model_paths[model_choice], defer(load_model))
             st.write(f"{model_choice} model loaded successfully!")
         else:
             st.error(f"Model file not found: {model_paths[model_choice]}")
@@ -203,7 +442,8 @@ def main():
         user_id = st.text_input("Enter User ID:")
         if st.button("Generate Recommendations"):
             if user_id:
-                generate_recommendations(model_choice, user_id, model, df_with_one_hot)
+                generate_recommendations(model_choice, user_id, model, df_with_one_hot,
+                                         (model_version, data_version))
             else:
                 st.error("Please enter a valid User ID.")
 
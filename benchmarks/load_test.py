@@ -0,0 +1,402 @@
+"""
+Load Test
+Replays user_id traces drawn from the test split against the recommendation
+serving path at one or more concurrency levels and reports latency
+percentiles, throughput, error rate and peak memory as JSON. Runs fully
+locally against the artifacts written by pipeline.py.
+
+Usage:
+    python -m benchmarks.load_test --target cf --concurrency 1 8 32 --requests 2000
+    python -m benchmarks.load_test --target http --url http://localhost:8000 --model cbf \
+        --mode asyncio --concurrency 16 64
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+from benchmarks.run_benchmarks import latency_summary
+from src.project_pipeline import data_loader, load_config, rec_index, save_artifacts, service
+
+logger = logging.getLogger(__name__)
+
+TARGETS = ("cf", "cbf", "http")
+MODES = ("thread", "process", "asyncio")
+COLD_PREFIX = "cold-start-"
+INDEX_DIRS = {"cf": "Collaborative_Filtering", "cbf": "Content_Based_Filtering"}
+
+
+def rss_bytes() -> int:
+    """Returns the current resident set size, or the peak where /proc is missing."""
+    try:
+        with open("/proc/self/statm", encoding="utf8") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PeakMemory:
+    """Samples the resident set size on a background thread while in use."""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while True:
+            self.peak = max(self.peak, rss_bytes())
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+
+def build_trace(known_users: np.ndarray, n_requests: int, cold_ratio: float,
+                seed: int = 0) -> List[str]:
+    """Draws a request trace mixing known users and cold-start users.
+
+    Known users are drawn with replacement, so popular users repeat as in
+    real traffic; every cold-start request is for a new user.
+
+    Args:
+        known_users (np.ndarray): User ids of the test split.
+        n_requests (int): Length of the trace.
+        cold_ratio (float): Share of requests from users unknown to the models.
+        seed (int): Seed of the draw.
+
+    Returns:
+        List[str]: One user id per request.
+    """
+    rng = np.random.default_rng(seed)
+    n_cold = int(round(n_requests * cold_ratio))
+    trace = [str(user_id) for user_id in rng.choice(known_users, n_requests - n_cold)]
+    trace += [f"{COLD_PREFIX}{number}" for number in range(n_cold)]
+    return [trace[position] for position in rng.permutation(len(trace))]
+
+
+def load_target(target: str, artifacts: Path, config: dict, *, model: str = "cf",
+                url: Optional[str] = None, num_recs: int = 10,
+                batching: bool = True) -> Callable[[str], object]:
+    """Builds the function serving one request of the trace.
+
+    "cf" and "cbf" mirror ``generate_cf_recommendations`` and
+    ``make_content_based_predictions`` of the app without Streamlit: the
+    top-N index answers known users and the others are scored through the
+    shared micro-batcher. "http" posts each request to the service.
+
+    Args:
+        target (str): "cf", "cbf" or "http".
+        artifacts (Path): Directory containing the pipeline artifacts.
+        config (dict): The loaded pipeline config.
+        model (str): Model asked from the service by the "http" target.
+        url (Optional[str]): Base URL of the service for the "http" target.
+        num_recs (int): Number of recommendations per request.
+        batching (bool): Micro-batch concurrent requests as configured.
+
+    Returns:
+        Callable[[str], object]: Returns the recommendations of a user id.
+    """
+    if target == "http":
+        return lambda user_id: service.request_recommendations(url, model, [user_id],
+                                                               num_recs)[user_id]
+    cbf_config = config["model_building"][1]["CBF"][0]["model"]
+    text_columns = cbf_config["text_params"]
+    if isinstance(text_columns, str):
+        text_columns = [text_columns]
+    recommenders = service.load_recommenders(artifacts,
+                                             [*cbf_config["numeric_params"], *text_columns],
+                                             config["ann_index"], config.get("shared_artifacts"))
+    batchers = service.make_batchers(recommenders,
+                                     config.get("batching") if batching else None)
+    index = rec_index.load_index(artifacts / "Recommendation_Index" / INDEX_DIRS[target])
+
+    def recommend(user_id: str):
+        recommendations = rec_index.lookup(index, user_id, num_recs)
+        if recommendations is None:
+            recommendations = batchers[target].submit([user_id], num_recs)[0]
+        return recommendations
+    return recommend
+
+
+def run_client(recommend: Callable[[str], object], user_ids: List[str]) -> List[tuple]:
+    """Sends requests back to back, as one user session would.
+
+    Returns:
+        List[tuple]: (user id, latency in seconds, error or None) per request.
+    """
+    records = []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        error = None
+        try:
+            recommend(user_id)
+        except Exception as exception:  # pylint: disable=broad-except
+            error = repr(exception)
+        records.append((user_id, time.perf_counter() - start, error))
+    return records
+
+
+_WORKER_TARGET = None
+
+
+def _init_worker(target_args: dict, warmup: List[str]):
+    """Loads the target once per worker process and warms it up."""
+    global _WORKER_TARGET  # pylint: disable=global-statement
+    _WORKER_TARGET = load_target(**target_args)
+    run_client(_WORKER_TARGET, warmup)
+
+
+def _worker_pid(delay: float) -> int:
+    """Returns the worker's process id after a short wait, so other workers take tasks too."""
+    time.sleep(delay)
+    return os.getpid()
+
+
+def _run_worker_client(user_ids: List[str]) -> tuple:
+    """Runs one client in a worker process and reports its peak memory."""
+    with PeakMemory() as memory:
+        records = run_client(_WORKER_TARGET, user_ids)
+    return records, memory.peak
+
+
+async def _post_async(url: str, body: bytes) -> bytes:
+    """Posts a request to the service on a non-blocking socket."""
+    parsed = urllib.parse.urlsplit(url)
+    reader, writer = await asyncio.open_connection(parsed.hostname, parsed.port or 80)
+    try:
+        writer.write(b"POST /recommend HTTP/1.1\r\n"
+                     + f"Host: {parsed.netloc}\r\nContent-Type: application/json\r\n"
+                       f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                     + body)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    status = response.split(b"\r\n", 1)[0]
+    if b" 200 " not in status:
+        raise OSError(f"Service answered {status.decode(errors='replace')}")
+    return response.split(b"\r\n\r\n", 1)[1]
+
+
+async def _run_async(recommend: Callable[[str], object], slices: List[List[str]],
+                     target_args: dict) -> List[List[tuple]]:
+    """Runs every client as a coroutine on one event loop.
+
+    Requests to the service use non-blocking sockets; in-process targets,
+    which are CPU-bound, run on a thread per client.
+    """
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(len(slices)))
+
+    async def request(user_id: str):
+        if target_args["target"] == "http":
+            body = json.dumps({"model": target_args["model"], "user_ids": [user_id],
+                               "k": target_args["num_recs"]}).encode("utf8")
+            return json.loads(await _post_async(target_args["url"], body))
+        return await asyncio.to_thread(recommend, user_id)
+
+    async def client(user_ids: List[str]) -> List[tuple]:
+        records = []
+        for user_id in user_ids:
+            start = time.perf_counter()
+            error = None
+            try:
+                await request(user_id)
+            except Exception as exception:  # pylint: disable=broad-except
+                error = repr(exception)
+            records.append((user_id, time.perf_counter() - start, error))
+        return records
+
+    return await asyncio.gather(*(client(user_ids) for user_ids in slices))
+
+
+def server_peak_rss(url: str) -> Optional[int]:
+    """Reads the peak memory the service reports on GET /metrics."""
+    try:
+        with urllib.request.urlopen(f"{url.rstrip('/')}/metrics", timeout=10) as response:
+            for line in response.read().decode("utf8").splitlines():
+                if line.startswith("recommender_process_max_rss_bytes "):
+                    return int(float(line.split()[1]))
+    except OSError:
+        return None
+    return None
+
+
+def summarize(records: List[tuple], seconds: float) -> dict:
+    """Summarises the requests of one run."""
+    latencies = [latency for _, latency, error in records if error is None]
+    cold = [latency for user_id, latency, error in records
+            if error is None and user_id.startswith(COLD_PREFIX)]
+    known = [latency for user_id, latency, error in records
+             if error is None and not user_id.startswith(COLD_PREFIX)]
+    errors = [error for _, _, error in records if error is not None]
+    return {
+        "requests": len(records),
+        "seconds": seconds,
+        "throughput_rps": len(latencies) / seconds if seconds else None,
+        "errors": len(errors),
+        "error_rate": len(errors) / len(records) if records else None,
+        "error_examples": sorted(set(errors))[:5],
+        "latency": latency_summary(latencies) if latencies else None,
+        "latency_known": latency_summary(known) if known else None,
+        "latency_cold": latency_summary(cold) if cold else None,
+    }
+
+
+def _replay_in_workers(slices: List[List[str]], target_args: dict,
+                       warmup: List[str]) -> Tuple[List[tuple], float, dict]:
+    """Runs every client in its own process, each loading the target.
+
+    Returns:
+        Tuple[List[tuple], float, dict]: The request records, the seconds of
+        the run, and the peak memory of the busiest worker and of all processes.
+    """
+    with ProcessPoolExecutor(max_workers=len(slices), initializer=_init_worker,
+                             initargs=(target_args, warmup)) as executor:
+        # Tasks only reach workers done loading: wait until every worker has run one
+        ready = set()
+        while len(ready) < len(slices):
+            ready.update(executor.map(_worker_pid, [0.05] * len(slices)))
+        start = time.perf_counter()
+        outputs = list(executor.map(_run_worker_client, slices))
+        seconds = time.perf_counter() - start
+    records = [record for worker_records, _ in outputs for record in worker_records]
+    return records, seconds, {
+        "peak_rss_bytes": max(peak for _, peak in outputs),
+        "total_peak_rss_bytes": sum(peak for _, peak in outputs) + rss_bytes(),
+    }
+
+
+def _replay_in_process(mode: str, recommend: Callable[[str], object], slices: List[List[str]],
+                       target_args: dict) -> Tuple[List[tuple], float, dict]:
+    """Runs every client as a thread or a coroutine of this process.
+
+    Returns:
+        Tuple[List[tuple], float, dict]: The request records, the seconds of
+        the run, and the peak memory of this process.
+    """
+    with PeakMemory() as memory:
+        start = time.perf_counter()
+        if mode == "asyncio":
+            outputs = asyncio.run(_run_async(recommend, slices, target_args))
+        else:
+            with ThreadPoolExecutor(max_workers=len(slices)) as executor:
+                outputs = list(executor.map(lambda user_ids: run_client(recommend, user_ids),
+                                            slices))
+        seconds = time.perf_counter() - start
+    records = [record for client_records in outputs for record in client_records]
+    return records, seconds, {"peak_rss_bytes": memory.peak}
+
+
+def run_level(args, recommend, trace: List[str], concurrency: int, target_args: dict) -> dict:
+    """Replays the trace with ``concurrency`` clients in the chosen mode."""
+    slices = [trace[client::concurrency] for client in range(concurrency)]
+    slices = [user_ids for user_ids in slices if user_ids]
+    if args.mode == "process":
+        records, seconds, memory = _replay_in_workers(slices, target_args, trace[:args.warmup])
+    else:
+        records, seconds, memory = _replay_in_process(args.mode, recommend, slices, target_args)
+    result = {"concurrency": concurrency, "mode": args.mode, **memory,
+              **summarize(records, seconds)}
+    if args.target == "http":
+        result["server_peak_rss_bytes"] = server_peak_rss(args.url)
+    latency = result["latency"] or {}
+    logger.info("concurrency %d (%s): %.1f req/s, p50 %.2fms, p99 %.2fms, %d errors, "
+                "peak RSS %.1f MB", concurrency, args.mode, result["throughput_rps"] or 0,
+                latency.get("p50_ms", float("nan")), latency.get("p99_ms", float("nan")),
+                result["errors"], result["peak_rss_bytes"] / 1024 ** 2)
+    return result
+
+
+def run(args) -> dict:
+    """Loads the target, replays the trace at every concurrency level and returns the report."""
+    config = load_config.load_config(Path(args.config))
+    test_data = data_loader.read_frame(args.artifacts / "Data" / "test_data", ["user_id"])
+    known_users = np.asarray(test_data["user_id"].astype(str).unique(), dtype=object)
+    trace = build_trace(known_users, args.requests, args.cold_ratio, args.seed)
+    target_args = {"target": args.target, "artifacts": args.artifacts, "config": config,
+                   "model": args.model, "url": args.url, "num_recs": args.k,
+                   "batching": not args.no_batching}
+
+    recommend = None
+    load_start = time.perf_counter()
+    if args.mode != "process":
+        recommend = load_target(**target_args)
+        run_client(recommend, trace[:args.warmup])
+    load_seconds = time.perf_counter() - load_start
+
+    return {
+        "params": {key: str(value) if isinstance(value, Path) else value
+                   for key, value in vars(args).items() if key != "output"},
+        "trace": {"requests": len(trace), "known_users": len(known_users),
+                  "cold_requests": sum(user_id.startswith(COLD_PREFIX) for user_id in trace),
+                  "distinct_users": len(set(trace))},
+        "load_seconds": load_seconds,
+        "results": [run_level(args, recommend, trace, concurrency, target_args)
+                    for concurrency in args.concurrency],
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """Parses the load test command line."""
+    parser = argparse.ArgumentParser(description="Load test the recommendation serving path.")
+    parser.add_argument("--target", choices=TARGETS, default="cf",
+                        help="In-process app path of a model, or the HTTP service.")
+    parser.add_argument("--model", choices=service.MODELS, default="cf",
+                        help="Model requested from the service by the http target.")
+    parser.add_argument("--url", default="http://localhost:8000",
+                        help="Base URL of the service for the http target.")
+    parser.add_argument("--mode", choices=MODES, default="thread",
+                        help="Run the clients as threads, processes or coroutines.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32],
+                        help="Numbers of concurrent clients, one run per value.")
+    parser.add_argument("--requests", type=int, default=2000,
+                        help="Requests per run, shared among the clients.")
+    parser.add_argument("--cold-ratio", type=float, default=0.1,
+                        help="Share of requests from cold-start users.")
+    parser.add_argument("--warmup", type=int, default=20,
+                        help="Requests sent before the runs, not measured.")
+    parser.add_argument("--k", type=int, default=10, help="Recommendations per request.")
+    parser.add_argument("--no-batching", action="store_true",
+                        help="Score every in-process request alone.")
+    parser.add_argument("--seed", type=int, default=77)
+    parser.add_argument("--config", default=os.getenv("CONFIG_PATH", "config/default.yaml"))
+    parser.add_argument("--artifacts", type=Path, default=Path("artifacts"))
+    parser.add_argument("--output", type=Path, default=Path("load_test_results.json"))
+    args = parser.parse_args(argv)
+    if not 0 <= args.cold_ratio <= 1:
+        parser.error("--cold-ratio must be between 0 and 1")
+    if min(args.concurrency) < 1:
+        parser.error("--concurrency values must be at least 1")
+    return args
+
+
+def main(argv=None):
+    """Entry point of the load test."""
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args(argv)
+    save_artifacts.save_json(run(args), args.output)
+    logger.info("Wrote load test results to %s", args.output)
+
+
+if __name__ == "__main__":
+    main()
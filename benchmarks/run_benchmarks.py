@@ -0,0 +1,301 @@
+"""
+Benchmark Suite
+Times and memory-profiles every pipeline stage and the per-user latency of
+both recommenders on synthetic data, and writes the results as JSON so runs
+can be compared.
+
+Usage:
+    python -m benchmarks.run_benchmarks --rows 100000 --output bench_results.json
+"""
+
+import argparse
+import json
+import logging
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import numpy as np
+from benchmarks.synthetic_data import generate_reviews
+from src.project_pipeline import (ann_index, cbf_features, cf_scoring, data_loader, eda,
+                                  evaluation, interactions, model_export, model_training,
+                                  save_artifacts)
+
+logger = logging.getLogger(__name__)
+
+
+def measure(results: list, name: str, func, *args, trace_memory: bool = True, **kwargs):
+    """Runs one stage and records its wall time, CPU time and peak memory.
+
+    Args:
+        results (list): List receiving the stage record.
+        name (str): Name of the stage.
+        func: Function running the stage.
+        trace_memory (bool): Track the peak Python allocation with tracemalloc.
+        *args, **kwargs: Arguments passed to ``func``.
+
+    Returns:
+        The output of ``func``.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    output = func(*args, **kwargs)
+    record = {
+        "stage": name,
+        "wall_s": time.perf_counter() - wall_start,
+        "cpu_s": time.process_time() - cpu_start,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    if trace_memory:
+        record["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+    results.append(record)
+    logger.info("%s: %.3fs wall, %.3fs cpu", name, record["wall_s"], record["cpu_s"])
+    return output
+
+
+def latency_summary(latencies: list) -> dict:
+    """Summarises per-call latencies in milliseconds."""
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "calls": len(latencies_ms),
+        "mean_ms": float(latencies_ms.mean()),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p90_ms": float(np.percentile(latencies_ms, 90)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "max_ms": float(latencies_ms.max()),
+    }
+
+
+def time_per_user(func, user_ids) -> dict:
+    """Calls ``func`` once per user and summarises the latencies."""
+    latencies = []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        func(user_id)
+        latencies.append(time.perf_counter() - start)
+    return latency_summary(latencies)
+
+
+def ann_recall(factors: dict, ann: dict, user_ids, k: int, nprobe: int) -> float:
+    """Measures the recall@k of the ANN search against scoring every item."""
+    exact = ann_index.recommend_batch(factors, ann, user_ids, k, nprobe=len(ann["centroids"]))
+    approx = ann_index.recommend_batch(factors, ann, user_ids, k, nprobe=nprobe)
+    hits = [len({rec["product_id"] for rec in found} & {rec["product_id"] for rec in truth})
+            / max(1, len(truth)) for found, truth in zip(approx, exact)]
+    return float(np.mean(hits))
+
+
+def artifact_bytes(path: Path) -> int:
+    """Returns the size of an artifact file, or of every file in an artifact directory."""
+    if path.is_dir():
+        return sum(child.stat().st_size for child in path.rglob("*") if child.is_file())
+    return path.stat().st_size
+
+
+def cold_load_seconds(path: Path) -> float:
+    """Loads a model artifact in a fresh interpreter, including the imports it triggers."""
+    code = ("import time; from pathlib import Path; "
+            "from src.project_pipeline import model_export; start = time.perf_counter(); "
+            f"model_export.load_model_artifact(Path({str(path)!r})); "
+            "print(time.perf_counter() - start)")
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            check=True)
+    return float(output.stdout.split()[-1])
+
+
+def artifact_report(cf_model, cbf_pipeline, directory: Path) -> list:
+    """Compares the size and cold load time of pickled and exported models."""
+    paths = {
+        ("cf", "pickle"): directory / "best_cf.pkl",
+        ("cbf", "pickle"): directory / "best_cbf.pkl",
+        ("cf", "export"): directory / "best_cf.npz",
+        ("cbf", "export"): directory / "best_cbf",
+    }
+    save_artifacts.save_model(cf_model, paths["cf", "pickle"])
+    save_artifacts.save_model(cbf_pipeline, paths["cbf", "pickle"])
+    model_export.export_models(cf_model, cbf_pipeline, paths["cf", "export"],
+                               paths["cbf", "export"])
+    return [{"model": model, "format": artifact_format, "bytes": artifact_bytes(path),
+             "cold_load_s": cold_load_seconds(path)}
+            for (model, artifact_format), path in paths.items()]
+
+
+def frame_memory_report(object_frame, compact_frame) -> dict:
+    """Compares the memory of the encoded frame with object columns, compact,
+    and as the app loads it back from its columnar artifact."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        save_artifacts.save_columns(compact_frame, Path(temp_dir) / "final_df")
+        loaded = data_loader.read_frame(Path(temp_dir) / "final_df", mmap=False,
+                                        as_category=True)
+        report = {"object": eda.memory_report(object_frame),
+                  "compact": eda.memory_report(compact_frame),
+                  "loaded": eda.memory_report(loaded)}
+    report["reduction"] = 1 - report["compact"]["total_bytes"] / report["object"]["total_bytes"]
+    return report
+
+
+def prepare_data(args, stages: list, trace: bool):
+    """Generates the raw reviews and runs the preprocessing stages on them.
+
+    Returns:
+        tuple: The encoded data and its frame memory report.
+    """
+    raw = measure(stages, "generate_reviews", generate_reviews, args.rows, args.products,
+                  args.users, args.max_users_per_review, args.seed, trace_memory=False)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        csv_path = Path(temp_dir) / "amazon.csv"
+        raw.to_csv(csv_path, index=False)
+        del raw
+        df = measure(stages, "read_data", data_loader.read_data, csv_path, trace_memory=trace)
+
+    df = measure(stages, "data_preprocess", eda.data_preprocess, df, trace_memory=trace)
+    df = measure(stages, "split_users", eda.split_users_frame, df, trace_memory=trace)
+    df = measure(stages, "extract_categories", eda.extract_categories, df, trace_memory=trace)
+    df.drop("category", axis=1, inplace=True)
+    object_frame = eda.one_hot_encoding(df.copy(), compact=False)
+    df_final = measure(stages, "one_hot_encoding", eda.one_hot_encoding, df, trace_memory=trace)
+    return df_final, frame_memory_report(object_frame, df_final)
+
+
+def train_models(args, stages: list, trace: bool, df_final) -> dict:
+    """Splits the encoded data and trains both recommenders.
+
+    Returns:
+        dict: The splits, both models and the CF search report.
+    """
+    data, train_data, test_data = measure(stages, "train_test_data", model_training.train_test_data,
+                                  df_final, 0.2, args.seed,
+                                  ["user_id", "product_id", "rating"], trace_memory=trace)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        search_file = Path(temp_dir) / "cf_search.json"
+        cf_model = measure(stages, "collaborative_filtering",
+                           model_training.collaborative_filtering, data, args.n_factors,
+                           args.lr_all, args.reg_all, cv=args.cv, n_jobs=args.n_jobs,
+                           random_state=args.seed, strategy=args.cf_strategy,
+                           report_file=search_file, trace_memory=trace)
+        with open(search_file, encoding="utf8") as file:
+            cf_search = json.load(file)
+    cbf_pipeline = measure(stages, "content_base_filtering",
+                           model_training.content_base_filtering,
+                           ["discounted_price", "discount_percentage"], "review_title",
+                           train_data, trace_memory=trace)
+    return {"train_data": train_data, "test_data": test_data, "cf": cf_model,
+            "cbf": cbf_pipeline, "cf_search": cf_search}
+
+
+def latency_report(args, factors: dict, store: dict, ann: dict, user_ids) -> tuple:
+    """Times both recommenders and the ANN index on a sample of known and cold-start users.
+
+    Returns:
+        tuple: The per-recommender latencies and the ANN results per ``nprobe``.
+    """
+    rng = np.random.default_rng(args.seed)
+    sample = list(rng.choice(user_ids, min(args.latency_users, len(user_ids)), replace=False))
+    sample += [f"cold-start-{number}" for number in range(max(1, args.latency_users // 10))]
+    latency = {
+        "generate_cf_recommendations": time_per_user(
+            lambda user_id: cf_scoring.recommend(factors, user_id), sample),
+        "make_content_based_predictions": time_per_user(
+            lambda user_id: cbf_features.recommend(store, user_id), sample),
+    }
+    ann_results = []
+    for nprobe in args.ann_nprobe:
+        ann_results.append({
+            "nprobe": nprobe,
+            "recall_at_10": ann_recall(factors, ann, sample, 10, nprobe),
+            **time_per_user(lambda user_id, nprobe=nprobe: ann_index.recommend(
+                factors, ann, user_id, nprobe=nprobe), sample),
+        })
+    return latency, ann_results
+
+
+def run(args) -> dict:
+    """Runs the whole benchmark and returns the machine-readable results."""
+    stages = []
+    trace = not args.no_tracemalloc
+    df_final, frame_memory = prepare_data(args, stages, trace)
+    models = train_models(args, stages, trace, df_final)
+
+    factors = measure(stages, "cf_load", cf_scoring.extract_svd_factors, models["cf"],
+                      df_final["product_id"].unique(), trace_memory=trace)
+    store = measure(stages, "cbf_load", cbf_features.build_feature_store, models["cbf"],
+                    df_final, trace_memory=trace)
+    ann = measure(stages, "ann_build", ann_index.build_ann_index, factors, args.ann_lists,
+                  random_state=args.seed, trace_memory=trace)
+    evaluation_report = measure(stages, "evaluate_models", evaluation.evaluate_models,
+                                models["cf"], models["cbf"], models["train_data"],
+                                models["test_data"], catalog=df_final,
+                                user_interactions=interactions.build_interactions(df_final),
+                                config={"k": [10], "relevance_threshold": 4.0, "shard_size": 512,
+                                        "memory_mb": 512, "n_jobs": args.n_jobs},
+                                trace_memory=trace)
+    latency, ann_results = latency_report(args, factors, store, ann,
+                                          df_final["user_id"].unique())
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        artifacts = artifact_report(models["cf"], models["cbf"], Path(temp_dir))
+
+    return {
+        "params": {key: value for key, value in vars(args).items() if key != "output"},
+        "environment": {"python": platform.python_version(), "numpy": np.__version__,
+                        "machine": platform.machine(), "processor": platform.processor()},
+        "data": {"raw_rows": args.rows, "ratings": len(df_final),
+                 "users": int(df_final["user_id"].nunique()),
+                 "products": int(df_final["product_id"].nunique())},
+        "stages": stages,
+        "latency": latency,
+        "ann": {"n_lists": len(ann["centroids"]), "results": ann_results},
+        "artifacts": artifacts,
+        "evaluation": evaluation_report,
+        "cf_search": models["cf_search"],
+        "frame_memory": frame_memory,
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """Parses the benchmark command line."""
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline and recommenders.")
+    parser.add_argument("--rows", type=int, default=10000,
+                        help="Number of raw review rows to generate.")
+    parser.add_argument("--products", type=int, default=1500)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--max-users-per-review", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=77)
+    parser.add_argument("--n-factors", type=int, nargs="+", default=[50])
+    parser.add_argument("--lr-all", type=float, nargs="+", default=[0.005])
+    parser.add_argument("--reg-all", type=float, nargs="+", default=[0.02])
+    parser.add_argument("--cv", type=int, default=3)
+    parser.add_argument("--cf-strategy", choices=["grid", "halving"], default="grid",
+                        help="SVD hyperparameter search; halving uses the default budget.")
+    parser.add_argument("--n-jobs", type=int, default=1)
+    parser.add_argument("--latency-users", type=int, default=200,
+                        help="Number of known users timed per recommender.")
+    parser.add_argument("--ann-lists", type=int, default=None,
+                        help="Number of ANN lists; defaults to 4 * sqrt(n_products).")
+    parser.add_argument("--ann-nprobe", type=int, nargs="+", default=[1, 4, 8, 16],
+                        help="ANN lists probed per query, one result per value.")
+    parser.add_argument("--no-tracemalloc", action="store_true",
+                        help="Skip tracemalloc peaks, which slow down the stages.")
+    parser.add_argument("--output", type=Path, default=Path("bench_results.json"))
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Entry point of the benchmark suite."""
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args(argv)
+    results = run(args)
+    save_artifacts.save_json(results, args.output)
+    logger.info("Wrote benchmark results to %s", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+""" Module to generate synthetic review dumps with the amazon.csv schema"""
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+CATEGORIES = [
+    'Computers&Accessories|Accessories&Peripherals|Cables&Accessories|Cables|USBCables',
+    'Electronics|HomeTheater,TV&Video|Televisions|SmartTelevisions',
+    'Electronics|Mobiles&Accessories|Smartphones&BasicMobiles|Smartphones',
+    'Home&Kitchen|Kitchen&HomeAppliances|SmallKitchenAppliances|ElectricKettles',
+    'OfficeProducts|OfficePaperProducts|Paper|Stationery|Pens,Pencils&WritingSupplies',
+    'Toys&Games|Arts&Crafts|Drawing&PaintingSupplies|ColouringPens&Markers',
+    'HomeImprovement|Electrical|CordManagement',
+    'MusicalInstruments|Microphones|Condenser',
+    'Car&Motorbike|CarAccessories|InteriorAccessories|AirPurifiers&Ionizers',
+    'Health&PersonalCare|HomeMedicalSupplies&Equipment|HealthMonitors|WeighingScales',
+]
+TITLES = ['Good product', 'Value for money!', 'Nice', 'Works as expected.',
+          'Not worth it', 'Excellent quality', 'Decent', 'Bad packaging']
+WORDS = np.array(['cable', 'fast', 'charging', 'durable', 'quality', 'usb', 'smart',
+                  'tv', 'phone', 'battery', 'kitchen', 'design', 'warranty'])
+
+
+def _review_columns(rng: np.random.Generator, n_rows: int, n_users: int,
+                    max_users_per_review: int) -> dict:
+    """Draws the comma-separated users, names, review ids and titles of every row."""
+    counts = rng.integers(1, max_users_per_review + 1, n_rows)
+    user_codes = rng.integers(0, n_users, counts.sum())
+    title_codes = rng.integers(0, len(TITLES), counts.sum())
+    ends = np.cumsum(counts)
+    starts = ends - counts
+
+    def join(values):
+        return [','.join(values[start:end]) for start, end in zip(starts, ends)]
+
+    return {
+        'user_id': join(np.char.add('U', np.char.zfill(user_codes.astype(str), 9))),
+        'user_name': join(np.char.add('Name', user_codes.astype(str))),
+        'review_id': join(np.char.add('R', np.arange(counts.sum()).astype(str))),
+        'review_title': join(np.asarray(TITLES)[title_codes]),
+    }
+
+
+def _product_catalog(rng: np.random.Generator, n_products: int) -> dict:
+    """Draws the prices, rating, category and description of every product."""
+    actual = rng.integers(200, 20000, n_products)
+    discount = rng.integers(5, 90, n_products)
+    return {
+        'actual': actual,
+        'discount': discount,
+        'discounted': (actual * (100 - discount) / 100).astype(int),
+        'rating': np.round(rng.uniform(2.0, 5.0, n_products), 1),
+        'product_ids': np.char.add('B', np.char.zfill(np.arange(n_products).astype(str), 9)),
+        'category': np.asarray(CATEGORIES)[rng.integers(0, len(CATEGORIES), n_products)],
+        'about': np.asarray([' '.join(rng.choice(WORDS, 8)) + '.' for _ in range(n_products)],
+                            dtype=object),
+    }
+
+
+def generate_reviews(n_rows: int, n_products: int, n_users: int,
+                     max_users_per_review: int, seed: int = 0) -> pd.DataFrame:
+    """Generates a raw review dump shaped like the Amazon sales dataset.
+
+    Each row lists between one and ``max_users_per_review`` comma-separated
+    users, names and review titles, so the number of ratings after user
+    splitting is about ``n_rows * (1 + max_users_per_review) / 2``.
+
+    Args:
+        n_rows (int): Number of product review rows.
+        n_products (int): Number of distinct products.
+        n_users (int): Number of distinct users.
+        max_users_per_review (int): Maximum users listed in one row.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        pd.DataFrame: Raw data with the same columns and string formats as amazon.csv.
+    """
+    rng = np.random.default_rng(seed)
+    codes = rng.integers(0, n_products, n_rows)
+    reviews = _review_columns(rng, n_rows, n_users, max_users_per_review)
+    catalog = _product_catalog(rng, n_products)
+
+    return pd.DataFrame({
+        'product_id': catalog['product_ids'][codes],
+        'product_name': np.char.add('Product ', codes.astype(str)),
+        'category': catalog['category'][codes],
+        'discounted_price': [f'₹{value:,}' for value in catalog['discounted'][codes]],
+        'actual_price': [f'₹{value:,}' for value in catalog['actual'][codes]],
+        'discount_percentage': np.char.add(catalog['discount'][codes].astype(str), '%'),
+        'rating': catalog['rating'][codes].astype(str),
+        'rating_count': [f'{value:,}' for value in rng.integers(1, 100000, n_rows)],
+        'about_product': catalog['about'][codes],
+        'user_id': reviews['user_id'],
+        'user_name': reviews['user_name'],
+        'review_id': reviews['review_id'],
+        'review_title': reviews['review_title'],
+        'review_content': np.asarray(TITLES)[rng.integers(0, len(TITLES), n_rows)],
+        'img_link': 'https://m.media-amazon.com/images/I/example.jpg',
+        'product_link': np.char.add('https://www.amazon.in/dp/', catalog['product_ids'][codes]),
+    })
+
+
+def main():
+    """Writes a synthetic dump to CSV."""
+    parser = argparse.ArgumentParser(description='Generate a synthetic amazon.csv.')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--products', type=int, default=1500)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--max-users-per-review', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, default=Path('data/synthetic_amazon.csv'))
+    args = parser.parse_args()
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    generate_reviews(args.rows, args.products, args.users, args.max_users_per_review,
+                     args.seed).to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    main()
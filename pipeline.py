@@ -2,23 +2,33 @@
 Pipeline Module
 This module defines a pipeline for loading data, preprocessing it, training models,
 and saving artifacts.
+
+Each stage output is cached under a key built from the hash of its inputs and
+the slice of the config it depends on, so a rerun only recomputes the stages
+whose inputs changed.
 """
 
+import argparse
+import functools
+import json
 import os
 import logging
+import sys
 from pathlib import Path
-from dotenv import load_dotenv
+from typing import Optional
 import pandas as pd
-from src.project_pipeline import eda, load_config
-from src.project_pipeline import data_loader, model_training, save_artifacts, aws_utils
+from dotenv import load_dotenv
+from src.project_pipeline import eda, load_config, metrics, stage_cache, streaming
+from src.project_pipeline import data_loader, model_training, save_artifacts, aws_utils, rec_index
+from src.project_pipeline import ann_index, cf_scoring, evaluation, incremental, interactions
+from src.project_pipeline import model_export, text_processing
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load configuration and environment variables
+# Load environment variables
 CONFIG_PATH = os.getenv('CONFIG_PATH', 'config/default.yaml')
-config = load_config.load_config(Path(CONFIG_PATH))
 load_dotenv()
 aws_access_key = os.getenv('aws_access_key_id')
 aws_secret_access_key = os.getenv('aws_secret_access_key')
@@ -26,63 +36,479 @@ aws_region = os.getenv('aws_region')
 
 # Define file paths
 artifacts = Path('artifacts')
+CACHE_DIR = Path('.pipeline_cache')
 CF_MODEL_FILE = artifacts / 'Collaborative_Filtering' / 'best_cf.pkl'
+CF_EXPORT_FILE = artifacts / 'Collaborative_Filtering' / 'best_cf.npz'
+CF_ANN_DIR = artifacts / 'Collaborative_Filtering' / 'ann_index'
 CBF_MODEL_FILE = artifacts / 'Content_Based_Filtering' / 'best_cbf.pkl'
-DATA_USER_SPLIT = artifacts / 'Data' / 'user_split.pkl'
-DATA_BEFORE_TRAIN_PATH = artifacts / 'Data' / 'final_df.pkl'
-TRAIN_DATA_PATH = artifacts / 'Data' / 'train_data.pkl'
-TEST_DATA_PATH = artifacts / 'Data' / 'test_data.pkl'
-
-logger.info('Reading data...')
-df = data_loader.read_data(config['data_loader']['path'])
-
-logger.info('Preprocessing data...')
-df_processed = eda.data_preprocess(df)
-df_user_split = pd.concat([eda.split_users(row)
-                           for _, row in df_processed.iterrows()], ignore_index=True)
-
-logger.info('Extracting first and last category...')
-df_user_split[['First_category', 'Last_category']] = df_user_split['category'].apply(lambda x:
-                                                        pd.Series(eda.extract_first_last(x)))
-df_user_split.drop('category', axis=1, inplace=True)
-
-logger.info('Performing one-hot encoding...')
-df_final = eda.one_hot_encoding(df_user_split)
-
-logger.info('Splitting data into train and test sets...')
-
-logger.info('Splitting data into train and test sets...')
-train_test_data = model_training.train_test_data(df_final, config['train_test_config']['test_size'],
-                                     config['train_test_config']['random_state'],
-                                     config['train_test_config']['training_cols'])
-
-logger.info('Training Collaborative Filtering model...')
-best_collaborative_filtering = model_training.collaborative_filtering(
-    train_test_data[0],
-    config['model_building'][0]['CF'][0]['model']['params']['n_factors'],
-    config['model_building'][0]['CF'][0]['model']['params']['lr_all'],
-    config['model_building'][0]['CF'][0]['model']['params']['reg_all']
-)
-
-logger.info('Training Content Based Filtering model...')
-content_based_filtering = model_training.content_base_filtering(
-                            config['model_building'][1]['CBF'][0]['model']['numeric_params'],
-                            config['model_building'][1]['CBF'][0]['model']['text_params'],
-                            train_test_data[1])
-
-
-logger.info('Saving models and data...')
-save_artifacts.save_model(content_based_filtering, CBF_MODEL_FILE)
-save_artifacts.save_model(best_collaborative_filtering, CF_MODEL_FILE)
-save_artifacts.save_data(df_user_split, DATA_USER_SPLIT)
-save_artifacts.save_data(df_final, DATA_BEFORE_TRAIN_PATH)
-save_artifacts.save_data(train_test_data[1], TRAIN_DATA_PATH)
-save_artifacts.save_data(train_test_data[2], TEST_DATA_PATH)
-
-logger.info('Uploading artifacts to AWS S3...')
-aws_utils.upload_artifacts(aws_access_key,
-                           aws_secret_access_key,
-                           aws_region, artifacts,
-                           config['aws'])
-
-logger.info('Uploaded artifacts!')
+CBF_EXPORT_DIR = artifacts / 'Content_Based_Filtering' / 'best_cbf'
+DATA_USER_SPLIT = artifacts / 'Data' / 'user_split'
+DATA_BEFORE_TRAIN_PATH = artifacts / 'Data' / 'final_df'
+DATA_INTERACTIONS = artifacts / 'Data' / 'interactions'
+TRAIN_DATA_PATH = artifacts / 'Data' / 'train_data'
+TEST_DATA_PATH = artifacts / 'Data' / 'test_data'
+CF_INDEX_DIR = artifacts / 'Recommendation_Index' / 'Collaborative_Filtering'
+CBF_INDEX_DIR = artifacts / 'Recommendation_Index' / 'Content_Based_Filtering'
+METRICS_FILE = artifacts / 'Metrics' / 'pipeline_metrics.prom'
+EVALUATION_FILE = artifacts / 'Metrics' / 'evaluation.json'
+CF_SEARCH_FILE = artifacts / 'Metrics' / 'cf_search.json'
+MODEL_VERSION_FILE = artifacts / 'model_version.json'
+
+STAGES = ['read', 'preprocess', 'encode', 'stream', 'interactions', 'split', 'cf', 'cbf']
+SKIPPABLE_STAGES = ['cf', 'cbf', 'index', 'evaluate', 'save', 'upload']
+
+
+def preprocess(df, text_config: Optional[dict] = None):
+    """Cleans the raw data and splits it into one row per user review."""
+    logger.info('Preprocessing data...')
+    df_processed = eda.data_preprocess(df, **(text_config or {}))
+    df_user_split = eda.split_users_frame(df_processed)
+
+    logger.info('Extracting first and last category...')
+    df_user_split = eda.extract_categories(df_user_split)
+    df_user_split.drop('category', axis=1, inplace=True)
+    return df_user_split
+
+
+def without_workers(section: Optional[dict]) -> Optional[dict]:
+    """Drops the process count of a config section that only changes how fast it runs."""
+    if section is None:
+        return None
+    return {key: value for key, value in section.items() if key != 'n_jobs'}
+
+
+def build_indexes(cf_model, cbf_model, final, user_interactions, index_config: dict):
+    """Builds the top-N recommendation indexes of whichever models are given."""
+    if cf_model is not None:
+        rec_index.build_cf_index(cf_model, final, index_config['top_n'],
+                                 index_config['batch_size'], CF_INDEX_DIR)
+    if cbf_model is not None:
+        rec_index.build_cbf_index(cbf_model, final, index_config['top_n'],
+                                  index_config['batch_size'], CBF_INDEX_DIR,
+                                  user_interactions=user_interactions)
+
+
+def save_ann_index(cf_model, final, ann_config: dict):
+    """Builds and saves the ANN index of the SVD model when it is enabled."""
+    if ann_config['enabled']:
+        factors = cf_scoring.extract_svd_factors(cf_model, final['product_id'].unique())
+        ann = ann_index.build_ann_index(factors, ann_config['n_lists'], ann_config['n_iter'],
+                                        random_state=ann_config['random_state'])
+        ann_index.save_ann_index(ann, CF_ANN_DIR)
+
+
+def resolve(*outputs):
+    """Loads or computes lazy stage outputs, e.g. before a stage starts its measurement."""
+    for output in outputs:
+        output()
+
+
+def stage_runner(cache_dir: Path, force: set, track):
+    """Returns the function declaring a cached stage of the pipeline.
+
+    ``stage(name, inputs, config_slice, compute, needs)`` returns the cache
+    key of the stage and a getter of its output. Outputs are loaded or
+    computed on first use, so a stage whose downstream stages are all
+    cached is never read back from disk. The outputs a stage needs are
+    resolved before its tracking starts, so each stage records only its
+    own time, peak and profile.
+
+    Args:
+        cache_dir (Path): Root directory of the stage cache.
+        force (set): Stages recomputed even when cached.
+        track: ``metrics.track_stage`` with the tracking options bound.
+    """
+    def stage(name, inputs, config_slice, compute, needs=()):
+        key = stage_cache.stage_key(name, inputs, config_slice)
+        output = []
+
+        def tracked():
+            resolve(*needs)
+            with track(name):
+                return compute()
+
+        def get():
+            if not output:
+                output.append(stage_cache.run_stage(name, key, tracked, cache_dir,
+                                                    force=name in force))
+            return output[0]
+        return key, get
+    return stage
+
+
+def read_raw(config: dict):
+    """Reads the raw reviews."""
+    logger.info('Reading data...')
+    return data_loader.read_data(config['data_loader']['path'])
+
+
+def encode(user_split):
+    """One-hot encodes the categories of the user split."""
+    logger.info('Performing one-hot encoding...')
+    return eda.one_hot_encoding(user_split.copy())
+
+
+def split_train_test(final, train_test_config: dict):
+    """Splits the encoded data into train and test sets."""
+    logger.info('Splitting data into train and test sets...')
+    return model_training.train_test_data(final, train_test_config['test_size'],
+                                          train_test_config['random_state'],
+                                          train_test_config['training_cols'])
+
+
+def stream_data(config: dict, key: str, force_stream: bool, track):
+    """Streams the raw data through preprocessing and encoding unless already streamed."""
+    marker = DATA_BEFORE_TRAIN_PATH / '.stage_key'
+    if not force_stream and marker.exists() and marker.read_text(encoding='utf8') == key:
+        logger.info('Stage stream: using streamed output %s', key[:12])
+        return
+    logger.info('Streaming data through preprocessing and encoding...')
+    with track('stream'):
+        streaming.stream_preprocess(config['data_loader'], DATA_USER_SPLIT,
+                                    DATA_BEFORE_TRAIN_PATH, config['text_processing'])
+    marker.write_text(key, encoding='utf8')
+
+
+def encoded_data(config: dict, stage, chunked: bool, force_stream: bool, track):
+    """Declares the stages up to the encoded data, or streams it in chunks.
+
+    Returns:
+        tuple: The key of the encoded data and getters of the user split and
+        of the encoded data.
+    """
+    data_hash = stage_cache.hash_file(Path(config['data_loader']['path']))
+    # The outputs depend on how text is normalized, not on how many processes do it
+    normalization = {'text_processing': without_workers(config.get('text_processing')),
+                     'punctuation': text_processing.PUNCTUATION.pattern,
+                     'text_columns': eda.TEXT_COLUMNS}
+    if chunked:
+        encode_key = stage_cache.stage_key('stream', [data_hash],
+                                           [config['data_loader'], normalization])
+        stream_data(config, encode_key, force_stream, track)
+        # Mapped parts are copied once when concatenated instead of read and then copied
+        user_split = functools.cache(lambda: data_loader.read_frame(DATA_USER_SPLIT))
+        final = functools.cache(lambda: data_loader.read_frame(DATA_BEFORE_TRAIN_PATH))
+        return encode_key, user_split, final
+    read_key, raw = stage('read', [data_hash], config['data_loader'], lambda: read_raw(config))
+    preprocess_key, user_split = stage('preprocess', [read_key], normalization,
+                                       lambda: preprocess(raw(), config['text_processing']),
+                                       [raw])
+    encode_key, final = stage('encode', [preprocess_key], None, lambda: encode(user_split()),
+                              [user_split])
+    return encode_key, user_split, final
+
+
+def data_stages(config: dict, stage, chunked: bool, force_stream: bool, track) -> dict:
+    """Declares the data stages shared by training, evaluation and saving.
+
+    Returns:
+        dict: Getters of the user split, the encoded data ("final"), the
+        interactions and the train/test split, and the keys of the last two.
+    """
+    encode_key, user_split, final = encoded_data(config, stage, chunked, force_stream, track)
+    interactions_key, user_interactions = stage(
+        'interactions', [encode_key], None, lambda: interactions.build_interactions(final()),
+        [final])
+    split_key, train_test_data = stage(
+        'split', [encode_key], config['train_test_config'],
+        lambda: split_train_test(final(), config['train_test_config']), [final])
+    return {'user_split': user_split, 'final': final, 'interactions': user_interactions,
+            'split': train_test_data, 'interactions_key': interactions_key,
+            'split_key': split_key}
+
+
+def cf_stage(config: dict, stage, data: dict):
+    """Declares the SVD training stage and returns the getter of its model."""
+    cf_config = config['model_building'][0]['CF'][0]['model']
+
+    def train_cf():
+        logger.info('Training Collaborative Filtering model...')
+        # Encode the training split in the code space of the full data
+        train_interactions = interactions.build_interactions(
+            data['split']()[1], data['interactions']()['user_ids'],
+            data['interactions']()['product_ids'])
+        return model_training.collaborative_filtering(train_interactions,
+                                                      cf_config['params']['n_factors'],
+                                                      cf_config['params']['lr_all'],
+                                                      cf_config['params']['reg_all'],
+                                                      **cf_config['search'],
+                                                      report_file=CF_SEARCH_FILE)
+
+    # The search picks the same model on any number of processes, so worker
+    # counts stay out of the cache key
+    key_config = {**cf_config, 'search': without_workers(cf_config['search'])}
+    return stage('cf', [data['split_key'], data['interactions_key']], key_config, train_cf,
+                 [data['split'], data['interactions']])[1]
+
+
+def cbf_stage(config: dict, stage, data: dict, cache_dir: Path):
+    """Declares the content-based training stage and returns the getter of its model."""
+    cbf_config = config['model_building'][1]['CBF'][0]['model']
+    # The texts hash to the same counts and XGBoost grows the same trees on any
+    # number of processes or threads
+    key_config = dict(cbf_config)
+    for section in ('text_features', 'training'):
+        if section in cbf_config:
+            key_config[section] = without_workers(cbf_config[section])
+
+    def train_cbf():
+        logger.info('Training Content Based Filtering model...')
+        training = cbf_config.get('training')
+        feature_dir = None
+        if training and training.get('cache_features'):
+            feature_key = stage_cache.stage_key(
+                'cbf_features', [data['split_key']],
+                [cbf_config['numeric_params'], cbf_config['text_params'],
+                 key_config.get('text_features'), training['batch_rows']])
+            feature_dir = stage_cache.stage_dir('cbf_features', feature_key, cache_dir)
+        return model_training.content_base_filtering(cbf_config['numeric_params'],
+                                                     cbf_config['text_params'],
+                                                     data['split']()[1],
+                                                     training=training,
+                                                     feature_dir=feature_dir,
+                                                     text_features=cbf_config.get('text_features'))
+
+    return stage('cbf', [data['split_key']], key_config, train_cbf, [data['split']])[1]
+
+
+def index_stage(config: dict, models: dict, data: dict, track):
+    """Builds the top-N indexes; they are written straight to the artifacts on every run."""
+    logger.info('Building top-N recommendation indexes...')
+    resolve(data['final'], data['interactions'])
+    with track('index'):
+        build_indexes(models['cf'], models['cbf'], data['final'](), data['interactions'](),
+                      config['recommendation_index'])
+
+
+def evaluate_stage(config: dict, models: dict, data: dict, track):
+    """Evaluates the trained models on the test split and writes the report."""
+    logger.info('Evaluating models on the test split...')
+    resolve(data['final'], data['interactions'], data['split'])
+    with track('evaluate'):
+        report = evaluation.evaluate_models(models['cf'], models['cbf'],
+                                            data['split']()[1], data['split']()[2],
+                                            catalog=data['final'](),
+                                            user_interactions=data['interactions'](),
+                                            config=config['evaluation'])
+        evaluation.save_report(report, EVALUATION_FILE)
+
+
+def save_stage(config: dict, models: dict, data: dict, track, chunked: bool):
+    """Exports the models and publishes the data artifacts."""
+    logger.info('Saving models and data...')
+    resolve(data['final'], data['interactions'], data['split'],
+            *([] if chunked else [data['user_split']]))
+    with track('save'):
+        # Compact exports load without surprise or sklearn; pickles are optional
+        model_export.export_models(models['cf'], models['cbf'], CF_EXPORT_FILE, CBF_EXPORT_DIR)
+        keep_pickle = config['model_export']['keep_pickle']
+        if models['cbf'] is not None and keep_pickle:
+            save_artifacts.save_model(models['cbf'], CBF_MODEL_FILE)
+        if models['cf'] is not None and keep_pickle:
+            save_artifacts.save_model(models['cf'], CF_MODEL_FILE)
+        if models['cf'] is not None:
+            save_ann_index(models['cf'], data['final'](), config['ann_index'])
+        if not chunked:
+            save_artifacts.publish_columns(data['user_split'](), DATA_USER_SPLIT)
+            save_artifacts.publish_columns(data['final'](), DATA_BEFORE_TRAIN_PATH)
+        interactions.save_interactions(data['interactions'](), DATA_INTERACTIONS)
+        save_artifacts.publish_columns(data['split']()[1], TRAIN_DATA_PATH)
+        save_artifacts.publish_columns(data['split']()[2], TEST_DATA_PATH)
+        if models['cf'] is not None or models['cbf'] is not None:
+            incremental.write_version(MODEL_VERSION_FILE,
+                                      incremental.read_version(MODEL_VERSION_FILE),
+                                      'full', len(data['final']()))
+
+
+def upload_stage(config: dict, track):
+    """Uploads the artifacts to S3."""
+    logger.info('Uploading artifacts to AWS S3...')
+    with track('upload'):
+        aws_utils.upload_artifacts(aws_access_key,
+                                   aws_secret_access_key,
+                                   aws_region, artifacts,
+                                   config['aws'])
+    logger.info('Uploaded artifacts!')
+
+
+def run_pipeline(config: dict, cache_dir: Path, force: set, skip: set, *,
+                 chunked: bool = False, trace_memory: bool = False,
+                 profile_dir: Optional[Path] = None):
+    """Runs the pipeline stages, reusing cached outputs whose inputs are unchanged.
+
+    Args:
+        config (dict): The loaded pipeline config.
+        cache_dir (Path): Root directory of the stage cache.
+        force (set): Stages recomputed even when cached.
+        skip (set): Stages that are not run at all.
+        chunked (bool): Read, preprocess and encode the data chunk by chunk,
+            writing the user split and final data incrementally.
+        trace_memory (bool): Record each stage's peak allocation with tracemalloc.
+        profile_dir (Optional[Path]): Directory receiving a cProfile dump per stage.
+    """
+    track = functools.partial(metrics.track_stage, trace_memory=trace_memory,
+                              profile_dir=profile_dir)
+    stage = stage_runner(cache_dir, force, track)
+    data = data_stages(config, stage, chunked, 'stream' in force, track)
+    models = {'cf': None if 'cf' in skip else cf_stage(config, stage, data)(),
+              'cbf': None if 'cbf' in skip else cbf_stage(config, stage, data, cache_dir)()}
+
+    if 'index' not in skip:
+        index_stage(config, models, data, track)
+    if 'evaluate' not in skip and (models['cf'] is not None or models['cbf'] is not None):
+        evaluate_stage(config, models, data, track)
+    if 'save' not in skip:
+        save_stage(config, models, data, track, chunked)
+    metrics.write_metrics(METRICS_FILE)
+
+    if 'upload' not in skip:
+        upload_stage(config, track)
+        metrics.write_metrics(METRICS_FILE)
+
+
+def update_frames(config: dict, update_path: Path) -> dict:
+    """Preprocesses a batch of new reviews and appends it to the published data.
+
+    Returns:
+        dict: The new rows after user splitting ('new_split') and encoding
+        ('new_final'), and the extended frames ('user_split' and 'final').
+    """
+    new_split = preprocess(data_loader.read_data(update_path), config['text_processing'])
+    final = data_loader.read_frame(DATA_BEFORE_TRAIN_PATH, mmap=False)
+    prefix = 'first_category_'
+    categories = ({column[len(prefix):] for column in final if column.startswith(prefix)}
+                  | set(new_split['First_category'].dropna()))
+    new_final = eda.one_hot_encoding(new_split.copy(), list(categories))
+    final = pd.concat([final, new_final], ignore_index=True)
+    one_hot = [column for column in final if column.startswith(prefix)]
+    final[one_hot] = final[one_hot].fillna(0)
+    user_split = pd.concat([data_loader.read_frame(DATA_USER_SPLIT, mmap=False), new_split],
+                           ignore_index=True)
+    return {'new_split': new_split, 'new_final': new_final, 'user_split': user_split,
+            'final': eda.compact_frame(final)}
+
+
+def drift_report(cf_arrays: dict, new_final: pd.DataFrame, previous: Optional[dict],
+                 drift_config: dict) -> dict:
+    """Checks the new ratings against the drift thresholds and the last evaluation RMSE."""
+    baseline_rmse = None
+    if EVALUATION_FILE.exists():
+        with open(EVALUATION_FILE, encoding='utf8') as file:
+            baseline_rmse = json.load(file).get('cf', {}).get('rmse')
+    return incremental.check_drift(cf_arrays, new_final, previous, baseline_rmse, drift_config)
+
+
+def publish_update(config: dict, frames: dict, models: dict, *, previous: Optional[dict],
+                   report: dict):
+    """Saves the updated models, data, interactions and indexes as a new model version."""
+    final = frames['final']
+    user_interactions = interactions.build_interactions(final)
+    build_indexes(models['cf'], models['cbf'], final, user_interactions,
+                  config['recommendation_index'])
+    save_ann_index(models['cf'], final, config['ann_index'])
+    # The pickles stay the models of the last full retrain
+    model_export.save_svd(models['cf'], CF_EXPORT_FILE)
+    model_export.save_cbf_booster(models['cbf']['booster'], CBF_EXPORT_DIR)
+    # Replaces the streamed parts and stream marker too, as the data changed
+    save_artifacts.publish_columns(frames['user_split'], DATA_USER_SPLIT)
+    save_artifacts.publish_columns(final, DATA_BEFORE_TRAIN_PATH)
+    interactions.save_interactions(user_interactions, DATA_INTERACTIONS)
+    incremental.write_version(MODEL_VERSION_FILE, previous, 'incremental',
+                              len(frames['new_final']), report)
+
+
+def run_update(config: dict, update_path: Path, skip: set, force_update: bool = False) -> bool:
+    """Folds a batch of new reviews into the published models without retraining.
+
+    New users and items are folded into the SVD factors, the XGBoost booster
+    is trained for a few more rounds on the new rows, the data, interactions
+    and indexes are extended, and the result is published as a new model
+    version. When the new ratings cross a drift threshold, nothing is
+    published and a full retrain is requested instead.
+
+    Args:
+        config (dict): The loaded pipeline config.
+        update_path (Path): CSV of new reviews in the schema of the raw data.
+        skip (set): Steps that are not run; 'upload' is honoured.
+        force_update (bool): Publish the update even when a drift threshold is crossed.
+
+    Returns:
+        bool: Whether the update was published.
+    """
+    update_config = config['incremental']
+    with metrics.track_stage('update_preprocess'):
+        frames = update_frames(config, update_path)
+
+    cf_arrays = model_export.load_model_artifact(
+        model_export.preferred_artifact(CF_EXPORT_FILE, CF_MODEL_FILE))
+    if not isinstance(cf_arrays, dict):
+        cf_arrays = model_export.svd_arrays(cf_arrays)
+    previous = incremental.read_version(MODEL_VERSION_FILE)
+    report = drift_report(cf_arrays, frames['new_final'], previous, update_config['drift'])
+    logger.info('Drift of the new ratings: %s', report)
+    if report['retrain'] and not force_update:
+        logger.warning('Drift thresholds %s crossed, run a full retrain', report['exceeded'])
+        return False
+
+    with metrics.track_stage('update_models'):
+        models = {'cf': incremental.fold_in_svd(cf_arrays, frames['new_final'],
+                                                **update_config['svd'])}
+        if not CBF_EXPORT_DIR.exists():
+            model_export.export_models(None, model_export.load_model_artifact(CBF_MODEL_FILE),
+                                       CF_EXPORT_FILE, CBF_EXPORT_DIR)
+        models['cbf'] = incremental.continue_cbf(
+            model_export.load_cbf(CBF_EXPORT_DIR), frames['new_final'],
+            update_config['cbf_rounds'],
+            config['model_building'][1]['CBF'][0]['model'].get('training'))
+
+    with metrics.track_stage('update_publish'):
+        publish_update(config, frames, models, previous=previous, report=report)
+    metrics.write_metrics(METRICS_FILE)
+
+    if 'upload' not in skip:
+        logger.info('Uploading artifacts to AWS S3...')
+        aws_utils.upload_artifacts(aws_access_key, aws_secret_access_key, aws_region,
+                                   artifacts, config['aws'])
+    return True
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """Parses the pipeline command line."""
+    parser = argparse.ArgumentParser(description='Train the recommenders and save artifacts.')
+    parser.add_argument('--config', default=CONFIG_PATH,
+                        help='Path to the pipeline config file.')
+    parser.add_argument('--cache-dir', type=Path, default=CACHE_DIR,
+                        help='Directory holding cached stage outputs.')
+    parser.add_argument('--force', action='append', default=[], choices=STAGES + ['all'],
+                        help='Recompute a stage even if it is cached (repeatable).')
+    parser.add_argument('--skip', action='append', default=[], choices=SKIPPABLE_STAGES,
+                        help='Do not run a stage (repeatable).')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Preprocess the raw data in chunks of data_loader.chunksize rows.')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Record the peak Python allocation of each stage.')
+    parser.add_argument('--profile-dir', type=Path, default=None,
+                        help='Write a cProfile dump of each stage to this directory.')
+    parser.add_argument('--update', type=Path, default=None,
+                        help='Fold a CSV of new reviews into the published models instead '
+                             'of retraining; exits with status 2 when a full retrain is due.')
+    parser.add_argument('--force-update', action='store_true',
+                        help='Publish the update even when a drift threshold is crossed.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Entry point of the training pipeline."""
+    args = parse_args(argv)
+    config = load_config.load_config(Path(args.config))
+    if args.update is not None:
+        if not run_update(config, args.update, set(args.skip), args.force_update):
+            sys.exit(2)
+        return
+    force = set(STAGES) if 'all' in args.force else set(args.force)
+    run_pipeline(config, args.cache_dir, force, set(args.skip), chunked=args.streaming,
+                 trace_memory=args.trace_memory, profile_dir=args.profile_dir)
+
+
+if __name__ == '__main__':
+    main()
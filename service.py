@@ -0,0 +1,47 @@
+"""
+Recommendation Service
+This script loads the collaborative filtering and content-based filtering
+artifacts, reloads them when the pipeline publishes a new version, and
+serves batch recommendations over HTTP/JSON.
+"""
+
+import argparse
+import functools
+import logging
+import os
+from pathlib import Path
+from src.project_pipeline import load_config, service
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH = os.getenv('CONFIG_PATH', 'config/default.yaml')
+
+
+def main(argv=None):
+    """Entry point of the recommendation service."""
+    parser = argparse.ArgumentParser(description='Serve batch recommendations over HTTP.')
+    parser.add_argument('--config', default=CONFIG_PATH,
+                        help='Path to the pipeline config file.')
+    parser.add_argument('--artifacts', type=Path, default=Path('artifacts'),
+                        help='Directory containing the trained artifacts.')
+    args = parser.parse_args(argv)
+
+    config = load_config.load_config(Path(args.config))
+    cbf_config = config['model_building'][1]['CBF'][0]['model']
+    text_columns = cbf_config['text_params']
+    if isinstance(text_columns, str):
+        text_columns = [text_columns]
+
+    check_interval = config['registry']['check_interval_seconds']
+    load = functools.partial(service.load_recommenders, args.artifacts,
+                             [*cbf_config['numeric_params'], *text_columns],
+                             config['ann_index'], config.get('shared_artifacts'))
+    batchers = service.watch_recommenders(load, args.artifacts / service.VERSION_FILE,
+                                          config.get('batching'), check_interval)
+    service.serve(batchers, config['service'], check_interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+""" Module to build and search an approximate nearest-neighbor index over SVD item factors"""
+import logging
+from pathlib import Path
+from typing import List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from src.project_pipeline import cf_scoring, save_artifacts
+
+logger = logging.getLogger(__name__)
+
+ANN_FILES = ("centroids", "offsets", "vectors", "product_ids")
+
+
+def _assign(points: np.ndarray, centroids: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+    """Returns the nearest centroid of every point, computed in batches."""
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    assignments = np.empty(len(points), dtype=np.int64)
+    for start in range(0, len(points), batch_size):
+        batch = points[start:start + batch_size]
+        distances = centroid_norms[None, :] - 2 * batch @ centroids.T
+        assignments[start:start + batch_size] = distances.argmin(axis=1)
+    return assignments
+
+
+def _kmeans(points: np.ndarray, n_lists: int, n_iter: int, sample_size: int,
+            rng: np.random.Generator) -> np.ndarray:
+    """Fits k-means centroids with Lloyd iterations on a sample of the points."""
+    if len(points) > sample_size:
+        points = points[rng.choice(len(points), sample_size, replace=False)]
+    centroids = points[rng.choice(len(points), n_lists, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = _assign(points, centroids)
+        counts = np.bincount(assignments, minlength=n_lists)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, points)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty lists with random points so every list stays usable
+        centroids[~filled] = points[rng.choice(len(points), int((~filled).sum()))]
+    return centroids
+
+
+def build_ann_index(factors: dict, n_lists: Optional[int] = None, n_iter: int = 10,
+                    sample_size: Optional[int] = None,
+                    random_state: Optional[int] = None) -> dict:
+    """Builds an inverted-file (IVF) index over the item factors and biases.
+
+    A biased SVD ranks the items of a user by ``bi + pu . qi``, an inner
+    product between ``[pu, 1]`` and ``x_i = [qi, bi]``. Appending
+    ``sqrt(M^2 - |x_i|^2)``, where M is the largest item norm, gives every
+    item the same norm, so the largest inner product becomes the nearest
+    neighbour and k-means lists can be searched by centroid distance.
+
+    Args:
+        factors (dict): Output of ``cf_scoring.extract_svd_factors``.
+        n_lists (Optional[int]): Number of k-means lists; defaults to 4 * sqrt(n_items).
+        n_iter (int): Number of k-means iterations.
+        sample_size (Optional[int]): Items used to fit the centroids; defaults to 256 per list.
+        random_state (Optional[int]): Seed of the centroid initialisation.
+
+    Returns:
+        dict: Centroids, list offsets, item vectors and product ids, with items
+        stored contiguously per list.
+    """
+    items = np.hstack([factors["item_factors"],
+                       factors["item_biases"][:, None]]).astype(np.float32)
+    norms = np.einsum("ij,ij->i", items, items)
+    augmented = np.hstack([items, np.sqrt(np.maximum(norms.max() - norms, 0))[:, None]])
+
+    if n_lists is None:
+        n_lists = int(round(4 * np.sqrt(len(items))))
+    n_lists = max(1, min(n_lists, len(items)))
+    if sample_size is None:
+        sample_size = 256 * n_lists
+    rng = np.random.default_rng(random_state)
+    centroids = _kmeans(augmented, n_lists, n_iter, sample_size, rng)
+
+    assignments = _assign(augmented, centroids)
+    order = np.argsort(assignments, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=n_lists))])
+    logger.info("Built ANN index with %d lists over %d items", n_lists, len(items))
+    return {
+        "centroids": centroids.astype(np.float32),
+        "offsets": offsets.astype(np.int64),
+        "vectors": items[order],
+        "product_ids": factors["product_ids"][order],
+    }
+
+
+def save_ann_index(ann: dict, ann_dir: Path):
+    """Writes the ANN index as one .npy file per array so it can be memory-mapped.
+
+    Args:
+        ann (dict): Output of ``build_ann_index``.
+        ann_dir (Path): Directory where the index is written.
+    """
+    ann_dir.mkdir(exist_ok=True, parents=True)
+    for name in ANN_FILES:
+        array = ann[name]
+        if name == "product_ids":
+            array = np.asarray(array, dtype=str)
+        save_artifacts.save_array(array, ann_dir / f"{name}.npy")
+    logger.info("Saved ANN index to path %s successfully!", ann_dir)
+
+
+def load_ann_index(ann_dir: Path) -> Optional[dict]:
+    """Memory-maps an ANN index.
+
+    Args:
+        ann_dir (Path): Directory holding the index files.
+
+    Returns:
+        dict: The index arrays, or None when the index has not been built.
+    """
+    if not all((ann_dir / f"{name}.npy").exists() for name in ANN_FILES):
+        return None
+    return {name: np.load(ann_dir / f"{name}.npy", mmap_mode="r") for name in ANN_FILES}
+
+
+def search(ann: dict, queries: np.ndarray, k: int,
+           nprobe: int = 8) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Finds the items with the largest inner product with each query.
+
+    Only the ``nprobe`` lists whose centroids are nearest to a query are
+    scored, so a larger ``nprobe`` trades latency for recall.
+
+    Args:
+        ann (dict): Output of ``build_ann_index`` or ``load_ann_index``.
+        queries (np.ndarray): Matrix of shape (n_queries, n_factors + 1).
+        k (int): Number of items to return per query.
+        nprobe (int): Number of lists scored per query.
+
+    Returns:
+        List[Tuple[np.ndarray, np.ndarray]]: Per query, item positions and
+        inner products, best first.
+    """
+    centroids = np.asarray(ann["centroids"])
+    offsets = np.asarray(ann["offsets"])
+    queries = np.atleast_2d(queries).astype(np.float32)
+    # The queries have a zero last coordinate in the augmented space
+    distances = (np.einsum("ij,ij->i", centroids, centroids)[None, :]
+                 - 2 * queries @ centroids[:, :-1].T)
+    nprobe = max(1, min(nprobe, len(centroids)))
+    probes = np.argpartition(distances, nprobe - 1, axis=1)[:, :nprobe]
+
+    results = []
+    for query, lists in zip(queries, probes):
+        candidates = np.concatenate([np.arange(offsets[list_id], offsets[list_id + 1])
+                                     for list_id in lists])
+        scores = ann["vectors"][candidates] @ query
+        indices, top_scores = cf_scoring.top_k(scores, k)
+        results.append((candidates[indices[0]], top_scores[0]))
+    return results
+
+
+def _user_queries(factors: dict, user_ids: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the augmented query of every user and their bias.
+
+    The query is the user factors followed by a one that picks up the item
+    bias; unknown users have zero factors and bias.
+    """
+    n_factors = factors["user_factors"].shape[1]
+    inner_uids = cf_scoring.inner_user_ids(factors, user_ids)
+    known_user = inner_uids >= 0
+    queries = np.zeros((len(user_ids), n_factors + 1), dtype=np.float64)
+    queries[known_user, :n_factors] = factors["user_factors"][inner_uids[known_user]]
+    queries[:, n_factors] = 1.0
+    user_biases = np.zeros(len(user_ids), dtype=np.float64)
+    user_biases[known_user] = factors["user_biases"][inner_uids[known_user]]
+    return queries, user_biases
+
+
+def recommend_batch(factors: dict, ann: dict, user_ids: List[str], num_recs: int = 10,
+                    nprobe: int = 8) -> List[List[dict]]:
+    """Generates approximate collaborative filtering recommendations for many users.
+
+    Falls back to exact scoring for unbiased models, whose unknown items
+    score the global mean, and for an index built from a model of another shape.
+
+    Args:
+        factors (dict): Output of ``cf_scoring.extract_svd_factors``, for the user factors.
+        ann (dict): Output of ``build_ann_index`` or ``load_ann_index``.
+        user_ids (List[str]): The IDs of the users to recommend for.
+        num_recs (int): Number of recommendations per user.
+        nprobe (int): Number of lists scored per user.
+
+    Returns:
+        List[List[dict]]: Per user, dictionaries with "product_id" and "predicted_rating".
+    """
+    n_factors = factors["user_factors"].shape[1]
+    if not factors["biased"] or ann["vectors"].shape[1] != n_factors + 1:
+        return cf_scoring.recommend_batch(factors, user_ids, num_recs)
+
+    queries, user_biases = _user_queries(factors, user_ids)
+    lower_bound, higher_bound = factors["rating_scale"]
+    recommendations = []
+    for user_bias, (positions, scores) in zip(user_biases,
+                                              search(ann, queries, num_recs, nprobe)):
+        ratings = np.clip(factors["global_mean"] + user_bias + scores, lower_bound, higher_bound)
+        recommendations.append([{"product_id": ann["product_ids"][position],
+                                 "predicted_rating": float(rating)}
+                                for position, rating in zip(positions, ratings)])
+    return recommendations
+
+
+def recommend(factors: dict, ann: dict, user_id: str, num_recs: int = 10,
+              nprobe: int = 8) -> pd.DataFrame:
+    """Generates approximate collaborative filtering recommendations for one user.
+
+    Args:
+        factors (dict): Output of ``cf_scoring.extract_svd_factors``.
+        ann (dict): Output of ``build_ann_index`` or ``load_ann_index``.
+        user_id (str): The ID of the user for whom recommendations are generated.
+        num_recs (int): Number of recommendations to return.
+        nprobe (int): Number of lists scored.
+
+    Returns:
+        pd.DataFrame: Columns "product_id" and "predicted_rating", best first.
+    """
+    return pd.DataFrame(recommend_batch(factors, ann, [user_id], num_recs, nprobe)[0],
+                        columns=["product_id", "predicted_rating"])
@@ -1,10 +1,21 @@
 """ Module to connect to AWS"""
+import hashlib
+import json
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 import boto3
+from boto3.s3.transfer import TransferConfig
+from s3transfer.utils import ChunksizeAdjuster
+from src.project_pipeline import save_artifacts
 
 logger = logging.getLogger(__name__)
 
+MANIFEST_NAME = ".s3_manifest.json"
+MEGABYTE = 1024 * 1024
+
 def upload_artifacts(access_key, secret_key, region, artifacts: Path, config: dict) -> list:
     """Upload all the artifacts in the specified directory to S3.
     
@@ -28,16 +39,20 @@ def upload_artifacts(access_key, secret_key, region, artifacts: Path, config: di
     prefix = config["prefix"]
     s3_uris = []
 
+    if config.get("sync", False):
+        return sync_upload(s3_client, artifacts, bucket_name, prefix, config.get("transfer", {}))
+
     def upload_files(directory, prefix):
         for file_path in directory.iterdir():
+            if file_path.name == MANIFEST_NAME:
+                continue
             if file_path.is_file():
                 upload_file(file_path, prefix)
             elif file_path.is_dir():
                 upload_files(file_path, prefix)
 
     def upload_file(file_path, prefix):
-        experiment_id = file_path.parent.stem
-        s3_key = f"{prefix}_{experiment_id}/{file_path.name}"
+        s3_key = artifact_key(file_path, artifacts, prefix)
         try:
             s3_client.upload_file(str(file_path), bucket_name, s3_key)
         except (FileNotFoundError, OSError):
@@ -48,7 +63,24 @@ def upload_artifacts(access_key, secret_key, region, artifacts: Path, config: di
     upload_files(artifacts, prefix)
     return s3_uris
 
-def load_from_s3(access_key, secret_key, region, bucket_name, target_directories):
+def artifact_key(file_path: Path, artifacts: Path, prefix: str) -> str:
+    """Builds the S3 key of an artifact file.
+
+    Args:
+        file_path (Path): Local path of the artifact.
+        artifacts (Path): Root directory of the artifacts.
+        prefix (str): Key prefix from the aws config.
+
+    Returns:
+        str: The S3 key, keeping nested directories (e.g. per-model index folders).
+    """
+    relative_path = file_path.relative_to(artifacts)
+    if len(relative_path.parts) > 1:
+        return f"{prefix}_{relative_path.as_posix()}"
+    return f"{prefix}_{file_path.parent.stem}/{file_path.name}"
+
+def load_from_s3(access_key, secret_key, region, bucket_name, target_directories, *,
+                 transfer: Optional[dict] = None):
     """Downloads directories from specified prefixes within
     an S3 bucket to a local 'artifacts' folder,
     stripping the 'artifacts_' prefix from the directory names.
@@ -59,6 +91,8 @@ def load_from_s3(access_key, secret_key, region, bucket_name, target_directories
         region (str): AWS region.
         bucket_name (str): Name of the S3 bucket.
         target_directories (list): List of directory prefixes to include in the download.
+        transfer (dict): Optional transfer settings; when given, only changed
+            objects are downloaded, concurrently and atomically.
     """
     try:
         session = boto3.Session(
@@ -69,8 +103,11 @@ def load_from_s3(access_key, secret_key, region, bucket_name, target_directories
         s3_client = session.client("s3")
         base_directory = Path("s3_artifacts")
 
-        for prefix in target_directories:
-            download_files(s3_client, bucket_name, prefix, base_directory)
+        if transfer is not None:
+            sync_download(s3_client, bucket_name, target_directories, base_directory, transfer)
+        else:
+            for prefix in target_directories:
+                download_files(s3_client, bucket_name, prefix, base_directory)
 
         logger.info("All relevant files downloaded from S3")
 
@@ -88,9 +125,250 @@ def download_files(s3_client, bucket_name, prefix, base_directory):
 def download_file(s3_client, bucket_name, file_key, base_directory):
     """Download a file from S3."""
     if not file_key.endswith("/"):  # Skip directories
-        local_file_path = base_directory / (file_key[10:] if
-                                             file_key.startswith("artifacts_")
-                                             else file_key)
+        local_file_path = local_path(file_key, base_directory)
         local_file_path.parent.mkdir(parents=True, exist_ok=True)
         s3_client.download_file(bucket_name, file_key, str(local_file_path))
         logger.info("Downloaded and saved %s to %s", file_key, local_file_path)
+
+def local_path(file_key: str, base_directory: Path) -> Path:
+    """Maps an S3 key to its local path, stripping the 'artifacts_' prefix."""
+    return base_directory / (file_key[10:] if file_key.startswith("artifacts_") else file_key)
+
+def make_transfer_config(transfer: dict) -> TransferConfig:
+    """Builds the boto3 multipart transfer configuration.
+
+    Args:
+        transfer (dict): The 'transfer' section of the aws config.
+
+    Returns:
+        TransferConfig: Thread and multipart settings for each file transfer.
+    """
+    return TransferConfig(
+        multipart_threshold=transfer.get("multipart_threshold_mb", 8) * MEGABYTE,
+        multipart_chunksize=transfer.get("multipart_chunksize_mb", 8) * MEGABYTE,
+        max_concurrency=transfer.get("max_concurrency", 10),
+        use_threads=True,
+    )
+
+def file_etag(file_path: Path, transfer_config: TransferConfig) -> str:
+    """Computes the ETag S3 assigns to a file uploaded with the given config.
+
+    Single-part uploads get the MD5 of the content; multipart uploads get the
+    MD5 of the concatenated part digests followed by the number of parts,
+    using the part size s3transfer actually picks for the file.
+
+    Args:
+        file_path (Path): Local file to hash.
+        transfer_config (TransferConfig): Settings the file is uploaded with.
+
+    Returns:
+        str: The expected ETag, without quotes.
+    """
+    file_size = file_path.stat().st_size
+    chunksize = ChunksizeAdjuster().adjust_chunksize(transfer_config.multipart_chunksize,
+                                                     file_size)
+    part_digests = []
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunksize), b""):
+            part_digests.append(hashlib.md5(chunk))
+    if file_size < transfer_config.multipart_threshold:
+        return part_digests[0].hexdigest() if part_digests else hashlib.md5().hexdigest()
+    combined = hashlib.md5(b"".join(digest.digest() for digest in part_digests))
+    return f"{combined.hexdigest()}-{len(part_digests)}"
+
+def read_manifest(directory: Path) -> Dict[str, dict]:
+    """Reads the sync manifest of a local directory, or an empty one."""
+    manifest_path = directory / MANIFEST_NAME
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path, encoding="utf8") as file:
+        return json.load(file)
+
+def write_manifest(directory: Path, manifest: Dict[str, dict]):
+    """Writes the sync manifest of a local directory atomically."""
+    save_artifacts.save_json(manifest, directory / MANIFEST_NAME, sort_keys=True)
+
+def _is_current(entry: Optional[dict], file_path: Path) -> bool:
+    """Checks that a manifest entry still describes the file on disk."""
+    if entry is None or not file_path.exists():
+        return False
+    stat = file_path.stat()
+    return entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+
+def _manifest_entry(file_path: Path, etag: str) -> dict:
+    """Records size, modification time and ETag of a local file."""
+    stat = file_path.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "etag": etag}
+
+def list_objects(s3_client, bucket_name: str, prefixes: Iterable[str]) -> Dict[str, dict]:
+    """Lists the size and ETag of every object under the given prefixes.
+
+    Args:
+        s3_client: Boto3 S3 client.
+        bucket_name (str): Name of the S3 bucket.
+        prefixes (Iterable[str]): Key prefixes to list.
+
+    Returns:
+        Dict[str, dict]: Object key to its "size" and "etag".
+    """
+    objects = {}
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for prefix in prefixes:
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                if not obj["Key"].endswith("/"):
+                    objects[obj["Key"]] = {"size": obj["Size"], "etag": obj["ETag"].strip('"')}
+    return objects
+
+def _pending_uploads(artifacts: Path, prefix: str, remote: Dict[str, dict],
+                     transfer_config: TransferConfig) -> Tuple[List[tuple], Dict[str, dict]]:
+    """Finds the artifacts whose size or ETag differs from their S3 object.
+
+    Args:
+        artifacts (Path): Directory containing all the artifacts from a given experiment.
+        prefix (str): Key prefix from the aws config.
+        remote (Dict[str, dict]): Objects already in S3, from ``list_objects``.
+        transfer_config (TransferConfig): Settings the files are uploaded with.
+
+    Returns:
+        Tuple[List[tuple], Dict[str, dict]]: The (local path, S3 key) pairs to
+        upload, and the manifest of the files currently in ``artifacts``.
+    """
+    previous = read_manifest(artifacts)
+    pending, manifest = [], {}
+    for file_path in sorted(artifacts.rglob("*")):
+        if not file_path.is_file() or MANIFEST_NAME in file_path.name:
+            continue
+        relative = file_path.relative_to(artifacts).as_posix()
+        entry = previous.get(relative)
+        if not _is_current(entry, file_path):
+            entry = _manifest_entry(file_path, file_etag(file_path, transfer_config))
+        manifest[relative] = entry
+        s3_key = artifact_key(file_path, artifacts, prefix)
+        if remote.get(s3_key) != {"size": entry["size"], "etag": entry["etag"]}:
+            pending.append((file_path, s3_key))
+    return pending, manifest
+
+def sync_upload(s3_client, artifacts: Path, bucket_name: str, prefix: str,
+                transfer: dict) -> List[str]:
+    """Uploads the artifacts that differ from the objects already in S3.
+
+    Local ETags are cached in the manifest by size and modification time, so
+    unchanged files are neither re-hashed nor re-uploaded. The manifest is
+    rebuilt from the files found on each run, so deleted artifacts drop out.
+
+    Args:
+        s3_client: Boto3 S3 client.
+        artifacts (Path): Directory containing all the artifacts from a given experiment.
+        bucket_name (str): Name of the S3 bucket.
+        prefix (str): Key prefix from the aws config.
+        transfer (dict): The 'transfer' section of the aws config.
+
+    Returns:
+        List of S3 URIs for each file that was uploaded.
+    """
+    transfer_config = make_transfer_config(transfer)
+    remote = list_objects(s3_client, bucket_name, [f"{prefix}_"])
+    pending, manifest = _pending_uploads(artifacts, prefix, remote, transfer_config)
+
+    def upload(item):
+        file_path, s3_key = item
+        s3_client.upload_file(str(file_path), bucket_name, s3_key, Config=transfer_config)
+        logger.info("Uploaded %s to s3://%s/%s", file_path, bucket_name, s3_key)
+        return f"s3://{bucket_name}/{s3_key}"
+
+    with ThreadPoolExecutor(max_workers=transfer.get("max_workers", 8)) as executor:
+        s3_uris = list(executor.map(upload, pending))
+    write_manifest(artifacts, manifest)
+    logger.info("Uploaded %d files, %d unchanged", len(s3_uris),
+                len(manifest) - len(s3_uris))
+    return s3_uris
+
+def _local_files(directory: Path) -> Set[str]:
+    """Lists the files under a local directory, relative to it."""
+    if not directory.exists():
+        return set()
+    return {path.relative_to(directory).as_posix() for path in directory.rglob("*")
+            if path.is_file()}
+
+def _changed_keys(directory: Path, remote: Dict[str, tuple],
+                  entries: Dict[str, dict]) -> Dict[str, Optional[str]]:
+    """Maps each remote file of a directory to its object key, or to None when
+    the manifest shows the local copy already has the remote ETag."""
+    return {relative: None if _is_current(entries.get(relative), directory / relative)
+            and entries[relative]["etag"] == etag else file_key
+            for relative, (file_key, etag) in remote.items()}
+
+def _download_directory(s3_client, bucket_name: str, directory: Path,
+                        files: Dict[str, Optional[str]], transfer: dict):
+    """Writes a new version of a directory next to it and swaps it in.
+
+    Args:
+        s3_client: Boto3 S3 client.
+        bucket_name (str): Name of the S3 bucket.
+        directory (Path): Local directory the new version replaces.
+        files (Dict[str, Optional[str]]): Path relative to ``directory`` to the
+            key of its object, or None for a file unchanged since the last
+            download, which is hard-linked from ``directory`` instead.
+        transfer (dict): The 'transfer' section of the aws config.
+    """
+    transfer_config = make_transfer_config(transfer)
+    with save_artifacts.staged_dir(directory) as temp_dir:
+        def fetch(item):
+            relative, file_key = item
+            file_path = temp_dir / relative
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            if file_key is None:
+                os.link(directory / relative, file_path)
+            else:
+                s3_client.download_file(bucket_name, file_key, str(file_path),
+                                        Config=transfer_config)
+                logger.info("Downloaded %s to %s", file_key, directory / relative)
+
+        with ThreadPoolExecutor(max_workers=transfer.get("max_workers", 8)) as executor:
+            list(executor.map(fetch, files.items()))
+
+def sync_download(s3_client, bucket_name: str, prefixes: Iterable[str],
+                  base_directory: Path, transfer: dict) -> List[Path]:
+    """Mirrors the directories under the given prefixes, downloading only changed objects.
+
+    Each prefix names a directory, e.g. ``artifacts_Collaborative_Filtering``.
+    A directory that differs from S3 is rebuilt next to the local copy, with
+    unchanged files hard-linked and the others downloaded, then swapped in
+    whole with ``save_artifacts.staged_dir``. Readers never see a model of
+    one version next to the index of another, and objects deleted from S3
+    are deleted locally.
+
+    Args:
+        s3_client: Boto3 S3 client.
+        bucket_name (str): Name of the S3 bucket.
+        prefixes (Iterable[str]): Key prefixes of the directories to download.
+        base_directory (Path): Local directory receiving the files.
+        transfer (dict): The 'transfer' section of the aws config.
+
+    Returns:
+        List of local paths that were downloaded.
+    """
+    manifest = read_manifest(base_directory)
+    downloaded, listed = [], 0
+    for prefix in prefixes:
+        directory = local_path(prefix.rstrip("/"), base_directory)
+        directory_key = f"{directory.relative_to(base_directory).as_posix()}/"
+        remote = {local_path(file_key, base_directory).relative_to(directory).as_posix():
+                  (file_key, remote_object["etag"]) for file_key, remote_object
+                  in list_objects(s3_client, bucket_name, [f"{prefix.rstrip('/')}/"]).items()}
+        entries = {relative[len(directory_key):]: entry for relative, entry in manifest.items()
+                   if relative.startswith(directory_key)}
+        files = _changed_keys(directory, remote, entries)
+        if any(files.values()) or _local_files(directory) != set(files):
+            _download_directory(s3_client, bucket_name, directory, files, transfer)
+            downloaded += [directory / relative for relative, file_key in files.items() if file_key]
+
+        manifest = {relative: entry for relative, entry in manifest.items()
+                    if not relative.startswith(directory_key)}
+        manifest.update({f"{directory_key}{relative}": _manifest_entry(directory / relative, etag)
+                         for relative, (_, etag) in remote.items()})
+        write_manifest(base_directory, manifest)
+        listed += len(files)
+    logger.info("Downloaded %d files, %d unchanged", len(downloaded), listed - len(downloaded))
+    return downloaded
@@ -0,0 +1,138 @@
+""" Module to group concurrent recommendation requests into micro-batches scored together"""
+import logging
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional
+from src.project_pipeline import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    """Items of the requests grouped into one batch, and their results."""
+
+    def __init__(self):
+        self.items: List = []
+        self.enqueued: List[float] = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results: Optional[list] = None
+        self.error: Optional[BaseException] = None
+
+
+class MicroBatcher:
+    """Scores the requests that arrive within a short window in one call.
+
+    There is no scheduler thread. The first request of a batch leads it: it
+    waits up to ``window_seconds`` for other requests, or until the batch
+    holds ``max_batch_size`` items. It then closes the batch, scores every
+    item with one ``score_batch`` call and hands each request its slice of
+    the results. The other requests wait for the leader. Requests with
+    different keys, e.g. another number of recommendations, never share a
+    batch.
+
+    The wait of every request before its batch is scored, the number of
+    items per batch and the scoring time are observed in the
+    ``{name}_queue_wait_seconds``, ``{name}_batch_size`` and
+    ``{name}_batch_scoring_seconds`` histograms.
+    """
+
+    def __init__(self, score_batch: Callable[[Hashable, list], list],
+                 window_seconds: float = 0.005, max_batch_size: int = 64,
+                 name: str = "batch"):
+        """
+        Args:
+            score_batch (Callable[[Hashable, list], list]): Scores the items of a
+                batch sharing a key and returns one result per item, in order.
+            window_seconds (float): Longest wait of a leader for other requests.
+            max_batch_size (int): Most items per batch; 1 scores every request alone.
+            name (str): Prefix of the metric names.
+        """
+        self.score_batch = score_batch
+        self.window_seconds = window_seconds
+        self.max_batch_size = max(1, max_batch_size)
+        self.name = name
+        self._lock = threading.Lock()
+        self._open: Dict[Hashable, _Batch] = {}
+
+    def submit(self, items: list, key: Hashable = None) -> list:
+        """Scores the items of one request, together with concurrent requests.
+
+        Args:
+            items (list): Items of the request, e.g. user ids.
+            key (Hashable): Only requests with equal keys are batched together.
+
+        Returns:
+            list: One result per item, in order.
+        """
+        items = list(items)
+        if not items:
+            return []
+        with self._lock:
+            batch = self._open.get(key)
+            if batch is not None and len(batch.items) + len(items) > self.max_batch_size:
+                # Too large to join: the open batch is scored now and this request starts another
+                self._close(key, batch)
+                batch = None
+            leader = batch is None
+            if leader:
+                batch = self._open[key] = _Batch()
+            start = len(batch.items)
+            batch.items.extend(items)
+            batch.enqueued.append(time.perf_counter())
+            if len(batch.items) >= self.max_batch_size:
+                self._close(key, batch)
+
+        if leader:
+            batch.full.wait(self.window_seconds)
+            with self._lock:
+                self._close(key, batch)
+            self._score(key, batch)
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[start:start + len(items)]
+
+    def _close(self, key: Hashable, batch: _Batch):
+        """Stops a batch from taking more requests; call with the lock held."""
+        if self._open.get(key) is batch:
+            del self._open[key]
+        batch.full.set()
+
+    def _score(self, key: Hashable, batch: _Batch):
+        """Scores a closed batch and wakes the requests waiting for it."""
+        start = time.perf_counter()
+        for enqueued in batch.enqueued:
+            metrics.observe(f"{self.name}_queue_wait_seconds", start - enqueued)
+        metrics.observe(f"{self.name}_batch_size", len(batch.items), metrics.SIZE_BUCKETS)
+        try:
+            results = list(self.score_batch(key, batch.items))
+            if len(results) != len(batch.items):
+                raise ValueError(f"Scored {len(results)} results for {len(batch.items)} items")
+            batch.results = results
+        except Exception as error:  # pylint: disable=broad-except
+            logger.error("Failed to score a batch of %d items: %s", len(batch.items), error)
+            batch.error = error
+        finally:
+            metrics.observe(f"{self.name}_batch_scoring_seconds", time.perf_counter() - start)
+            batch.done.set()
+
+
+def from_config(score_batch: Callable[[Hashable, list], list], batching_config: Optional[dict],
+                name: str) -> MicroBatcher:
+    """Builds a batcher from the 'batching' section of the config.
+
+    Args:
+        score_batch (Callable[[Hashable, list], list]): See ``MicroBatcher``.
+        batching_config (Optional[dict]): Section with "enabled", "window_ms" and
+            "max_batch_size"; when missing or disabled every request is scored alone.
+        name (str): Prefix of the metric names.
+
+    Returns:
+        MicroBatcher: The batcher.
+    """
+    if not batching_config or not batching_config.get("enabled", True):
+        return MicroBatcher(score_batch, 0.0, 1, name)
+    return MicroBatcher(score_batch, batching_config["window_ms"] / 1000,
+                        batching_config["max_batch_size"], name)
@@ -0,0 +1,151 @@
+""" Module to cache product-level features and scores of the content-based model"""
+import logging
+from typing import List, Optional
+import numpy as np
+import pandas as pd
+from src.project_pipeline import cf_scoring, interactions, model_export
+
+logger = logging.getLogger(__name__)
+
+
+def feature_columns(pipeline) -> List[str]:
+    """Lists the input columns consumed by the pipeline's ColumnTransformer.
+
+    Args:
+        pipeline: The trained content-based filtering pipeline, or its export
+            loaded by ``model_export.load_cbf``.
+
+    Returns:
+        List[str]: Column names used by the fitted transformers.
+    """
+    if isinstance(pipeline, dict):
+        return model_export.cbf_columns(pipeline)
+    columns = []
+    for name, transformer, transformer_columns in pipeline.named_steps["preprocessor"].transformers_:
+        if name == "remainder" or transformer == "drop":
+            continue
+        if isinstance(transformer_columns, str):
+            columns.append(transformer_columns)
+        else:
+            columns.extend(transformer_columns)
+    return columns
+
+
+def _rated_positions_by_user(df_with_one_hot: pd.DataFrame, product_ids: pd.Index) -> dict:
+    """Groups the store positions of the rated products by user, for data without interactions."""
+    user_codes, user_ids = pd.factorize(df_with_one_hot["user_id"])
+    rated_codes = product_ids.get_indexer(df_with_one_hot["product_id"])
+    order = np.argsort(user_codes, kind="stable")
+    splits = np.cumsum(np.bincount(user_codes, minlength=len(user_ids)))[:-1]
+    return dict(zip(user_ids, np.split(rated_codes[order], splits)))
+
+
+def build_feature_store(pipeline, df_with_one_hot: pd.DataFrame,
+                        user_interactions: Optional[dict] = None) -> dict:
+    """Precomputes the content-based features and scores of every product.
+
+    Rows are deduplicated on the product and the columns the model reads, so
+    each distinct feature row goes through the TF-IDF transform and XGBoost
+    once. A product's score is its best row score, as in the live app path.
+
+    Args:
+        pipeline: The trained content-based filtering pipeline, or its export
+            loaded by ``model_export.load_cbf``.
+        df_with_one_hot (pd.DataFrame): Encoded data holding the product catalog.
+        user_interactions (Optional[dict]): Integer-coded interactions used to look
+            up rated products; without them the ratings are grouped from the data.
+
+    Returns:
+        dict: Product ids, transformed feature rows, their product positions,
+        per-product scores and the rated products of each user.
+    """
+    columns = feature_columns(pipeline)
+    rows = df_with_one_hot[["product_id"] + [col for col in columns if col != "product_id"]]
+    rows = rows.drop_duplicates(ignore_index=True)
+
+    product_codes, product_ids = pd.factorize(rows["product_id"])
+    if isinstance(pipeline, dict):
+        features = model_export.cbf_transform(pipeline, rows)
+        row_scores = model_export.cbf_predict(pipeline, features)
+    else:
+        features = pipeline.named_steps["preprocessor"].transform(rows)
+        row_scores = pipeline.named_steps["xgb_model"].predict(features)
+
+    product_scores = np.full(len(product_ids), -np.inf)
+    np.maximum.at(product_scores, product_codes, row_scores)
+
+    store = {
+        "product_ids": np.asarray(product_ids, dtype=object),
+        "row_products": product_codes,
+        "features": features,
+        "product_scores": product_scores,
+    }
+    if user_interactions is not None:
+        store["interactions"] = user_interactions
+        store["code_positions"] = product_ids.get_indexer(
+            np.asarray(user_interactions["product_ids"]))
+    else:
+        store["rated"] = _rated_positions_by_user(df_with_one_hot, product_ids)
+
+    logger.info("Built content-based feature store with %d rows for %d products",
+                len(rows), len(product_ids))
+    return store
+
+
+def store_users(store: dict) -> np.ndarray:
+    """Returns the ids of every user with ratings in the feature store."""
+    if "interactions" in store:
+        indptr = np.asarray(store["interactions"]["indptr"])
+        return np.asarray(store["interactions"]["user_ids"])[np.diff(indptr) > 0].astype(object)
+    return np.asarray(list(store["rated"]), dtype=object)
+
+
+def rated_positions(store: dict, user_id: str) -> np.ndarray:
+    """Returns the store positions of the products a user rated.
+
+    Args:
+        store (dict): Output of ``build_feature_store``.
+        user_id (str): The ID of the user.
+
+    Returns:
+        np.ndarray: Positions in ``store["product_ids"]``, empty for an unknown user.
+    """
+    if "interactions" in store:
+        codes, _ = interactions.user_items(store["interactions"], user_id)
+        positions = store["code_positions"][codes]
+        return positions[positions >= 0]
+    return store["rated"].get(user_id, np.empty(0, dtype=np.int64))
+
+
+def recommend(store: dict, user_id: str, num_recs: int = 10) -> list:
+    """Generates content-based recommendations from the cached product scores.
+
+    Args:
+        store (dict): Output of ``build_feature_store``.
+        user_id (str): The ID of the user for whom recommendations are generated.
+        num_recs (int): Number of recommendations to return.
+
+    Returns:
+        list: Recommendation dictionaries with "product_id" and "predicted_rating".
+    """
+    return recommend_batch(store, [user_id], num_recs)[0]
+
+
+def recommend_batch(store: dict, user_ids: List[str], num_recs: int = 10) -> List[list]:
+    """Generates content-based recommendations for many users at once.
+
+    Args:
+        store (dict): Output of ``build_feature_store``.
+        user_ids (List[str]): The IDs of the users to recommend for.
+        num_recs (int): Number of recommendations per user.
+
+    Returns:
+        List[list]: Per user, dictionaries with "product_id" and "predicted_rating".
+    """
+    scores = np.tile(store["product_scores"], (len(user_ids), 1))
+    for row, user_id in enumerate(user_ids):
+        scores[row, rated_positions(store, user_id)] = -np.inf
+    indices, values = cf_scoring.top_k(scores, num_recs)
+    return [[{"product_id": store["product_ids"][index], "predicted_rating": float(value)}
+             for index, value in zip(row_indices, row_values) if np.isfinite(value)]
+            for row_indices, row_values in zip(indices, values)]
@@ -0,0 +1,198 @@
+""" Module to score collaborative filtering recommendations with NumPy"""
+import logging
+from typing import Iterable, List, Tuple
+import numpy as np
+import pandas as pd
+from src.project_pipeline import model_export
+
+logger = logging.getLogger(__name__)
+
+
+def extract_svd_factors(model, product_ids: Iterable) -> dict:
+    """Pulls the factors of a trained surprise SVD model into NumPy arrays
+    aligned with the product catalog.
+
+    Catalog products that the model never saw during training get zero
+    factors and a zero bias, which reproduces how ``SVD.predict`` scores
+    unknown items.
+
+    Args:
+        model (SVD): Trained surprise SVD model, or its parameters as
+            returned by ``model_export.svd_arrays`` or ``model_export.load_svd``.
+        product_ids (Iterable): Product ids of the catalog to score.
+
+    Returns:
+        dict: Factor arrays and id maps used by the scoring functions.
+    """
+    arrays = model if isinstance(model, dict) else model_export.svd_arrays(model)
+    catalog = np.asarray([str(product_id) for product_id in product_ids], dtype=object)
+    # Inner ids without ratings have an empty raw id and stay unknown
+    trained_iids = np.flatnonzero(arrays["item_ids"] != "")
+    positions = pd.Index(arrays["item_ids"][trained_iids]).get_indexer(catalog)
+    item_known = positions >= 0
+    inner_iids = trained_iids[positions]
+
+    item_factors = np.zeros((len(catalog), arrays["qi"].shape[1]), dtype=np.float64)
+    item_biases = np.zeros(len(catalog), dtype=np.float64)
+    item_factors[item_known] = arrays["qi"][inner_iids[item_known]]
+    item_biases[item_known] = arrays["bi"][inner_iids[item_known]]
+
+    # Sorted raw ids and their inner ids: a binary search replaces a per-process dict
+    trained_uids = np.flatnonzero(arrays["user_ids"] != "")
+    raw_uids = np.asarray(arrays["user_ids"][trained_uids], dtype=str)
+    order = np.argsort(raw_uids, kind="stable")
+
+    return {
+        "product_ids": catalog,
+        "item_factors": item_factors,
+        "item_biases": item_biases,
+        "item_known": item_known,
+        "user_ids": raw_uids[order],
+        "user_inner_ids": trained_uids[order],
+        "user_factors": arrays["pu"],
+        "user_biases": arrays["bu"],
+        "global_mean": arrays["global_mean"],
+        "rating_scale": arrays["rating_scale"],
+        "biased": arrays["biased"],
+    }
+
+
+def inner_user_ids(factors: dict, user_ids: Iterable) -> np.ndarray:
+    """Maps raw user ids to the model's inner ids, -1 for unknown users.
+
+    Args:
+        factors (dict): Output of ``extract_svd_factors``.
+        user_ids (Iterable): Raw user ids.
+
+    Returns:
+        np.ndarray: Inner id of every user.
+    """
+    user_ids = np.asarray(user_ids if isinstance(user_ids, (np.ndarray, pd.Series))
+                          else list(user_ids), dtype=str)
+    known_ids = factors["user_ids"]
+    if len(known_ids) == 0 or len(user_ids) == 0:
+        return np.full(len(user_ids), -1, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(known_ids, user_ids), len(known_ids) - 1)
+    return np.where(known_ids[positions] == user_ids,
+                    np.asarray(factors["user_inner_ids"])[positions], -1).astype(np.int64)
+
+
+def score_users(factors: dict, user_ids: Iterable) -> np.ndarray:
+    """Scores every catalog product for a batch of users.
+
+    Mirrors ``SVD.predict``: unknown users fall back to the global mean
+    plus the item bias (or the global mean alone for an unbiased model),
+    and every estimate is clipped to the rating scale.
+
+    Args:
+        factors (dict): Output of ``extract_svd_factors``.
+        user_ids (Iterable): Raw user ids to score.
+
+    Returns:
+        np.ndarray: Matrix of shape (n_users, n_products) with predicted ratings.
+    """
+    inner_uids = inner_user_ids(factors, user_ids)
+    known_user = inner_uids >= 0
+    n_factors = factors["item_factors"].shape[1]
+
+    user_vectors = np.zeros((len(inner_uids), n_factors), dtype=np.float64)
+    user_vectors[known_user] = factors["user_factors"][inner_uids[known_user]]
+    scores = user_vectors @ factors["item_factors"].T
+
+    if factors["biased"]:
+        user_biases = np.zeros(len(inner_uids), dtype=np.float64)
+        user_biases[known_user] = factors["user_biases"][inner_uids[known_user]]
+        scores += factors["global_mean"] + user_biases[:, None] + factors["item_biases"][None, :]
+    else:
+        impossible = ~(known_user[:, None] & factors["item_known"][None, :])
+        scores[impossible] = factors["global_mean"]
+
+    lower_bound, higher_bound = factors["rating_scale"]
+    return np.clip(scores, lower_bound, higher_bound, out=scores)
+
+
+def top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Selects the k best-scored columns of each row with a partial sort.
+
+    Args:
+        scores (np.ndarray): Matrix of shape (n_users, n_products).
+        k (int): Number of items to keep per row.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Column indices and scores of the top k,
+        ordered from best to worst.
+    """
+    scores = np.atleast_2d(scores)
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    return (np.take_along_axis(candidates, order, axis=1),
+            np.take_along_axis(candidate_scores, order, axis=1))
+
+
+def recommend(factors: dict, user_id: str, num_recs: int = 10) -> pd.DataFrame:
+    """Generates the top collaborative filtering recommendations for one user.
+
+    Args:
+        factors (dict): Output of ``extract_svd_factors``.
+        user_id (str): The ID of the user for whom recommendations are generated.
+        num_recs (int): Number of recommendations to return.
+
+    Returns:
+        pd.DataFrame: Columns "product_id" and "predicted_rating", best first.
+    """
+    indices, scores = top_k(score_users(factors, [user_id]), num_recs)
+    return pd.DataFrame({"product_id": factors["product_ids"][indices[0]],
+                         "predicted_rating": scores[0]})
+
+
+def recommend_batch(factors: dict, user_ids: List[str], num_recs: int = 10) -> List[List[dict]]:
+    """Generates collaborative filtering recommendations for many users at once.
+
+    Args:
+        factors (dict): Output of ``extract_svd_factors``.
+        user_ids (List[str]): The IDs of the users to score in one matrix product.
+        num_recs (int): Number of recommendations per user.
+
+    Returns:
+        List[List[dict]]: Per user, dictionaries with "product_id" and "predicted_rating".
+    """
+    indices, scores = top_k(score_users(factors, user_ids), num_recs)
+    return [[{"product_id": factors["product_ids"][index], "predicted_rating": float(score)}
+             for index, score in zip(row_indices, row_scores)]
+            for row_indices, row_scores in zip(indices, scores)]
+
+
+def score_pairs(factors: dict, user_ids: Iterable, positions: np.ndarray) -> np.ndarray:
+    """Predicts the rating of many (user, product) pairs at once.
+
+    Args:
+        factors (dict): Output of ``extract_svd_factors``.
+        user_ids (Iterable): Raw user id of each pair.
+        positions (np.ndarray): Catalog position of the product of each pair.
+
+    Returns:
+        np.ndarray: Predicted ratings, as ``SVD.predict`` would estimate them.
+    """
+    inner_uids = inner_user_ids(factors, user_ids)
+    known_user = inner_uids >= 0
+    positions = np.asarray(positions, dtype=np.int64)
+
+    user_vectors = np.zeros((len(inner_uids), factors["item_factors"].shape[1]),
+                            dtype=np.float64)
+    user_vectors[known_user] = factors["user_factors"][inner_uids[known_user]]
+    scores = np.einsum("ij,ij->i", user_vectors, factors["item_factors"][positions])
+
+    if factors["biased"]:
+        user_biases = np.zeros(len(inner_uids), dtype=np.float64)
+        user_biases[known_user] = factors["user_biases"][inner_uids[known_user]]
+        scores += factors["global_mean"] + user_biases + factors["item_biases"][positions]
+    else:
+        scores[~(known_user & factors["item_known"][positions])] = factors["global_mean"]
+
+    lower_bound, higher_bound = factors["rating_scale"]
+    return np.clip(scores, lower_bound, higher_bound, out=scores)
@@ -1,7 +1,11 @@
 """ Module to read data"""
+import json
 from pathlib import Path
 import logging
+from typing import Dict, Iterator, List, Optional
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 
 logger = logging.getLogger(__name__)
 
@@ -12,3 +16,114 @@ def read_data(file_path: Path):
     data= pd.read_csv(file_path)
     logger.info("Get data successfully from the %s", file_path)
     return data
+
+
+def read_data_chunks(file_path: Path,
+                     chunksize: int,
+                     usecols: Optional[List[str]] = None,
+                     dtype: Optional[Dict[str, str]] = None) -> Iterator[pd.DataFrame]:
+    """Streams a CSV file in chunks with explicit columns and dtypes.
+
+    Args:
+        file_path (Path): Path to file to be read.
+        chunksize (int): Number of rows per chunk.
+        usecols (Optional[List[str]]): Columns to read; all columns when None.
+        dtype (Optional[Dict[str, str]]): Dtype of each column, skipping inference.
+
+    Yields:
+        pd.DataFrame: Consecutive chunks of the file.
+    """
+    with pd.read_csv(file_path, chunksize=chunksize, usecols=usecols, dtype=dtype) as reader:
+        for number, chunk in enumerate(reader):
+            logger.debug("Read chunk %d with %d rows from %s", number, len(chunk), file_path)
+            yield chunk
+
+
+def _load_column(data_dir: Path, entry: dict, mmap_mode: Optional[str], as_category: bool):
+    """Loads one column of a ``read_columns`` directory, decoding strings unless asked not to."""
+    values = np.load(data_dir / entry["file"], mmap_mode=mmap_mode)
+    if entry["kind"] == "numeric":
+        return values
+    categories = np.load(data_dir / entry["categories"]).astype(object)
+    if entry["kind"] == "category" or as_category:
+        return pd.Categorical.from_codes(values, categories, ordered=entry.get("ordered", False))
+    decoded = categories.take(values)
+    decoded[values < 0] = np.nan
+    return decoded
+
+
+def read_columns(data_dir: Path,
+                 columns: Optional[List[str]] = None,
+                 mmap: bool = True,
+                 as_category: bool = False) -> pd.DataFrame:
+    """Reads a directory written by ``save_artifacts.save_columns``.
+
+    Args:
+        data_dir (Path): Directory holding the .npy columns and schema.json.
+        columns (Optional[List[str]]): Columns to load; all columns when None.
+        mmap (bool): Memory-map the column files instead of reading them.
+        as_category (bool): Return dictionary-encoded string columns as
+            categoricals built on the stored codes instead of materializing them.
+
+    Returns:
+        pd.DataFrame: The requested columns, with their original dtypes.
+    """
+    with open(data_dir / "schema.json", encoding="utf8") as file:
+        schema = json.load(file)
+    mmap_mode = "r" if mmap else None
+    entries = {entry["name"]: entry for entry in schema["columns"]}
+    names = list(entries) if columns is None else columns
+
+    data, dtypes = {}, {}
+    for name in names:
+        data[name] = _load_column(data_dir, entries[name], mmap_mode, as_category)
+        if entries[name]["kind"] == "dictionary" and not as_category:
+            dtypes[name] = entries[name]["dtype"]
+
+    index = None
+    if schema["index"] is not None:
+        index = np.load(data_dir / schema["index"], mmap_mode=mmap_mode)
+    frame = pd.DataFrame(data, index=index, columns=names, copy=False).astype(dtypes)
+    logger.info("Get %d columns successfully from the %s", len(names), data_dir)
+    return frame
+
+
+def _concat_parts(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenates chunks, merging the categories each chunk was encoded with.
+
+    ``pd.concat`` turns categoricals with different categories into objects,
+    so unordered categorical columns are merged with ``union_categoricals``.
+    """
+    data = {}
+    for name in frames[0].columns:
+        chunks = [frame[name] for frame in frames]
+        if all(isinstance(chunk.dtype, pd.CategoricalDtype) and not chunk.cat.ordered
+               for chunk in chunks):
+            data[name] = union_categoricals(chunks)
+        else:
+            data[name] = pd.concat(chunks, ignore_index=True)
+    return pd.DataFrame(data, columns=frames[0].columns)
+
+
+def read_frame(data_path: Path, columns: Optional[List[str]] = None, **kwargs) -> pd.DataFrame:
+    """Reads a data artifact, preferring the columnar directory over the pickle.
+
+    Directories written in chunks (``part-*`` subdirectories) are concatenated,
+    keeping categorical columns categorical.
+
+    Args:
+        data_path (Path): Artifact path with or without its .pkl suffix.
+        columns (Optional[List[str]]): Columns to load; all columns when None.
+        **kwargs: Extra options passed to ``read_columns``.
+
+    Returns:
+        pd.DataFrame: The loaded data.
+    """
+    data_dir = data_path.with_suffix("")
+    if (data_dir / "schema.json").exists():
+        return read_columns(data_dir, columns, **kwargs)
+    parts = sorted(data_dir.glob("part-*"))
+    if parts:
+        return _concat_parts([read_columns(part, columns, **kwargs) for part in parts])
+    data = pd.read_pickle(data_dir.with_suffix(".pkl"))
+    return data if columns is None else data[columns]
@@ -1,22 +1,30 @@
 """ Module to perform EDA"""
-from typing import Tuple
+from typing import Iterable, Iterator, List, Optional, Tuple
+import numpy as np
 import pandas as pd
+from src.project_pipeline import text_processing
 
+# Text columns normalized by ``data_preprocess`` and the punctuation they keep:
+# review titles keep the commas ``split_users_frame`` splits them on
+TEXT_COLUMNS = {'about_product': '', 'review_title': ',', 'review_content': ''}
 
-def data_preprocess(data: pd.DataFrame) -> pd.DataFrame:
+
+def data_preprocess(data: pd.DataFrame, n_jobs: int = 1, shard_rows: int = 50000) -> pd.DataFrame:
     """Preprocesses the input DataFrame.
 
     Args:
         data (pd.DataFrame): Input DataFrame to be preprocessed.
+        n_jobs (int): Number of processes normalizing the text, -1 for one per CPU.
+        shard_rows (int): Number of rows normalized per process task.
 
     Returns:
         pd.DataFrame: Preprocessed DataFrame.
     """
     data.fillna(value=pd.NA, inplace=True)  # Fill missing values with 'NA'
     data['discounted_price'] = data['discounted_price'].str.replace(
-        '₹', '').str.replace(',', '').astype(float)
+        '[₹,]', '', regex=True).astype(float)
     data['actual_price'] = data['actual_price'].str.replace(
-        '₹', '').str.replace(',', '').astype(float)
+        '[₹,]', '', regex=True).astype(float)
 
     data['rating'] = pd.to_numeric(data['rating'], errors='coerce')
     data.dropna(inplace=True)
@@ -26,11 +34,7 @@ def data_preprocess(data: pd.DataFrame) -> pd.DataFrame:
 
     data['discount_percentage'] = data['discount_percentage'].str.rstrip('%').astype(float)
 
-    data['about_product'] = data['about_product'].str.replace(r'[^\w\s]', '').str.lower()
-    data['review_title'] = data['review_title'].str.replace(r'[^\w\s]', '').str.lower()
-    data['review_content'] = data['review_content'].str.replace(r'[^\w\s]', '').str.lower()
-
-    return data
+    return text_processing.normalize_columns(data, TEXT_COLUMNS, n_jobs, shard_rows)
 
 
 def split_users(row: pd.Series) -> pd.DataFrame:
@@ -55,6 +59,34 @@ def split_users(row: pd.Series) -> pd.DataFrame:
     return pd.DataFrame(rows)
 
 
+def split_users_frame(data: pd.DataFrame) -> pd.DataFrame:
+    """Column-wise version of ``split_users`` applied to every row of a DataFrame.
+
+    The comma-separated user columns are split and exploded together, and
+    like ``zip`` only as many users as the shortest list are kept per row.
+
+    Args:
+        data (pd.DataFrame): Input DataFrame containing user information.
+
+    Returns:
+        pd.DataFrame: DataFrame with each user information split into separate rows.
+    """
+    split_columns = ['user_id', 'user_name', 'review_title']
+    data = data.reset_index(drop=True)
+
+    exploded = []
+    for column in split_columns:
+        values = data[column].str.split(',').explode()
+        position = values.groupby(level=0).cumcount()
+        exploded.append(values.set_axis(pd.MultiIndex.from_arrays([values.index, position])))
+    users = pd.concat(exploded, axis=1, join='inner', keys=split_columns).sort_index()
+
+    result = data.drop(columns=split_columns).take(users.index.get_level_values(0))
+    for column in split_columns:
+        result[column] = users[column].to_numpy()
+    return result[data.columns].reset_index(drop=True)
+
+
 def extract_first_last(category: str) -> Tuple[str, str]:
     """Extracts the first and last items from a string of categories separated by '|'.
 
@@ -70,17 +102,60 @@ def extract_first_last(category: str) -> Tuple[str, str]:
     return first_item, last_item
 
 
-def one_hot_encoding(data: pd.DataFrame) -> pd.DataFrame:
+def extract_categories(data: pd.DataFrame) -> pd.DataFrame:
+    """Column-wise version of ``extract_first_last`` for the 'category' column.
+
+    Args:
+        data (pd.DataFrame): Input DataFrame with a 'category' column.
+
+    Returns:
+        pd.DataFrame: DataFrame with 'First_category' and 'Last_category' columns added.
+    """
+    data['First_category'] = data['category'].str.partition('|')[0]
+    data['Last_category'] = data['category'].str.rpartition('|')[2]
+    return data
+
+
+def preprocess_chunks(chunks: Iterable[pd.DataFrame], n_jobs: int = 1,
+                      shard_rows: int = 50000) -> Iterator[pd.DataFrame]:
+    """Preprocesses, splits users and extracts categories chunk by chunk.
+
+    Args:
+        chunks (Iterable[pd.DataFrame]): Raw data chunks.
+        n_jobs (int): Number of processes normalizing the text of a chunk.
+        shard_rows (int): Number of rows normalized per process task.
+
+    Yields:
+        pd.DataFrame: One row per user review, with first and last category.
+    """
+    for chunk in chunks:
+        data = split_users_frame(data_preprocess(chunk, n_jobs, shard_rows))
+        data = extract_categories(data)
+        data.drop('category', axis=1, inplace=True)
+        yield data
+
+
+def one_hot_encoding(data: pd.DataFrame,
+                     categories: Optional[List[str]] = None,
+                     compact: bool = True) -> pd.DataFrame:
     """Performs one-hot encoding on the 'First_category' column of the DataFrame.
 
     Args:
         data (pd.DataFrame): Input DataFrame.
+        categories (Optional[List[str]]): Full list of first categories, so that
+            chunks encoded separately get the same columns.
+        compact (bool): Return the frame in the representation of ``compact_frame``.
 
     Returns:
         pd.DataFrame: DataFrame with one-hot encoded 'First_category' column.
     """
     data.drop(columns=['product_name', 'img_link', 'product_link'], inplace=True)
-    one_hot_encoded = pd.get_dummies(data['First_category'], prefix='first_category')
+    first_category = data['First_category']
+    if categories is not None:
+        first_category = pd.Series(pd.Categorical(first_category, categories=sorted(categories)),
+                                   index=data.index)
+    one_hot_encoded = pd.get_dummies(first_category, prefix='first_category',
+                                     dtype=np.uint8 if compact else bool)
 
     # Concatenate one-hot encoded columns with the original dataframe
     data_with_one_hot = pd.concat([data.drop(columns=['First_category',
@@ -91,4 +166,56 @@ def one_hot_encoding(data: pd.DataFrame) -> pd.DataFrame:
                                                     'actual_price',
                                                     'review_content']),
                                  one_hot_encoded], axis=1)
-    return data_with_one_hot
+    return compact_frame(data_with_one_hot) if compact else data_with_one_hot
+
+
+def compact_frame(data: pd.DataFrame) -> pd.DataFrame:
+    """Converts a frame to a compact representation without changing its values.
+
+    String columns (ids, names and review titles) become categoricals, so
+    each distinct string is stored once and rows hold integer codes. Boolean
+    columns become uint8. Integral numeric columns are downcast to the
+    smallest integer type that holds them. Fractional floats stay float64,
+    because scikit-learn keeps float32 inputs in float32 and the model
+    features would change.
+
+    Args:
+        data (pd.DataFrame): Input DataFrame.
+
+    Returns:
+        pd.DataFrame: The compact DataFrame.
+    """
+    columns = {}
+    for column in data.columns:
+        series = data[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            columns[column] = series
+        elif pd.api.types.is_bool_dtype(series):
+            columns[column] = series.astype(np.uint8)
+        elif pd.api.types.is_numeric_dtype(series):
+            values = series.to_numpy()
+            if (series.dtype.kind in 'iu'
+                    or (series.notna().all() and np.array_equal(values, np.round(values)))):
+                downcast = pd.to_numeric(series.astype(np.int64),
+                                         downcast='unsigned' if (values >= 0).all() else 'integer')
+                columns[column] = downcast if np.array_equal(downcast, values) else series
+            else:
+                columns[column] = series
+        else:
+            columns[column] = series.astype('category')
+    return pd.DataFrame(columns, index=data.index)
+
+
+def memory_report(data: pd.DataFrame) -> dict:
+    """Reports the memory held by each column of a frame, strings included.
+
+    Args:
+        data (pd.DataFrame): Input DataFrame.
+
+    Returns:
+        dict: Total bytes and the bytes and dtype of every column.
+    """
+    usage = data.memory_usage(deep=True)
+    return {'total_bytes': int(usage.sum()),
+            'columns': {column: {'dtype': str(data[column].dtype), 'bytes': int(usage[column])}
+                        for column in data.columns}}
@@ -0,0 +1,267 @@
+""" Module to evaluate the trained recommenders on the test split with batched scoring"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List
+import numpy as np
+import pandas as pd
+from src.project_pipeline import (cbf_features, cf_scoring, interactions, model_export,
+                                  save_artifacts)
+
+logger = logging.getLogger(__name__)
+
+MEGABYTE = 1024 * 1024
+# Bytes per product of every scored user: the float64 scores, the negated copy and
+# int64 partition indices of ``cf_scoring.top_k``, and the temporaries of scoring
+SCORE_BYTES_PER_PRODUCT = 32
+
+
+def _gather(indptr: np.ndarray, values: np.ndarray, codes: np.ndarray):
+    """Returns the row number and value of every CSR entry of the given rows."""
+    starts, stops = indptr[codes], indptr[codes + 1]
+    lengths = stops - starts
+    rows = np.repeat(np.arange(len(codes)), lengths)
+    # Position of each entry in ``values``: its row start plus its rank in the row
+    entries = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    return rows, np.asarray(values)[entries]
+
+
+def _relevant_keys(train: dict, test: dict, user_codes: np.ndarray,
+                   relevance_threshold: float) -> np.ndarray:
+    """Returns the sorted ``row * n_products + product`` keys of the relevant test products.
+
+    A test product is relevant when its rating reaches the threshold and the
+    user did not rate it in training. Rows are positions in ``user_codes``.
+    """
+    n_products = len(test["product_ids"])
+    test_rows, test_items = _gather(test["indptr"], test["indices"], user_codes)
+    _, test_ratings = _gather(test["indptr"], test["ratings"], user_codes)
+    liked = test_ratings >= relevance_threshold
+    keys = test_rows[liked].astype(np.int64) * n_products + test_items[liked]
+    train_rows, train_items = _gather(train["indptr"], train["indices"], user_codes)
+    train_keys = train_rows.astype(np.int64) * n_products + train_items
+    return np.unique(keys[~np.isin(keys, train_keys)])
+
+
+def _rank_shard(score_products: Callable[[np.ndarray], np.ndarray], user_codes: np.ndarray,
+                train: dict, test: dict, settings: dict) -> dict:
+    """Sums the ranking metrics of one shard of users with a relevant test product.
+
+    Products the user rated in training are never recommended, so they are
+    masked from the scores and do not count as relevant test products. Only
+    the score matrix is dense: relevance stays a sorted array of keys.
+    """
+    k_values = settings["k_values"]
+    scores = score_products(user_codes)
+    n_products = scores.shape[1]
+    train_rows, train_items = _gather(train["indptr"], train["indices"], user_codes)
+    scores[train_rows, train_items] = -np.inf
+    top, _ = cf_scoring.top_k(scores, max(k_values))
+    del scores
+
+    relevant = _relevant_keys(train, test, user_codes, settings["relevance_threshold"])
+    hits = np.isin(np.arange(len(user_codes))[:, None] * n_products + top, relevant)
+    return _metric_sums(hits, np.bincount(relevant // n_products, minlength=len(user_codes)),
+                        k_values)
+
+
+def _metric_sums(hits: np.ndarray, n_relevant: np.ndarray, k_values: List[int]) -> dict:
+    """Sums precision@k, recall@k and NDCG@k over the rows of a (users, max k) hit matrix."""
+    discounts = 1 / np.log2(np.arange(2, hits.shape[1] + 2))
+    ideal = np.cumsum(discounts)
+    sums = {"users": len(hits)}
+    for k in k_values:
+        hits_k = hits[:, :k].sum(axis=1)
+        dcg = (hits[:, :k] * discounts[:k]).sum(axis=1)
+        idcg = ideal[np.minimum(n_relevant, min(k, hits.shape[1])) - 1]
+        sums[f"precision@{k}"] = float((hits_k / k).sum())
+        sums[f"recall@{k}"] = float((hits_k / n_relevant).sum())
+        sums[f"ndcg@{k}"] = float((dcg / idcg).sum())
+    return sums
+
+
+def _ranked_users(train: dict, test: dict, relevance_threshold: float) -> np.ndarray:
+    """Returns the codes of the test users with a relevant test product, the only ones ranked."""
+    test_users = np.flatnonzero(np.diff(np.asarray(test["indptr"])) > 0)
+    relevant = _relevant_keys(train, test, test_users, relevance_threshold)
+    return test_users[np.unique(relevant // max(len(test["product_ids"]), 1))]
+
+
+def _shard_rows(n_products: int, n_workers: int, shard_size: int, memory_mb: float) -> int:
+    """Sizes the shards so that the score matrices of every worker fit the memory budget.
+
+    Args:
+        n_products (int): Number of scored products.
+        n_workers (int): Number of shards scored at once.
+        shard_size (int): Largest number of users scored together.
+        memory_mb (float): Memory budget of all the workers together.
+
+    Returns:
+        int: Number of users per shard, at least one.
+    """
+    budget_rows = int(memory_mb * MEGABYTE) // (n_workers * SCORE_BYTES_PER_PRODUCT
+                                                 * max(n_products, 1))
+    return max(1, min(shard_size, budget_rows))
+
+
+def ranking_metrics(score_products: Callable[[np.ndarray], np.ndarray], train: dict,
+                    test: dict, *, relevance_threshold: float, k_values: List[int],
+                    shard_size: int = 512, memory_mb: float = 512, n_jobs: int = 4) -> dict:
+    """Computes precision@k, recall@k and NDCG@k over every test user.
+
+    Users are scored shard by shard, a dense (shard, n_products) matrix at a
+    time, and shards run on a thread pool: the matrix products and partial
+    sorts release the GIL, and the factors are shared without copies. Shards
+    are sized so that the matrices of all the threads fit ``memory_mb``.
+
+    Args:
+        score_products (Callable[[np.ndarray], np.ndarray]): Returns the score
+            of every product code for an array of user codes.
+        train (dict): Training interactions in the code space of ``test``.
+        test (dict): Test interactions.
+        relevance_threshold (float): Minimum test rating of a relevant product.
+        k_values (List[int]): Cutoffs of the ranking metrics.
+        shard_size (int): Largest number of users scored together.
+        memory_mb (float): Memory budget of the score matrices of all the threads.
+        n_jobs (int): Number of threads, -1 for one per CPU.
+
+    Returns:
+        dict: The metrics averaged over the users with a relevant test product,
+        and the number of such users.
+    """
+    users = _ranked_users(train, test, relevance_threshold)
+    n_workers = os.cpu_count() if n_jobs == -1 else n_jobs
+    rows = _shard_rows(len(test["product_ids"]), n_workers, shard_size, memory_mb)
+    settings = {"relevance_threshold": relevance_threshold, "k_values": k_values}
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        results = list(executor.map(
+            lambda start: _rank_shard(score_products, users[start:start + rows], train, test,
+                                      settings), range(0, len(users), rows)))
+    return _average(results, k_values)
+
+
+def _average(results: List[dict], k_values: List[int]) -> dict:
+    """Averages the metric sums of every shard over the ranked users."""
+    n_users = sum(result["users"] for result in results)
+    report = {"ranked_users": n_users}
+    for k in k_values:
+        for metric in ("precision", "recall", "ndcg"):
+            name = f"{metric}@{k}"
+            report[name] = sum(result[name] for result in results) / n_users if n_users else None
+    return report
+
+
+def _rating_errors(predictions: np.ndarray, ratings: np.ndarray) -> dict:
+    """Returns the RMSE and MAE of rating predictions."""
+    errors = predictions - ratings
+    return {"rmse": float(np.sqrt(np.mean(errors ** 2))), "mae": float(np.mean(np.abs(errors))),
+            "n_ratings": len(ratings)}
+
+
+def evaluate_cf(model, train: dict, test: dict, test_data: pd.DataFrame,
+                **settings) -> dict:
+    """Evaluates the SVD model on the test split.
+
+    Args:
+        model (SVD): Trained surprise SVD model, or its exported parameters.
+        train (dict): Training interactions in the code space of ``test``.
+        test (dict): Test interactions.
+        test_data (pd.DataFrame): The test split.
+        **settings: Keyword arguments of ``ranking_metrics``.
+
+    Returns:
+        dict: RMSE, MAE and the ranking metrics.
+    """
+    factors = cf_scoring.extract_svd_factors(model, test["product_ids"])
+    positions = np.searchsorted(test["product_ids"], test_data["product_id"].astype(str))
+    predictions = cf_scoring.score_pairs(factors, test_data["user_id"].astype(str), positions)
+    report = _rating_errors(predictions, test_data["rating"].to_numpy(dtype=np.float64))
+
+    user_ids = np.asarray(test["user_ids"])
+    report.update(ranking_metrics(lambda codes: cf_scoring.score_users(factors, user_ids[codes]),
+                                  train, test, **settings))
+    return report
+
+
+def evaluate_cbf(pipeline, train: dict, test: dict, test_data: pd.DataFrame,
+                 catalog: pd.DataFrame, **settings) -> dict:
+    """Evaluates the content-based model on the test split.
+
+    The model scores products, not users, so every user is ranked on the
+    cached product scores minus the products they rated in training.
+
+    Args:
+        pipeline: The trained content-based pipeline, or its export.
+        train (dict): Training interactions in the code space of ``test``.
+        test (dict): Test interactions.
+        test_data (pd.DataFrame): The test split.
+        catalog (pd.DataFrame): Encoded data holding the product catalog.
+        **settings: Keyword arguments of ``ranking_metrics``.
+
+    Returns:
+        dict: RMSE, MAE and the ranking metrics.
+    """
+    if isinstance(pipeline, dict):
+        predictions = model_export.cbf_predict(pipeline,
+                                               model_export.cbf_transform(pipeline, test_data))
+    else:
+        predictions = pipeline.predict(test_data.drop(columns=["rating"]))
+    report = _rating_errors(np.asarray(predictions, dtype=np.float64),
+                            test_data["rating"].to_numpy(dtype=np.float64))
+
+    store = cbf_features.build_feature_store(pipeline, catalog, train)
+    product_scores = np.full(len(test["product_ids"]), -np.inf)
+    known = store["code_positions"] >= 0
+    product_scores[known] = store["product_scores"][store["code_positions"][known]]
+    report.update(ranking_metrics(lambda codes: np.tile(product_scores, (len(codes), 1)),
+                                  train, test, **settings))
+    return report
+
+
+def evaluate_models(cf_model, cbf_pipeline, train_data: pd.DataFrame, test_data: pd.DataFrame,
+                    *, catalog: pd.DataFrame, user_interactions: dict, config: dict) -> dict:
+    """Evaluates whichever models are given on the test split.
+
+    Args:
+        cf_model (SVD): Trained SVD model, or None.
+        cbf_pipeline: Trained content-based pipeline, or None.
+        train_data (pd.DataFrame): The training split.
+        test_data (pd.DataFrame): The test split.
+        catalog (pd.DataFrame): Encoded data holding the product catalog.
+        user_interactions (dict): Interactions of the full data, whose codes are reused.
+        config (dict): The 'evaluation' section of the config.
+
+    Returns:
+        dict: Metrics per model, with the evaluation settings.
+    """
+    start = time.perf_counter()
+    train = interactions.build_interactions(train_data, user_interactions["user_ids"],
+                                            user_interactions["product_ids"])
+    test = interactions.build_interactions(test_data, user_interactions["user_ids"],
+                                           user_interactions["product_ids"])
+    settings = {"relevance_threshold": config["relevance_threshold"], "k_values": config["k"],
+                "shard_size": config["shard_size"], "memory_mb": config.get("memory_mb", 512),
+                "n_jobs": config["n_jobs"]}
+    report = {"k": config["k"], "relevance_threshold": config["relevance_threshold"]}
+    if cf_model is not None:
+        report["cf"] = evaluate_cf(cf_model, train, test, test_data, **settings)
+        logger.info("CF evaluation: %s", report["cf"])
+    if cbf_pipeline is not None:
+        report["cbf"] = evaluate_cbf(cbf_pipeline, train, test, test_data, catalog,
+                                    **settings)
+        logger.info("CBF evaluation: %s", report["cbf"])
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+
+def save_report(report: dict, report_file: Path):
+    """Writes the evaluation report atomically as JSON.
+
+    Args:
+        report (dict): Output of ``evaluate_models``.
+        report_file (Path): Destination file.
+    """
+    save_artifacts.save_json(report, report_file)
+    logger.info("Saved evaluation report to path %s successfully!", report_file)
@@ -0,0 +1,236 @@
+""" Module to update trained models with new ratings and decide when a full retrain is due"""
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+import numpy as np
+import pandas as pd
+from src.project_pipeline import cf_scoring, model_export, save_artifacts
+
+logger = logging.getLogger(__name__)
+
+
+def _append_ids(ids: np.ndarray, new_ids: pd.Series):
+    """Appends unseen ids and returns the extended ids, the position of every
+    id of ``new_ids`` and the number of ids appended."""
+    new_ids = new_ids.to_numpy(dtype=object)
+    # Inner ids without ratings have an empty raw id and are never reused
+    known = np.flatnonzero(ids != "")
+    found = pd.Index(ids[known]).get_indexer(new_ids)
+    unseen = pd.unique(new_ids[found < 0])
+    positions = np.where(found >= 0, known[found],
+                         len(ids) + pd.Index(unseen).get_indexer(new_ids))
+    return np.concatenate([ids, np.asarray(unseen, dtype=object)]), positions, len(unseen)
+
+
+def _extend_parameters(arrays: dict, ratings: pd.DataFrame, init_std_dev: float,
+                       random_state: Optional[int]) -> Tuple[dict, np.ndarray, np.ndarray]:
+    """Copies the SVD parameters with rows for the users and items first seen in ``ratings``.
+
+    Returns:
+        Tuple[dict, np.ndarray, np.ndarray]: The extended parameters and the
+        user and item row of every rating.
+    """
+    rng = np.random.default_rng(random_state)
+    user_ids, users, n_new_users = _append_ids(arrays["user_ids"],
+                                               ratings["user_id"].astype(str))
+    item_ids, items, n_new_items = _append_ids(arrays["item_ids"],
+                                               ratings["product_id"].astype(str))
+    n_factors = arrays["pu"].shape[1]
+    return dict(arrays,
+                pu=np.vstack([arrays["pu"], rng.normal(0, init_std_dev, (n_new_users, n_factors))]),
+                qi=np.vstack([arrays["qi"], rng.normal(0, init_std_dev, (n_new_items, n_factors))]),
+                bu=np.concatenate([arrays["bu"], np.zeros(n_new_users)]),
+                bi=np.concatenate([arrays["bi"], np.zeros(n_new_items)]),
+                user_ids=user_ids, item_ids=item_ids), users, items
+
+
+def _sgd_pass(params: dict, users: np.ndarray, items: np.ndarray, values: np.ndarray, *,
+              steps: Tuple[np.ndarray, np.ndarray], reg_all: float):
+    """Applies one SGD pass over the new ratings to ``params`` in place.
+
+    Every gradient is computed from the parameters at the start of the pass.
+    """
+    user_step, item_step = steps
+    pu, qi = params["pu"], params["qi"]
+    user_vectors, item_vectors = pu[users], qi[items]
+    estimates = ((params["global_mean"] if params["biased"] else 0.0)
+                 + np.einsum("ij,ij->i", user_vectors, item_vectors))
+    if params["biased"]:
+        estimates += params["bu"][users] + params["bi"][items]
+        np.add.at(params["bu"], users,
+                  user_step * (values - estimates - reg_all * params["bu"][users]))
+        np.add.at(params["bi"], items,
+                  item_step * (values - estimates - reg_all * params["bi"][items]))
+    errors = (values - estimates)[:, None]
+    np.add.at(pu, users, user_step[:, None] * (errors * item_vectors - reg_all * user_vectors))
+    np.add.at(qi, items, item_step[:, None] * (errors * user_vectors - reg_all * item_vectors))
+
+
+def fold_in_svd(arrays: dict, ratings: pd.DataFrame, *, n_epochs: int = 20,
+                lr_all: float = 0.005, reg_all: float = 0.02, update_known: bool = False,
+                init_std_dev: float = 0.1, random_state: Optional[int] = None) -> dict:
+    """Folds new ratings into SVD parameters with a few SGD passes.
+
+    New users and items get factors drawn like ``SVD.fit`` draws them and
+    zero biases. Each pass computes the gradient of every new rating from
+    the same parameters and accumulates them with ``np.add.at``, so only the
+    rows of the users and items in ``ratings`` change. Known rows stay fixed
+    unless ``update_known`` is set, which keeps the rest of the model
+    consistent with the factors it was trained with.
+
+    Args:
+        arrays (dict): Output of ``model_export.svd_arrays`` or ``model_export.load_svd``.
+        ratings (pd.DataFrame): New rows with "user_id", "product_id" and "rating".
+        n_epochs (int): Number of passes over the new ratings.
+        lr_all (float): Learning rate of every parameter.
+        reg_all (float): Regularization of every parameter.
+        update_known (bool): Also update users and items the model already knows.
+        init_std_dev (float): Standard deviation of the initial factors.
+        random_state (Optional[int]): Seed of the initial factors.
+
+    Returns:
+        dict: Updated SVD parameters in the format of ``svd_arrays``.
+    """
+    params, users, items = _extend_parameters(arrays, ratings, init_std_dev, random_state)
+    user_step = np.full(len(params["user_ids"]), lr_all)
+    item_step = np.full(len(params["item_ids"]), lr_all)
+    if not update_known:
+        user_step[:len(arrays["user_ids"])] = 0
+        item_step[:len(arrays["item_ids"])] = 0
+    steps = (user_step[users], item_step[items])
+    values = ratings["rating"].to_numpy(dtype=np.float64)
+    for _ in range(n_epochs):
+        _sgd_pass(params, users, items, values, steps=steps, reg_all=reg_all)
+
+    logger.info("Folded %d ratings into the SVD model: %d new users, %d new items",
+                len(ratings), len(params["user_ids"]) - len(arrays["user_ids"]),
+                len(params["item_ids"]) - len(arrays["item_ids"]))
+    return params
+
+
+def continue_cbf(model: dict, rows: pd.DataFrame, n_rounds: int,
+                 training: Optional[dict] = None) -> dict:
+    """Adds boosting rounds fitted on new rows to an exported content-based model.
+
+    The preprocessing stays as trained: terms missing from the TF-IDF
+    vocabulary are ignored until the next full retrain.
+
+    Args:
+        model (dict): Output of ``model_export.load_cbf``.
+        rows (pd.DataFrame): New rows with the model's columns and "rating".
+        n_rounds (int): Number of boosting rounds added.
+        training (Optional[dict]): The 'training' section of the CBF config,
+            whose tree method, threads and tree parameters are reused.
+
+    Returns:
+        dict: The model with the extended booster.
+    """
+    import xgboost as xgb  # pylint: disable=import-outside-toplevel
+
+    booster = model["booster"]
+    best_iteration = booster.attr("best_iteration")
+    if best_iteration is not None:
+        # Trees past the early-stopping point were never used for predictions
+        booster = booster[:int(best_iteration) + 1]
+    params = {}
+    if training is not None:
+        params = {
+            "tree_method": training["tree_method"],
+            "nthread": os.cpu_count() if training["n_jobs"] == -1 else training["n_jobs"],
+            "eta": training["learning_rate"],
+            "max_depth": training["max_depth"],
+            "max_bin": training["max_bin"],
+        }
+    dtrain = xgb.DMatrix(model_export.cbf_transform(model, rows),
+                         label=rows["rating"].to_numpy(dtype=np.float32))
+    booster = xgb.train(params, dtrain, num_boost_round=n_rounds, xgb_model=booster)
+    booster.set_attr(best_iteration=None, best_score=None)
+    logger.info("Continued the content-based model for %d rounds on %d rows",
+                n_rounds, len(rows))
+    return dict(model, booster=booster)
+
+
+def read_version(version_file: Path) -> Optional[dict]:
+    """Reads the published model version, or returns None when there is none."""
+    if not version_file.exists():
+        return None
+    with open(version_file, encoding="utf8") as file:
+        return json.load(file)
+
+
+def write_version(version_file: Path, previous: Optional[dict], kind: str, n_ratings: int,
+                  drift: Optional[dict] = None) -> dict:
+    """Atomically publishes a new model version.
+
+    Args:
+        version_file (Path): Destination file.
+        previous (Optional[dict]): The version being replaced.
+        kind (str): "full" for a retrain, "incremental" for an update.
+        n_ratings (int): Ratings in the full retrain, or in the update.
+        drift (Optional[dict]): Drift report of an update.
+
+    Returns:
+        dict: The published version.
+    """
+    now = time.time()
+    version = {"version": (previous or {}).get("version", 0) + 1, "kind": kind, "created": now}
+    if kind == "full" or previous is None:
+        version.update(full_retrain_created=now, full_retrain_ratings=n_ratings,
+                       updates_since_full=0, ratings_since_full=0)
+    else:
+        version.update(full_retrain_created=previous["full_retrain_created"],
+                       full_retrain_ratings=previous["full_retrain_ratings"],
+                       updates_since_full=previous["updates_since_full"] + 1,
+                       ratings_since_full=previous["ratings_since_full"] + n_ratings)
+    if drift is not None:
+        version["drift"] = drift
+    save_artifacts.save_json(version, version_file)
+    logger.info("Published model version %d (%s)", version["version"], kind)
+    return version
+
+
+def check_drift(arrays: dict, ratings: pd.DataFrame, version: Optional[dict],
+                baseline_rmse: Optional[float], thresholds: dict) -> dict:
+    """Measures how far new ratings drift from the model and whether a full retrain is due.
+
+    Args:
+        arrays (dict): SVD parameters before the update.
+        ratings (pd.DataFrame): New rows with "user_id", "product_id" and "rating".
+        version (Optional[dict]): The published version, from ``read_version``.
+        baseline_rmse (Optional[float]): Test RMSE of the last full retrain.
+        thresholds (dict): The 'drift' section of the incremental config.
+
+    Returns:
+        dict: The drift measures, the thresholds they crossed and whether a
+        full retrain is required.
+    """
+    factors = cf_scoring.extract_svd_factors(arrays, ratings["product_id"].unique())
+    positions = pd.Index(factors["product_ids"]).get_indexer(ratings["product_id"].astype(str))
+    predictions = cf_scoring.score_pairs(factors, ratings["user_id"].astype(str), positions)
+    errors = predictions - ratings["rating"].to_numpy(dtype=np.float64)
+    known_user = cf_scoring.inner_user_ids(factors, ratings["user_id"].astype(str)) >= 0
+
+    report = {
+        "batch_rmse": float(np.sqrt(np.mean(errors ** 2))),
+        "cold_ratings_ratio": float(1 - known_user.mean()),
+    }
+    if baseline_rmse:
+        report["rmse_increase"] = report["batch_rmse"] / baseline_rmse - 1
+    if version is not None:
+        report["new_ratings_ratio"] = ((version["ratings_since_full"] + len(ratings))
+                                       / max(version["full_retrain_ratings"], 1))
+        report["updates"] = version["updates_since_full"] + 1
+        report["days"] = (time.time() - version["full_retrain_created"]) / 86400
+
+    limits = {"rmse_increase": "max_rmse_increase",
+              "cold_ratings_ratio": "max_cold_ratings_ratio",
+              "new_ratings_ratio": "max_new_ratings_ratio",
+              "updates": "max_updates", "days": "max_days"}
+    report["exceeded"] = [name for name, limit in limits.items()
+                          if name in report and thresholds.get(limit) is not None
+                          and report[name] > thresholds[limit]]
+    report["retrain"] = bool(report["exceeded"])
+    return report
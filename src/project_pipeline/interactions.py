@@ -0,0 +1,122 @@
+""" Module to build, save and query the integer-coded user-item interaction matrix"""
+import logging
+from pathlib import Path
+from typing import Optional, Tuple
+import numpy as np
+import pandas as pd
+from src.project_pipeline import save_artifacts
+
+logger = logging.getLogger(__name__)
+
+INTERACTION_FILES = ("user_ids", "product_ids", "indptr", "indices", "ratings")
+
+
+def build_interactions(data: pd.DataFrame, user_ids: Optional[np.ndarray] = None,
+                       product_ids: Optional[np.ndarray] = None) -> dict:
+    """Encodes users and products as integers and groups the ratings by user in CSR form.
+
+    Codes are positions in the sorted unique ids, so they are stable for a
+    given catalog and a user id can be resolved with a binary search. Row
+    ``u`` holds ``indices[indptr[u]:indptr[u + 1]]``, the product codes the
+    user rated, in the original row order, and the matching ``ratings``.
+
+    Args:
+        data (pd.DataFrame): Rows with "user_id", "product_id" and "rating".
+        user_ids (Optional[np.ndarray]): Sorted user ids of an existing code space
+            holding every user of ``data``, e.g. to encode a training split like
+            the full data.
+        product_ids (Optional[np.ndarray]): Sorted product ids of an existing code
+            space holding every product of ``data``.
+
+    Returns:
+        dict: The sorted ids and the CSR arrays.
+    """
+    users = data["user_id"].astype(str).to_numpy()
+    products = data["product_id"].astype(str).to_numpy()
+    if user_ids is None:
+        user_ids = np.unique(users)
+    if product_ids is None:
+        product_ids = np.unique(products)
+    user_codes = np.searchsorted(user_ids, users)
+    product_codes = np.searchsorted(product_ids, products)
+
+    order = np.argsort(user_codes, kind="stable")
+    indptr = np.zeros(len(user_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(user_codes, minlength=len(user_ids)), out=indptr[1:])
+    logger.info("Built interactions of %d users with %d products from %d ratings",
+                len(user_ids), len(product_ids), len(data))
+    return {
+        "user_ids": np.asarray(user_ids, dtype=str),
+        "product_ids": np.asarray(product_ids, dtype=str),
+        "indptr": indptr,
+        "indices": product_codes[order].astype(np.int32),
+        "ratings": data["rating"].to_numpy(dtype=np.float64)[order],
+    }
+
+
+def save_interactions(interactions: dict, interactions_dir: Path):
+    """Writes the interactions as one .npy file per array so they can be memory-mapped.
+
+    Args:
+        interactions (dict): Output of ``build_interactions``.
+        interactions_dir (Path): Directory where the arrays are written.
+    """
+    interactions_dir.mkdir(exist_ok=True, parents=True)
+    for name in INTERACTION_FILES:
+        save_artifacts.save_array(interactions[name], interactions_dir / f"{name}.npy")
+    logger.info("Saved interactions to path %s successfully!", interactions_dir)
+
+
+def load_interactions(interactions_dir: Path) -> Optional[dict]:
+    """Memory-maps saved interactions.
+
+    Args:
+        interactions_dir (Path): Directory holding the interaction arrays.
+
+    Returns:
+        dict: The interaction arrays, or None when they have not been built.
+    """
+    if not all((interactions_dir / f"{name}.npy").exists() for name in INTERACTION_FILES):
+        return None
+    return {name: np.load(interactions_dir / f"{name}.npy", mmap_mode="r")
+            for name in INTERACTION_FILES}
+
+
+def user_code(interactions: dict, user_id: str) -> int:
+    """Returns the integer code of a user, or -1 for an unknown user."""
+    position = int(np.searchsorted(interactions["user_ids"], user_id))
+    if position < len(interactions["user_ids"]) and interactions["user_ids"][position] == user_id:
+        return position
+    return -1
+
+
+def user_items(interactions: dict, user_id: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the product codes rated by a user and the ratings, in O(degree).
+
+    Args:
+        interactions (dict): Output of ``build_interactions`` or ``load_interactions``.
+        user_id (str): The ID of the user.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Product codes and ratings, empty for an unknown user.
+    """
+    code = user_code(interactions, user_id)
+    if code < 0:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+    start, stop = interactions["indptr"][code], interactions["indptr"][code + 1]
+    return (np.asarray(interactions["indices"][start:stop]),
+            np.asarray(interactions["ratings"][start:stop]))
+
+
+def user_history(interactions: dict, user_id: str) -> pd.DataFrame:
+    """Returns the products a user rated, with their ratings.
+
+    Args:
+        interactions (dict): Output of ``build_interactions`` or ``load_interactions``.
+        user_id (str): The ID of the user.
+
+    Returns:
+        pd.DataFrame: Columns "product_id" and "rating".
+    """
+    codes, ratings = user_items(interactions, user_id)
+    return pd.DataFrame({"product_id": interactions["product_ids"][codes], "rating": ratings})
@@ -0,0 +1,158 @@
+""" Module to record stage timings and request latencies and export them as metrics"""
+import bisect
+import contextlib
+import cProfile
+import logging
+import resource
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, Optional
+from src.project_pipeline import save_artifacts
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond scoring to multi-second loads
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Size buckets, from single requests to large batches
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+_lock = threading.Lock()
+_stages: Dict[str, dict] = {}
+_histograms: Dict[str, dict] = {}
+_profiling = threading.Event()
+
+
+def max_rss_bytes() -> int:
+    """Returns the peak resident set size of the process so far."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextlib.contextmanager
+def track_stage(name: str, trace_memory: bool = False, profile_dir: Optional[Path] = None):
+    """Records wall time, CPU time and memory of a pipeline stage.
+
+    Args:
+        name (str): Name of the stage.
+        trace_memory (bool): Record the peak Python allocation with tracemalloc.
+            Nested stages reuse the outer trace and report no peak of their own.
+        profile_dir (Optional[Path]): When set, dump a cProfile of the stage there.
+            Only one profiler can run at a time, so nested stages are not dumped.
+    """
+    owns_trace = trace_memory and not tracemalloc.is_tracing()
+    if owns_trace:
+        tracemalloc.start()
+    profiler = None
+    if profile_dir is not None and not _profiling.is_set():
+        _profiling.set()
+        profiler = cProfile.Profile()
+        profiler.enable()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        record = {
+            "wall_seconds": time.perf_counter() - wall_start,
+            "cpu_seconds": time.process_time() - cpu_start,
+            "max_rss_bytes": max_rss_bytes(),
+        }
+        if profiler is not None:
+            profiler.disable()
+            _profiling.clear()
+            profile_dir.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(profile_dir / f"{name}.prof")
+        if owns_trace:
+            record["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        with _lock:
+            _stages[name] = record
+        logger.info("Stage %s took %.2fs wall, %.2fs cpu", name,
+                    record["wall_seconds"], record["cpu_seconds"])
+
+
+def observe(name: str, value: float, buckets: tuple = BUCKETS):
+    """Adds one observation to a histogram.
+
+    Args:
+        name (str): Name of the histogram, e.g. "app_cf_scoring_seconds".
+        value (float): Observed latency, or size for a histogram of sizes.
+        buckets (tuple): Upper bounds of the buckets, used when the histogram
+            is first observed, e.g. ``SIZE_BUCKETS`` for batch sizes.
+    """
+    with _lock:
+        histogram = _histograms.setdefault(
+            name, {"bounds": buckets, "buckets": [0] * (len(buckets) + 1), "sum": 0.0,
+                   "count": 0})
+        histogram["buckets"][bisect.bisect_left(histogram["bounds"], value)] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+@contextlib.contextmanager
+def timed(name: str):
+    """Observes the latency of the enclosed block in a histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def snapshot() -> dict:
+    """Returns a copy of every recorded stage and histogram."""
+    with _lock:
+        return {
+            "stages": {name: dict(record) for name, record in _stages.items()},
+            "histograms": {name: {"buckets": list(zip([repr(bound)
+                                                       for bound in histogram["bounds"]]
+                                                      + ["+Inf"], histogram["buckets"])),
+                                  "sum": histogram["sum"], "count": histogram["count"]}
+                           for name, histogram in _histograms.items()},
+            "max_rss_bytes": max_rss_bytes(),
+        }
+
+
+def to_prometheus(prefix: str = "recommender") -> str:
+    """Renders the recorded metrics in the Prometheus text exposition format.
+
+    Args:
+        prefix (str): Prefix of every metric name.
+
+    Returns:
+        str: The metrics as Prometheus text.
+    """
+    data = snapshot()
+    lines = [f"# TYPE {prefix}_process_max_rss_bytes gauge",
+             f"{prefix}_process_max_rss_bytes {data['max_rss_bytes']}"]
+    for field in ("wall_seconds", "cpu_seconds", "max_rss_bytes", "peak_traced_bytes"):
+        metric = f"{prefix}_stage_{field}"
+        values = [(stage, record[field]) for stage, record in data["stages"].items()
+                  if field in record]
+        if values:
+            lines.append(f"# TYPE {metric} gauge")
+            lines.extend(f'{metric}{{stage="{stage}"}} {value}' for stage, value in values)
+    for name, histogram in data["histograms"].items():
+        metric = f"{prefix}_{name}"
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for label, count in histogram["buckets"]:
+            cumulative += count
+            lines.append(f'{metric}_bucket{{le="{label}"}} {cumulative}')
+        lines.append(f"{metric}_sum {histogram['sum']}")
+        lines.append(f"{metric}_count {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path: Path, prefix: str = "recommender"):
+    """Writes the metrics atomically, as JSON for a .json path and Prometheus text otherwise.
+
+    Args:
+        path (Path): Destination file.
+        prefix (str): Prefix of every Prometheus metric name.
+    """
+    if path.suffix == ".json":
+        save_artifacts.save_json(snapshot(), path)
+    else:
+        save_artifacts.save_text(to_prometheus(prefix), path)
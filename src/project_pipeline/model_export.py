@@ -0,0 +1,389 @@
+""" Module to export trained models to compact, pickle-free artifacts and load them lazily"""
+import json
+import logging
+import os
+import pickle
+import re
+from pathlib import Path
+from typing import Any, List, Optional
+import numpy as np
+import pandas as pd
+from src.project_pipeline import save_artifacts, text_processing
+
+logger = logging.getLogger(__name__)
+
+# Files of an exported content-based model directory
+CBF_PREPROCESSOR_FILE = "preprocessor.json"
+CBF_BOOSTER_FILE = "xgb_model.ubj"
+
+
+def svd_arrays(model) -> dict:
+    """Pulls the parameters of a trained surprise SVD model into plain arrays.
+
+    Args:
+        model (SVD): Trained surprise SVD model.
+
+    Returns:
+        dict: Factors and biases indexed by inner id, the raw user and item
+        ids of every inner id ("" for ids without ratings in the trainset),
+        the global mean, rating scale and bias flag.
+    """
+    trainset = model.trainset
+    user_ids = np.full(trainset.n_users, "", dtype=object)
+    for raw_id, inner_id in trainset._raw2inner_id_users.items():  # pylint: disable=protected-access
+        user_ids[inner_id] = raw_id
+    item_ids = np.full(trainset.n_items, "", dtype=object)
+    for raw_id, inner_id in trainset._raw2inner_id_items.items():  # pylint: disable=protected-access
+        item_ids[inner_id] = raw_id
+    return {
+        "pu": np.asarray(model.pu, dtype=np.float64),
+        "qi": np.asarray(model.qi, dtype=np.float64),
+        "bu": np.asarray(model.bu, dtype=np.float64),
+        "bi": np.asarray(model.bi, dtype=np.float64),
+        "user_ids": user_ids,
+        "item_ids": item_ids,
+        "global_mean": float(trainset.global_mean),
+        "rating_scale": tuple(trainset.rating_scale),
+        "biased": bool(model.biased),
+    }
+
+
+def export_svd(model, model_file: Path):
+    """Saves the SVD factors, biases and id maps as an uncompressed .npz.
+
+    Args:
+        model (SVD): Trained surprise SVD model.
+        model_file (Path): The path of the .npz file.
+    """
+    save_svd(svd_arrays(model), model_file)
+
+
+def save_svd(arrays: dict, model_file: Path):
+    """Atomically writes SVD parameters in the format of ``svd_arrays`` as an .npz.
+
+    Ids are stored as UTF-8 bytes, a quarter of the size of NumPy unicode.
+
+    Args:
+        arrays (dict): Output of ``svd_arrays`` or ``load_svd``.
+        model_file (Path): The path of the .npz file.
+    """
+    model_file.parent.mkdir(exist_ok=True, parents=True)
+    temp_file = model_file.with_name(f".{model_file.name}.part")
+    with open(temp_file, "wb") as file:
+        np.savez(file, pu=arrays["pu"], qi=arrays["qi"], bu=arrays["bu"], bi=arrays["bi"],
+                 user_ids=np.char.encode(arrays["user_ids"].astype(str), "utf8"),
+                 item_ids=np.char.encode(arrays["item_ids"].astype(str), "utf8"),
+                 global_mean=arrays["global_mean"],
+                 rating_scale=np.asarray(arrays["rating_scale"], dtype=np.float64),
+                 biased=arrays["biased"])
+    os.replace(temp_file, model_file)
+    logger.info("Exported the SVD model to path %s successfully!", model_file)
+
+
+def load_svd(model_file: Path) -> dict:
+    """Loads exported SVD parameters in the format of ``svd_arrays``.
+
+    Args:
+        model_file (Path): The path of the .npz file.
+
+    Returns:
+        dict: The SVD parameters, usable wherever a trained SVD model is scored.
+    """
+    with np.load(model_file) as data:
+        return {
+            "pu": data["pu"],
+            "qi": data["qi"],
+            "bu": data["bu"],
+            "bi": data["bi"],
+            "user_ids": np.char.decode(data["user_ids"], "utf8").astype(object),
+            "item_ids": np.char.decode(data["item_ids"], "utf8").astype(object),
+            "global_mean": float(data["global_mean"]),
+            "rating_scale": tuple(map(float, data["rating_scale"])),
+            "biased": bool(data["biased"]),
+        }
+
+
+def _export_transformer(name: str, transformer, columns) -> dict:
+    """Describes one fitted scaler or TF-IDF step of the ColumnTransformer."""
+    steps = transformer.steps if hasattr(transformer, "steps") else [(name, transformer)]
+    kinds = [type(step).__name__ for _, step in steps]
+    if kinds == ["HashedTermCounts", "TfidfTransformer"]:
+        hashing, tfidf = steps[0][1], steps[1][1]
+        if not isinstance(columns, str):
+            raise ValueError("HashedTermCounts must read a single text column")
+        return {
+            "name": name,
+            "kind": "hashed_tfidf",
+            "columns": columns,
+            "n_features": hashing.n_features,
+            "sublinear_tf": tfidf.sublinear_tf,
+            "norm": tfidf.norm,
+            "idf": tfidf.idf_.tolist() if tfidf.use_idf else None,
+        }
+    if len(steps) != 1:
+        raise ValueError(f"Transformer {name} has {len(steps)} steps, expected one")
+    step = steps[0][1]
+    kind = type(step).__name__
+    if kind == "StandardScaler":
+        return {
+            "name": name,
+            "kind": "scaler",
+            "columns": list(columns),
+            "mean": None if step.mean_ is None else step.mean_.tolist(),
+            "scale": None if step.scale_ is None else step.scale_.tolist(),
+        }
+    if kind == "TfidfVectorizer":
+        params = step.get_params()
+        unsupported = {key: params[key] for key in ("preprocessor", "tokenizer", "stop_words",
+                                                    "strip_accents")
+                       if params[key] is not None}
+        if params["analyzer"] != "word" or params["binary"] or unsupported:
+            raise ValueError(f"TfidfVectorizer options are not supported: {unsupported}")
+        if not isinstance(columns, str):
+            raise ValueError("TfidfVectorizer must read a single text column")
+        terms = sorted(step.vocabulary_, key=step.vocabulary_.get)
+        return {
+            "name": name,
+            "kind": "tfidf",
+            "columns": columns,
+            "lowercase": params["lowercase"],
+            "token_pattern": params["token_pattern"],
+            "ngram_range": list(params["ngram_range"]),
+            "sublinear_tf": params["sublinear_tf"],
+            "norm": params["norm"],
+            "terms": terms,
+            "idf": step.idf_.tolist() if params["use_idf"] else None,
+        }
+    raise ValueError(f"Transformer {kind} cannot be exported")
+
+
+def export_cbf(pipeline, model_dir: Path):
+    """Saves the fitted preprocessing as JSON and the XGBoost booster as UBJSON.
+
+    Args:
+        pipeline: The trained content-based filtering pipeline.
+        model_dir (Path): The directory receiving the exported model.
+    """
+    preprocessor = pipeline.named_steps["preprocessor"]
+    transformers = [_export_transformer(name, transformer, columns)
+                    for name, transformer, columns in preprocessor.transformers_
+                    if name != "remainder" and transformer != "drop"]
+    _publish_cbf(model_dir, pipeline.named_steps["xgb_model"].get_booster(),
+                 {"transformers": transformers,
+                  "sparse_output": bool(preprocessor.sparse_output_)})
+    logger.info("Exported the content-based model to path %s successfully!", model_dir)
+
+
+def save_cbf_booster(booster, model_dir: Path):
+    """Replaces the XGBoost booster of an exported content-based model.
+
+    The preprocessing of the current export is kept.
+
+    Args:
+        booster (xgb.Booster): The booster to save.
+        model_dir (Path): The directory of the exported model.
+    """
+    _publish_cbf(model_dir, booster)
+
+
+def _publish_cbf(model_dir: Path, booster, preprocessor: Optional[dict] = None):
+    """Writes an exported content-based model to a new directory and swaps it in.
+
+    A reader loading ``model_dir`` gets the preprocessing and the booster of
+    the same version, never one of each.
+
+    Args:
+        model_dir (Path): The directory of the exported model.
+        booster (xgb.Booster): The booster to save.
+        preprocessor (Optional[dict]): The preprocessing to save, or None to
+            keep the one of the current export.
+    """
+    with save_artifacts.staged_dir(model_dir) as temp_dir:
+        if preprocessor is None:
+            os.link(model_dir / CBF_PREPROCESSOR_FILE, temp_dir / CBF_PREPROCESSOR_FILE)
+        else:
+            with open(temp_dir / CBF_PREPROCESSOR_FILE, "w", encoding="utf8") as file:
+                json.dump(preprocessor, file)
+        booster.save_model(temp_dir / CBF_BOOSTER_FILE)
+
+
+def load_cbf(model_dir: Path) -> dict:
+    """Loads an exported content-based model, importing xgboost only now.
+
+    Args:
+        model_dir (Path): The directory holding the exported model.
+
+    Returns:
+        dict: The preprocessing description and the XGBoost booster.
+    """
+    import xgboost as xgb  # pylint: disable=import-outside-toplevel
+
+    with open(model_dir / CBF_PREPROCESSOR_FILE, encoding="utf8") as file:
+        model = json.load(file)
+    for transformer in model["transformers"]:
+        if transformer["kind"] == "tfidf":
+            transformer["vocabulary"] = {term: index
+                                         for index, term in enumerate(transformer["terms"])}
+            transformer["pattern"] = re.compile(transformer["token_pattern"])
+    booster = xgb.Booster()
+    booster.load_model(model_dir / CBF_BOOSTER_FILE)
+    model["booster"] = booster
+    return model
+
+
+def cbf_columns(model: dict) -> List[str]:
+    """Lists the input columns read by an exported content-based model."""
+    columns = []
+    for transformer in model["transformers"]:
+        if isinstance(transformer["columns"], str):
+            columns.append(transformer["columns"])
+        else:
+            columns.extend(transformer["columns"])
+    return columns
+
+
+def _term_indices(transformer: dict, text: str) -> List[int]:
+    """Returns the vocabulary index of every n-gram of one text, repeated per occurrence."""
+    vocabulary = transformer["vocabulary"]
+    min_n, max_n = transformer["ngram_range"]
+    if transformer["lowercase"]:
+        text = text.lower()
+    tokens = transformer["pattern"].findall(text)
+    indices = []
+    for size in range(min_n, max_n + 1):
+        for start in range(len(tokens) - size + 1):
+            index = vocabulary.get(" ".join(tokens[start:start + size]))
+            if index is not None:
+                indices.append(index)
+    return indices
+
+
+def _tfidf_transform(transformer: dict, texts: pd.Series):
+    """Reproduces ``TfidfVectorizer.transform`` from the exported vocabulary and idf.
+
+    Each distinct text is tokenized once and its row reused for its duplicates.
+    """
+    from scipy import sparse  # pylint: disable=import-outside-toplevel
+
+    codes, uniques = pd.factorize(np.asarray(texts, dtype=object))
+    indptr, indices = [0], []
+    for text in uniques:
+        indices.extend(_term_indices(transformer, text))
+        indptr.append(len(indices))
+    matrix = sparse.csr_matrix((np.ones(len(indices)), indices, indptr),
+                               shape=(len(uniques), len(transformer["vocabulary"])))
+    matrix.sum_duplicates()
+    return _weight_counts(transformer, matrix[codes])
+
+
+def _weight_counts(transformer: dict, matrix):
+    """Applies the exported sublinear tf, idf and norm of a TF-IDF step to term counts."""
+    from scipy import sparse  # pylint: disable=import-outside-toplevel
+
+    if transformer["sublinear_tf"]:
+        np.log(matrix.data, matrix.data)
+        matrix.data += 1
+    if transformer["idf"] is not None:
+        matrix = matrix @ sparse.diags(np.asarray(transformer["idf"]))
+    if transformer["norm"] is not None:
+        if transformer["norm"] == "l2":
+            norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        else:
+            norms = np.asarray(abs(matrix).sum(axis=1)).ravel()
+        norms[norms == 0] = 1
+        matrix = sparse.diags(1 / norms) @ matrix
+    return sparse.csr_matrix(matrix)
+
+
+def cbf_transform(model: dict, data: pd.DataFrame):
+    """Reproduces the fitted ColumnTransformer of the content-based pipeline.
+
+    Args:
+        model (dict): Output of ``load_cbf``.
+        data (pd.DataFrame): Rows holding the columns of ``cbf_columns``.
+
+    Returns:
+        The feature matrix, sparse when the fitted ColumnTransformer was.
+    """
+    from scipy import sparse  # pylint: disable=import-outside-toplevel
+
+    blocks = []
+    for transformer in model["transformers"]:
+        if transformer["kind"] == "scaler":
+            values = data[transformer["columns"]].to_numpy(dtype=np.float64)
+            if transformer["mean"] is not None:
+                values = values - np.asarray(transformer["mean"])
+            if transformer["scale"] is not None:
+                values = values / np.asarray(transformer["scale"])
+            blocks.append(values)
+        elif transformer["kind"] == "hashed_tfidf":
+            counts = text_processing.hashed_counts(data[transformer["columns"]],
+                                                   transformer["n_features"])
+            blocks.append(_weight_counts(transformer, counts))
+        else:
+            blocks.append(_tfidf_transform(transformer, data[transformer["columns"]]))
+    if model["sparse_output"]:
+        return sparse.hstack(blocks, format="csr")
+    return np.hstack([block.toarray() if sparse.issparse(block) else block for block in blocks])
+
+
+def cbf_predict(model: dict, features) -> np.ndarray:
+    """Predicts ratings from transformed features with the exported booster.
+
+    Args:
+        model (dict): Output of ``load_cbf``.
+        features: Output of ``cbf_transform``.
+
+    Returns:
+        np.ndarray: Predicted ratings.
+    """
+    booster = model["booster"]
+    best_iteration = booster.attr("best_iteration")
+    iteration_range = (0, int(best_iteration) + 1) if best_iteration is not None else (0, 0)
+    return booster.inplace_predict(features, iteration_range=iteration_range)
+
+
+def load_model_artifact(path: Path) -> Any:
+    """Loads a model artifact by its format, importing heavy libraries only on demand.
+
+    Exported SVD models (.npz) need NumPy only, exported content-based models
+    (a directory) import xgboost, and legacy pickles import whatever they hold.
+
+    Args:
+        path (Path): The path of the model artifact.
+
+    Returns:
+        The SVD parameters, the exported content-based model or the unpickled model.
+    """
+    if path.suffix == ".npz":
+        return load_svd(path)
+    if path.is_dir():
+        return load_cbf(path)
+    with open(path, "rb") as file:
+        return pickle.load(file)
+
+
+def preferred_artifact(*paths: Path) -> Path:
+    """Returns the first existing artifact, or the last path when none exists."""
+    for path in paths:
+        if path.exists():
+            return path
+    return paths[-1]
+
+
+def export_models(cf_model, cbf_pipeline, cf_file: Path, cbf_dir: Path):
+    """Exports whichever models are given next to their pickles.
+
+    Args:
+        cf_model (SVD): Trained SVD model, or None.
+        cbf_pipeline: Trained content-based pipeline, or None.
+        cf_file (Path): Destination .npz of the SVD model.
+        cbf_dir (Path): Destination directory of the content-based model.
+    """
+    if cf_model is not None:
+        export_svd(cf_model, cf_file)
+    if cbf_pipeline is not None:
+        try:
+            export_cbf(cbf_pipeline, cbf_dir)
+        except ValueError as error:
+            logger.warning("Content-based model kept as a pickle only: %s", error)
@@ -0,0 +1,147 @@
+""" Module to serve the latest version of file-based artifacts and reload them in the background"""
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Attempts at a first load when the artifact keeps changing while it is read
+MAX_LOAD_ATTEMPTS = 3
+
+
+def artifact_version(path: Path) -> Optional[tuple]:
+    """Identifies the version of an artifact file or directory from its stat.
+
+    Artifacts are published by renaming a new file into place, which changes
+    the inode, modification time and usually the size of the file.
+
+    Args:
+        path (Path): A file, or a directory whose files, at any depth, form one artifact.
+
+    Returns:
+        Optional[tuple]: A hashable version, or None when the artifact does not exist.
+    """
+    try:
+        if path.is_dir():
+            files = sorted(child for child in path.rglob("*")
+                           if child.is_file() and not child.name.startswith("."))
+            if not files:
+                return None
+            return tuple((str(child.relative_to(path)), *_stat_version(child))
+                         for child in files)
+        return _stat_version(path)
+    except FileNotFoundError:
+        return None
+
+
+def _stat_version(path: Path) -> tuple:
+    """Returns the inode, modification time and size of a file."""
+    stat = path.stat()
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class ModelRegistry:
+    """Holds the current version of each artifact and swaps in new versions.
+
+    ``get`` stats the artifact at most once per ``check_interval`` seconds.
+    When the version on disk differs from the loaded one, the new version is
+    loaded on a background thread while callers keep getting the current one,
+    then swapped in under a lock. Only the latest version of each artifact is
+    kept, so the previous one is freed once no caller references it. Loads
+    are shared: concurrent callers never load the same version twice.
+    """
+
+    def __init__(self, check_interval: float = 2.0, max_workers: int = 2):
+        """
+        Args:
+            check_interval (float): Minimum seconds between two stats of an artifact.
+            max_workers (int): Number of artifacts that can load concurrently.
+        """
+        self.check_interval = check_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="model-registry")
+        self._lock = threading.Lock()
+        self._entries: Dict[Path, Tuple[tuple, Any]] = {}
+        self._loading: Dict[Path, Tuple[tuple, Future]] = {}
+        self._checked: Dict[Path, float] = {}
+
+    def get(self, path: Path, loader: Callable[[Path], Any]) -> Tuple[Optional[tuple], Any]:
+        """Returns the loaded artifact, scheduling a reload when it changed on disk.
+
+        The first call for an artifact loads it synchronously; later calls
+        never wait for a reload.
+
+        Args:
+            path (Path): Path of the artifact.
+            loader (Callable[[Path], Any]): Function loading the artifact from its path.
+
+        Returns:
+            Tuple[Optional[tuple], Any]: The version and the loaded artifact,
+            or (None, None) when the artifact has never been available.
+        """
+        path = Path(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            now = time.monotonic()
+            due = now - self._checked.get(path, float("-inf")) >= self.check_interval
+            if due or entry is None:
+                self._checked[path] = now
+
+        if entry is not None and not due:
+            return entry
+
+        for _ in range(MAX_LOAD_ATTEMPTS):
+            version = artifact_version(path)
+            if version is None or (entry is not None and entry[0] == version):
+                break
+            future = self._schedule(path, version, loader)
+            if entry is not None:
+                break
+            future.result()
+            with self._lock:
+                entry = self._entries.get(path)
+            if entry is not None:
+                break
+        return entry if entry is not None else (None, None)
+
+    def _schedule(self, path: Path, version: tuple, loader: Callable[[Path], Any]) -> Future:
+        """Starts loading a version unless that version is loading or failed to load."""
+        with self._lock:
+            loading = self._loading.get(path)
+            if loading is not None and loading[0] == version and (
+                    not loading[1].done() or loading[1].exception() is not None):
+                return loading[1]
+            future = self._executor.submit(self._load, path, version, loader)
+            self._loading[path] = (version, future)
+        future.add_done_callback(lambda done: self._log_failure(path, done))
+        return future
+
+    def _load(self, path: Path, version: tuple, loader: Callable[[Path], Any]):
+        """Loads one version and swaps it in if the artifact did not change meanwhile."""
+        start = time.perf_counter()
+        artifact = loader(path)
+        if artifact_version(path) != version:
+            logger.info("%s changed while loading, it will be reloaded", path)
+            with self._lock:
+                self._checked.pop(path, None)
+            return
+        with self._lock:
+            previous = self._entries.get(path)
+            self._entries[path] = (version, artifact)
+        logger.info("%s %s in %.2fs", "Reloaded" if previous else "Loaded", path,
+                    time.perf_counter() - start)
+
+    @staticmethod
+    def _log_failure(path: Path, future: Future):
+        """Keeps serving the current version when a load fails."""
+        if future.exception() is not None:
+            logger.error("Failed to load %s: %s", path, future.exception())
+
+    def evict(self, path: Path):
+        """Drops an artifact so its memory can be reclaimed."""
+        with self._lock:
+            self._entries.pop(Path(path), None)
+            self._checked.pop(Path(path), None)
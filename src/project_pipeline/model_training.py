@@ -1,14 +1,40 @@
 """ Module to perform all model processing and training steps"""
-from typing import List, Union
+import contextlib
+import itertools
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+import numpy as np
 import pandas as pd
 import xgboost as xgb
-from surprise.model_selection import cross_validate
-from surprise import Dataset, Reader, SVD
-from sklearn.model_selection import train_test_split
+from scipy import sparse
+from surprise.model_selection import KFold
+from surprise import Dataset, Reader, SVD, Trainset, accuracy
+from sklearn.base import BaseEstimator, TransformerMixin, clone
+from sklearn.model_selection import GroupShuffleSplit, train_test_split
 from sklearn.pipeline import Pipeline
 from sklearn.compose import ColumnTransformer
 from sklearn.preprocessing import StandardScaler
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.utils import check_random_state
+from sklearn.feature_extraction.text import TfidfTransformer, TfidfVectorizer
+from src.project_pipeline import save_artifacts, text_processing
+
+logger = logging.getLogger(__name__)
+
+RATING_SCALE = (0, 5)
+
+# Default budget of ``halving_search_cf``
+HALVING_BUDGET = {'eta': 3, 'min_epochs': 2, 'max_epochs': 20, 'max_fits': None,
+                  'max_seconds': None}
 
 
 def train_test_data(data:pd.DataFrame,
@@ -27,22 +53,417 @@ def train_test_data(data:pd.DataFrame,
         Tuple: A tuple containing the Surprise Dataset, training DataFrame, and testing DataFrame.
     """
     train_data, test_data = train_test_split(data, test_size = test_size, random_state=random_state)
-    reader = Reader(rating_scale=(0,5))
+    reader = Reader(rating_scale=RATING_SCALE)
     data_train_collab = Dataset.load_from_df(train_data[training_col],reader)
     return (data_train_collab, train_data, test_data)
 
 
-def collaborative_filtering(data: pd.DataFrame,
+def _build_trainset(user_codes: np.ndarray, product_codes: np.ndarray, ratings: np.ndarray,
+                    interactions: dict, raw_ids: bool) -> Trainset:
+    """Builds a surprise Trainset whose inner ids are the interaction codes.
+
+    Only users and items with ratings are known to the trainset, but the
+    factor matrices span the whole code space so the ids never need remapping.
+    """
+    ur, ir = {}, {}
+    for user, item, rating in zip(user_codes.tolist(), product_codes.tolist(), ratings.tolist()):
+        ur.setdefault(user, []).append((item, rating))
+        ir.setdefault(item, []).append((user, rating))
+    if raw_ids:
+        raw2inner_id_users = {interactions['user_ids'][user]: user for user in ur}
+        raw2inner_id_items = {interactions['product_ids'][item]: item for item in ir}
+    else:
+        raw2inner_id_users = {user: user for user in ur}
+        raw2inner_id_items = {item: item for item in ir}
+    return Trainset(ur, ir, len(interactions['user_ids']), len(interactions['product_ids']),
+                    len(ratings), RATING_SCALE, raw2inner_id_users, raw2inner_id_items)
+
+
+def _interaction_rows(interactions: dict) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Expands the CSR interactions into user codes, product codes and ratings."""
+    user_codes = np.repeat(np.arange(len(interactions['user_ids'])),
+                           np.diff(interactions['indptr']))
+    return (user_codes, np.asarray(interactions['indices']),
+            np.asarray(interactions['ratings'], dtype=np.float64))
+
+
+def interactions_trainset(interactions: dict) -> Trainset:
+    """Builds the full surprise Trainset from integer-coded interactions.
+
+    Args:
+        interactions (dict): Output of ``interactions.build_interactions``.
+
+    Returns:
+        Trainset: Trainset with raw user and product ids mapped to their codes.
+    """
+    return _build_trainset(*_interaction_rows(interactions), interactions, raw_ids=True)
+
+
+def interaction_folds(interactions: dict, cv: int,
+                      random_state: Optional[int] = None) -> List[tuple]:
+    """Splits integer-coded interactions into shuffled cross-validation folds.
+
+    The fold trainsets and testsets use the integer codes as raw ids, so no
+    string id is hashed while cross-validating.
+
+    Args:
+        interactions (dict): Output of ``interactions.build_interactions``.
+        cv (int): Number of folds.
+        random_state (Optional[int]): Seed of the shuffle.
+
+    Returns:
+        List[tuple]: One (trainset, testset) pair per fold.
+    """
+    user_codes, product_codes, ratings = _interaction_rows(interactions)
+    permutation = check_random_state(random_state).permutation(len(ratings))
+    folds = []
+    for test_rows in np.array_split(permutation, cv):
+        train_mask = np.ones(len(ratings), dtype=bool)
+        train_mask[test_rows] = False
+        trainset = _build_trainset(user_codes[train_mask], product_codes[train_mask],
+                                   ratings[train_mask], interactions, raw_ids=False)
+        testset = list(zip(user_codes[test_rows].tolist(), product_codes[test_rows].tolist(),
+                           ratings[test_rows].tolist()))
+        folds.append((trainset, testset))
+    return folds
+
+
+def _evaluate_candidate(params: Dict[str, float], folds: list, random_state: Optional[int]) -> dict:
+    """Cross-validates one SVD parameter combination on precomputed folds.
+
+    Args:
+        params (Dict[str, float]): SVD parameters of the candidate.
+        folds (list): List of (trainset, testset) pairs shared by every candidate.
+        random_state (Optional[int]): Seed for the SVD factor initialisation.
+
+    Returns:
+        dict: The candidate parameters, mean RMSE across folds and total fit time.
+    """
+    fit_time = 0.0
+    fold_rmse = []
+    for trainset, testset in folds:
+        algo = SVD(**params, random_state=random_state, verbose=False)
+        start = time.perf_counter()
+        algo.fit(trainset)
+        fit_time += time.perf_counter() - start
+        fold_rmse.append(accuracy.rmse(algo.test(testset), verbose=False))
+    return {'params': params, 'rmse': float(np.mean(fold_rmse)), 'fit_time': fit_time}
+
+
+_WORKER_FOLDS = None
+
+
+def _init_worker(folds: list):
+    """Stores the shared folds once per worker process."""
+    global _WORKER_FOLDS  # pylint: disable=global-statement
+    _WORKER_FOLDS = folds
+
+
+def _evaluate_in_worker(params: Dict[str, float], random_state: Optional[int],
+                        n_folds: Optional[int] = None) -> dict:
+    """Evaluates a candidate on the first ``n_folds`` folds held by the worker process."""
+    return _evaluate_candidate(params, _WORKER_FOLDS[:n_folds], random_state)
+
+
+def _grid_candidates(param_grid: Dict[str, list]) -> List[dict]:
+    """Expands a parameter grid into its combinations, in grid order."""
+    return [dict(zip(param_grid, values)) for values in itertools.product(*param_grid.values())]
+
+
+def _cv_folds(data, cv: int, random_state: Optional[int]) -> list:
+    """Splits a surprise Dataset or integer-coded interactions into (trainset, testset) folds."""
+    if isinstance(data, dict):
+        return interaction_folds(data, cv, random_state)
+    return list(KFold(n_splits=cv, random_state=random_state, shuffle=True).split(data))
+
+
+def grid_search_cf(data,
+                   param_grid: Dict[str, list],
+                   cv: int = 5,
+                   n_jobs: int = 1,
+                   random_state: Optional[int] = None) -> List[dict]:
+    """Cross-validates every SVD parameter combination of a grid.
+
+    The fold splits are generated once and shared by all candidates, so with
+    a fixed ``random_state`` the results do not depend on ``n_jobs``.
+
+    Args:
+        data (Union[Dataset, dict]): The surprise Dataset with the user-item
+            interactions, or the integer-coded interactions.
+        param_grid (Dict[str, list]): Values to try for each SVD parameter.
+        cv (int): Number of cross-validation folds.
+        n_jobs (int): Number of worker processes; -1 uses every core, 1 runs serially.
+        random_state (Optional[int]): Seed for the fold splits and SVD initialisation.
+
+    Returns:
+        List[dict]: Per-candidate parameters, mean RMSE and fit time, in grid order.
+    """
+    candidates = _grid_candidates(param_grid)
+    folds = _cv_folds(data, cv, random_state)
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+
+    if n_jobs == 1:
+        results = [_evaluate_candidate(params, folds, random_state) for params in candidates]
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(candidates)),
+                                 initializer=_init_worker, initargs=(folds,)) as executor:
+            results = list(executor.map(_evaluate_in_worker, candidates,
+                                        itertools.repeat(random_state)))
+
+    for result in results:
+        logger.info('SVD %s: RMSE %.4f, fit time %.2fs',
+                    result['params'], result['rmse'], result['fit_time'])
+    return results
+
+
+def halving_schedule(n_candidates: int, cv: int, eta: int = 3, min_epochs: int = 2,
+                     max_epochs: int = 20) -> List[dict]:
+    """Plans the rungs of a successive halving search.
+
+    Each rung keeps the best ``1 / eta`` of the previous one and gives the
+    survivors ``eta`` times more folds and epochs, up to a last rung that
+    cross-validates on every fold with ``max_epochs`` epochs, like the grid.
+    As in scikit-learn's ``HalvingGridSearchCV``, the number of rungs is
+    bounded by the ratio of ``max_epochs`` to ``min_epochs``, so the last
+    rung may compare several candidates.
+
+    Args:
+        n_candidates (int): Number of parameter combinations.
+        cv (int): Number of cross-validation folds of the last rung.
+        eta (int): Reduction factor between rungs.
+        min_epochs (int): Fewest SGD epochs of a fit.
+        max_epochs (int): SGD epochs of the last rung and of the final model.
+
+    Returns:
+        List[dict]: Number of candidates, folds and epochs of every rung.
+    """
+    n_rungs = 1
+    while eta ** n_rungs < n_candidates and min_epochs * eta ** n_rungs <= max_epochs:
+        n_rungs += 1
+    schedule = []
+    for rung in range(n_rungs):
+        fraction = float(eta) ** (rung - n_rungs + 1)
+        schedule.append({
+            'candidates': int(np.ceil(n_candidates / eta ** rung)),
+            'folds': max(1, int(np.ceil(cv * fraction))),
+            'n_epochs': max(min_epochs, int(round(max_epochs * fraction))),
+        })
+    return schedule
+
+
+def _budget_stop(rungs: List[dict], rung_fits: int, n_epochs: int, elapsed: float,
+                 budget: dict) -> Optional[str]:
+    """Returns the budget limit the next rung would overrun, or None.
+
+    Args:
+        rungs (List[dict]): The rungs that ran, with their fits and seconds.
+        rung_fits (int): Fold fits of the next rung.
+        n_epochs (int): SGD epochs of each fit of the next rung.
+        elapsed (float): Seconds since the search started.
+        budget (dict): The search budget, with "max_fits" and "max_seconds".
+
+    Returns:
+        Optional[str]: "max_fits", "max_seconds" or None.
+    """
+    fits = sum(rung['fits'] for rung in rungs)
+    # Seconds per epoch of one fold fit, measured on the previous rung
+    pace = rungs[-1]['seconds'] / (rungs[-1]['fits'] * rungs[-1]['n_epochs'])
+    if budget['max_fits'] is not None and fits + rung_fits > budget['max_fits']:
+        return 'max_fits'
+    if (budget['max_seconds'] is not None
+            and elapsed + pace * rung_fits * n_epochs > budget['max_seconds']):
+        return 'max_seconds'
+    return None
+
+
+def _evaluate_rung(executor: Optional[ProcessPoolExecutor], survivors: List[dict], plan: dict,
+                   folds: list, random_state: Optional[int]) -> List[dict]:
+    """Cross-validates the survivors of a rung, best first, serially without an executor."""
+    rung_params = [dict(params, n_epochs=plan['n_epochs']) for params in survivors]
+    if executor is None:
+        results = [_evaluate_candidate(params, folds[:plan['folds']], random_state)
+                   for params in rung_params]
+    else:
+        results = list(executor.map(_evaluate_in_worker, rung_params,
+                                    itertools.repeat(random_state),
+                                    itertools.repeat(plan['folds'])))
+    results = [dict(result, params=params) for result, params in zip(results, survivors)]
+    results.sort(key=lambda result: result['rmse'])
+    return results
+
+
+def _run_rungs(candidates: List[dict], schedule: List[dict], folds: list, *,
+               executor: Optional[ProcessPoolExecutor], random_state: Optional[int],
+               budget: dict, start: float) -> Tuple[List[dict], List[dict], Optional[str]]:
+    """Runs the rungs of a halving search until the last one or the budget.
+
+    Returns:
+        Tuple[List[dict], List[dict], Optional[str]]: The results of the last
+        rung that ran, best first, every rung that ran, and the budget limit
+        that stopped the search, if any.
+    """
+    rungs, results = [], []
+    for rung, plan in enumerate(schedule):
+        survivors = candidates[:plan['candidates']]
+        rung_fits = len(survivors) * plan['folds']
+        if rung > 0:
+            stopped_by = _budget_stop(rungs, rung_fits, plan['n_epochs'],
+                                      time.perf_counter() - start, budget)
+            if stopped_by:
+                logger.info('SVD search stopped before rung %d by %s', rung, stopped_by)
+                return results, rungs, stopped_by
+
+        rung_start = time.perf_counter()
+        results = _evaluate_rung(executor, survivors, plan, folds, random_state)
+        candidates = [result['params'] for result in results]
+        rungs.append(dict(plan, fits=rung_fits, seconds=time.perf_counter() - rung_start,
+                          best_rmse=results[0]['rmse']))
+        logger.info('SVD rung %d: %d candidates on %d folds with %d epochs, best %s '
+                    'RMSE %.4f', rung, len(survivors), plan['folds'], plan['n_epochs'],
+                    results[0]['params'], results[0]['rmse'])
+    return results, rungs, None
+
+
+def _halving_report(results: List[dict], rungs: List[dict], stopped_by: Optional[str], *,
+                    cv: int, budget: dict, start: float) -> dict:
+    """Reports a halving search with the fits and epochs saved against the grid search."""
+    fits = sum(rung['fits'] for rung in rungs)
+    epochs = sum(rung['fits'] * rung['n_epochs'] for rung in rungs)
+    # The first rung always runs, on every candidate
+    grid_fits = rungs[0]['candidates'] * cv
+    report = {
+        'strategy': 'halving',
+        'eta': budget['eta'],
+        'best_params': dict(results[0]['params'], n_epochs=budget['max_epochs']),
+        'best_rmse': results[0]['rmse'],
+        'best_folds': rungs[-1]['folds'],
+        'best_epochs': rungs[-1]['n_epochs'],
+        'completed': stopped_by is None,
+        'stopped_by': stopped_by,
+        'rungs': rungs,
+        'results': [{'params': result['params'], 'rmse': result['rmse']} for result in results],
+        'fits': fits,
+        'grid_fits': grid_fits,
+        'fits_saved': grid_fits - fits,
+        'epochs': epochs,
+        'grid_epochs': grid_fits * budget['max_epochs'],
+        'epochs_saved': grid_fits * budget['max_epochs'] - epochs,
+        'seconds': time.perf_counter() - start,
+    }
+    logger.info('SVD search ran %d of %d grid fits (%d of %d epochs) in %.2fs',
+                fits, grid_fits, epochs, report['grid_epochs'], report['seconds'])
+    return report
+
+
+def halving_search_cf(data,
+                      param_grid: Dict[str, list],
+                      *,
+                      cv: int = 5,
+                      n_jobs: int = 1,
+                      random_state: Optional[int] = None,
+                      budget: Optional[dict] = None) -> dict:
+    """Searches the SVD parameter grid with successive halving.
+
+    Every combination is first fitted on a few folds with few epochs, and
+    only the best ``1 / eta`` move on to the next rung; see
+    ``halving_schedule``. Rungs share the folds of the grid search, taking
+    the first ones. The search stops before a rung that would exceed
+    ``max_fits`` fold fits, or that is expected to end past ``max_seconds``
+    going by the previous rung, and then picks the best candidate of the
+    last rung that ran. The first rung always runs.
+
+    Args:
+        data (Union[Dataset, dict]): The surprise Dataset with the user-item
+            interactions, or the integer-coded interactions.
+        param_grid (Dict[str, list]): Values to try for each SVD parameter.
+        cv (int): Number of cross-validation folds.
+        n_jobs (int): Number of worker processes; -1 uses every core, 1 runs serially.
+        random_state (Optional[int]): Seed for the fold splits and SVD initialisation.
+        budget (Optional[dict]): Overrides of ``HALVING_BUDGET``: the reduction
+            factor ``eta`` between rungs, the fewest SGD epochs ``min_epochs``
+            of a fit, the epochs ``max_epochs`` of the last rung and of the
+            final model, and the most fold fits ``max_fits`` and wall time
+            ``max_seconds`` of the whole search.
+
+    Returns:
+        dict: Search report with the best parameters, its RMSE, every rung and
+        the fits and epochs saved against the grid search.
+    """
+    start = time.perf_counter()
+    budget = {**HALVING_BUDGET, **(budget or {})}
+    candidates = _grid_candidates(param_grid)
+    schedule = halving_schedule(len(candidates), cv, budget['eta'], budget['min_epochs'],
+                                budget['max_epochs'])
+    folds = _cv_folds(data, cv, random_state)
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+
+    pool = contextlib.nullcontext()
+    if n_jobs > 1:
+        pool = ProcessPoolExecutor(max_workers=min(n_jobs, len(candidates)),
+                                   initializer=_init_worker, initargs=(folds,))
+    with pool as executor:
+        results, rungs, stopped_by = _run_rungs(candidates, schedule, folds, executor=executor,
+                                                random_state=random_state, budget=budget,
+                                                start=start)
+    return _halving_report(results, rungs, stopped_by, cv=cv, budget=budget, start=start)
+
+
+def save_search_report(report: dict, report_file: Path):
+    """Writes a hyperparameter search report atomically as JSON.
+
+    Args:
+        report (dict): Search report from ``collaborative_filtering``.
+        report_file (Path): Destination file.
+    """
+    save_artifacts.save_json(report, report_file)
+    logger.info('Saved search report to path %s successfully!', report_file)
+
+
+def _grid_search_report(data, param_grid: Dict[str, list], cv: int, n_jobs: int,
+                        random_state: Optional[int]) -> dict:
+    """Runs the grid search and reports it in the format of ``halving_search_cf``."""
+    start = time.perf_counter()
+    results = grid_search_cf(data, param_grid, cv=cv, n_jobs=n_jobs, random_state=random_state)
+    # Find the parameter combination with the least RMSE
+    best = min(results, key=lambda result: result['rmse'])
+    grid_fits = len(results) * cv
+    return {'strategy': 'grid', 'best_params': best['params'], 'best_rmse': best['rmse'],
+            'results': [{'params': result['params'], 'rmse': result['rmse']}
+                        for result in results],
+            'fits': grid_fits, 'grid_fits': grid_fits, 'fits_saved': 0,
+            'seconds': time.perf_counter() - start}
+
+
+def collaborative_filtering(data: Union[Dataset, dict],
                             n_factors_list: List[int],
                             lr_all_list: List[float],
-                            reg_all_list: List[float]):
+                            reg_all_list: List[float],
+                            *,
+                            cv: int = 5,
+                            n_jobs: int = 1,
+                            random_state: Optional[int] = None,
+                            strategy: str = 'grid',
+                            budget: Optional[dict] = None,
+                            report_file: Optional[Path] = None):
     """Perform collaborative filtering using Singular Value Decomposition (SVD).
 
         Args:
-            data (pd.DataFrame): The DataFrame containing the user-item interactions.
+            data (Union[Dataset, dict]): The surprise Dataset with the user-item
+                interactions, or the integer-coded interactions, whose codes then
+                become the model's inner ids.
             n_factors_list (List[int]): The list of numbers of factors to try.
             lr_all_list (List[float]): The list of learning rates for all parameters to try.
             reg_all_list (List[float]): The list of regularization terms for all parameters to try.
+            cv (int): Number of cross-validation folds.
+            n_jobs (int): Number of worker processes for the search.
+            random_state (Optional[int]): Seed for reproducible folds and fits.
+            strategy (str): "grid" to cross-validate every combination, or
+                "halving" for a successive halving search.
+            budget (Optional[dict]): Budget of ``halving_search_cf``: eta,
+                min_epochs, max_epochs, max_fits and max_seconds.
+            report_file (Optional[Path]): Where to write the search report as JSON.
 
         Returns:
             SVD: The trained collaborative filtering model.
@@ -52,45 +473,393 @@ def collaborative_filtering(data: pd.DataFrame,
         'lr_all': lr_all_list,
         'reg_all': reg_all_list
     }
-    rmse_results_svd = {}
+    if strategy == 'halving':
+        report = halving_search_cf(data, param_grid, cv=cv, n_jobs=n_jobs,
+                                   random_state=random_state, budget=budget)
+    elif strategy == 'grid':
+        report = _grid_search_report(data, param_grid, cv, n_jobs, random_state)
+    else:
+        raise ValueError(f'Unknown search strategy: {strategy}')
+    best_params_svd = report['best_params']
+    logger.info('Best SVD parameters: %s', best_params_svd)
+    if report_file is not None:
+        save_search_report(report, report_file)
 
-    for n_factors in param_grid['n_factors']:
-        for lr_all in param_grid['lr_all']:
-            for reg_all in param_grid['reg_all']:
-                # Set algorithm parameters
-                algo = SVD(n_factors=n_factors, lr_all=lr_all, reg_all=reg_all, verbose=False)
+    # Re-train the best model on the full dataset
+    best_model = SVD(**best_params_svd, random_state=random_state)
+    if isinstance(data, dict):
+        trainset = interactions_trainset(data)
+    else:
+        trainset = data.build_full_trainset()
+    best_model.fit(trainset)
 
-                # Perform cross-validation
-                cv_results = cross_validate(algo, data, measures=['RMSE'], cv=5, verbose=False)
+    return best_model
 
-                # Calculate mean RMSE across folds
-                mean_rmse = cv_results['test_rmse'].mean()
 
-                # Store the RMSE for this parameter combination
-                rmse_results_svd[(n_factors, lr_all, reg_all)] = mean_rmse
+class HashedTermCounts(BaseEstimator, TransformerMixin):
+    """Stateless text step hashing each distinct text into term counts once per process.
 
-    # Find the parameter combination with the least RMSE
-    best_params_svd = min(rmse_results_svd, key=rmse_results_svd.get)
+    Feeding a ``TfidfTransformer``, it replaces a ``TfidfVectorizer`` whose
+    vocabulary must be refitted and every text re-tokenized at each fit and
+    predict; see ``text_processing.hashed_counts``.
+    """
 
-    # Re-train the best model on the full dataset
-    best_model = SVD(n_factors=best_params_svd[0],
-                     lr_all=best_params_svd[1],
-                     reg_all=best_params_svd[2])
-    trainset = data.build_full_trainset()
-    best_model.fit(trainset)
+    def __init__(self, n_features: int = 2 ** 18, n_jobs: int = 1):
+        self.n_features = n_features
+        self.n_jobs = n_jobs
 
-    return best_model
+    def fit(self, x, y=None):  # pylint: disable=unused-argument
+        """Nothing to learn: the hashing is fixed by ``n_features``."""
+        return self
+
+    def transform(self, x):
+        """Returns the hashed term counts of a column of texts."""
+        texts = x.iloc[:, 0] if isinstance(x, pd.DataFrame) else x
+        return text_processing.hashed_counts(texts, self.n_features, self.n_jobs)
+
+
+def text_transformer(text_features: Optional[dict] = None) -> Pipeline:
+    """Builds the text step of the content-based preprocessing.
+
+    Args:
+        text_features (Optional[dict]): The 'text_features' section of the CBF
+            config; ``vectorizer: hashing`` selects ``HashedTermCounts``.
+
+    Returns:
+        Pipeline: A TF-IDF vectorizer, or hashed counts weighted by TF-IDF.
+    """
+    if text_features is None or text_features['vectorizer'] == 'tfidf':
+        return Pipeline(steps=[('tfidf', TfidfVectorizer())])
+    if text_features['vectorizer'] != 'hashing':
+        raise ValueError(f"Unknown text vectorizer {text_features['vectorizer']}")
+    return Pipeline(steps=[
+        ('hashing', HashedTermCounts(text_features['n_features'],
+                                     text_features.get('n_jobs', 1))),
+        ('tfidf', TfidfTransformer())
+    ])
+
+
+def _idf(document_frequency: np.ndarray, n_documents: int, smooth_idf: bool) -> np.ndarray:
+    """Computes inverse document frequencies as ``TfidfTransformer.fit`` does."""
+    document_frequency = document_frequency.astype(np.float64) + float(smooth_idf)
+    idf = np.full_like(document_frequency, n_documents + int(smooth_idf))
+    idf /= document_frequency
+    np.log(idf, out=idf)
+    return idf + 1.0
+
+
+def _refit_hashed_tfidf(step: Pipeline, column_batches) -> Tuple[object, int, int, bool]:
+    """Refits the IDF weights of hashed term counts from the batches of texts."""
+    hashing, tfidf = step.steps[0][1], step.steps[1][1]
+    document_frequency = np.zeros(hashing.n_features, dtype=np.int64)
+    n_documents = 0
+    for texts in column_batches():
+        counts = hashing.transform(texts)
+        document_frequency += np.bincount(counts.indices, minlength=hashing.n_features)
+        n_documents += counts.shape[0]
+    tfidf.n_features_in_ = hashing.n_features
+    if tfidf.use_idf:
+        tfidf.idf_ = _idf(document_frequency, n_documents, tfidf.smooth_idf)
+    return step, int(document_frequency.sum()), hashing.n_features, True
+
+
+def _refit_vectorizer(step: TfidfVectorizer, column_batches) -> Tuple[object, int, int, bool]:
+    """Refits the vocabulary and IDF weights of a TF-IDF vectorizer from the batches of texts."""
+    if (step.min_df, step.max_df, step.max_features) != (1, 1.0, None):
+        raise ValueError('Batched TF-IDF fits do not support vocabulary limits')
+    analyzer = step.build_analyzer()
+    document_frequency = Counter()
+    n_documents = 0
+    for texts in column_batches():
+        for text in texts:
+            document_frequency.update(set(analyzer(text)))
+        n_documents += len(texts)
+    # The vocabulary is numbered in term order, as TfidfVectorizer.fit does
+    terms = sorted(document_frequency)
+    step.vocabulary_ = {term: number for number, term in enumerate(terms)}
+    counts = np.array([document_frequency[term] for term in terms], dtype=np.int64)
+    if step.use_idf:
+        step.idf_ = _idf(counts, n_documents, step.smooth_idf)
+    return step, int(counts.sum()), len(terms), True
+
+
+def _refit_scaler(step: StandardScaler, column_batches) -> Tuple[object, int, int, bool]:
+    """Refits a scaler incrementally from the batches of its columns."""
+    scaler = clone(step)
+    n_rows = 0
+    for columns in column_batches():
+        scaler.partial_fit(columns)
+        n_rows += len(columns)
+    return scaler, n_rows * scaler.n_features_in_, scaler.n_features_in_, False
+
+
+def _refit_in_batches(step, column_batches) -> Tuple[object, int, int, bool]:
+    """Refits one step of the ColumnTransformer from batches of its input columns.
+
+    The vocabulary, document frequencies and scaling statistics are
+    accumulated batch by batch, so the transformed training matrix is never
+    built. The result matches fitting the step on all the rows at once.
+
+    Args:
+        step: Step fitted by the ColumnTransformer on a first batch.
+        column_batches (Callable[[], Iterable]): Returns a fresh iterator over
+            the batches of the step's input columns.
+
+    Returns:
+        Tuple[object, int, int, bool]: The refitted step, the number of
+        non-zero values and of columns it outputs, and whether they are sparse.
+    """
+    kinds = [type(part).__name__ for _, part in step.steps] if hasattr(step, 'steps') else []
+    if len(kinds) == 1:
+        inner, *output = _refit_in_batches(step.steps[0][1], column_batches)
+        step.steps[0] = (step.steps[0][0], inner)
+        return (step, *output)
+    if kinds == ['HashedTermCounts', 'TfidfTransformer']:
+        return _refit_hashed_tfidf(step, column_batches)
+    if isinstance(step, TfidfVectorizer):
+        return _refit_vectorizer(step, column_batches)
+    if isinstance(step, StandardScaler):
+        return _refit_scaler(step, column_batches)
+    raise ValueError(f'Step {type(step).__name__} cannot be fitted in batches')
+
+
+def fit_in_batches(preprocessor: ColumnTransformer, x_train: pd.DataFrame,
+                   batch_rows: int) -> ColumnTransformer:
+    """Fits the content-based preprocessing without transforming every row at once.
+
+    The ColumnTransformer is fitted on the first batch to set up its
+    columns, then each step is refitted over all the batches; see
+    ``_refit_in_batches``. Whether the output is sparse is decided on the
+    density of all the rows, as ``ColumnTransformer.fit`` does.
+
+    Args:
+        preprocessor (ColumnTransformer): Unfitted feature transformer.
+        x_train (pd.DataFrame): Training rows.
+        batch_rows (int): Number of rows per batch.
+
+    Returns:
+        ColumnTransformer: The fitted preprocessor.
+    """
+    preprocessor.fit(x_train.iloc[:batch_rows])
+    fitted, outputs = [], []
+    for name, step, columns in preprocessor.transformers_:
+        if name == 'remainder' or step == 'drop':
+            fitted.append((name, step, columns))
+            continue
+        step, nonzero, width, is_sparse = _refit_in_batches(
+            step, lambda columns=columns: (x_train[columns].iloc[start:start + batch_rows]
+                                           for start in range(0, len(x_train), batch_rows)))
+        fitted.append((name, step, columns))
+        outputs.append((name, nonzero, width, is_sparse))
+    preprocessor.transformers_ = fitted
+
+    offset = 0
+    for name, _, width, _ in outputs:
+        preprocessor.output_indices_[name] = slice(offset, offset + width)
+        offset += width
+    density = sum(nonzero for _, nonzero, _, _ in outputs) / max(len(x_train) * offset, 1)
+    preprocessor.sparse_output_ = bool(any(is_sparse for *_, is_sparse in outputs)
+                                       and density < preprocessor.sparse_threshold)
+    return preprocessor
+
+
+def cbf_feature_batches(preprocessor: ColumnTransformer, x_train: pd.DataFrame,
+                        y_train: pd.Series, feature_dir: Path, batch_rows: int) -> dict:
+    """Fits the preprocessing once and stores the transformed rows in batches.
+
+    The preprocessing is fitted in a streaming pass over the batches, then
+    each batch is transformed and written in turn, so the transformed
+    training matrix is never held in memory. When ``feature_dir`` already holds the batches of a previous run they are
+    reused and the fitted preprocessor is loaded instead of refitting TF-IDF.
+    Sparse batches are stored as .npz, dense ones as .npy, so XGBoost sees
+    the same missing values as the in-memory pipeline.
+
+    Args:
+        preprocessor (ColumnTransformer): Unfitted feature transformer.
+        x_train (pd.DataFrame): Training rows.
+        y_train (pd.Series): Training ratings.
+        feature_dir (Path): Directory holding the cached batches.
+        batch_rows (int): Number of rows per batch.
+
+    Returns:
+        dict: The fitted preprocessor, the directory, the number of batches
+        and whether the features are sparse.
+    """
+    meta_file = feature_dir / 'meta.json'
+    if meta_file.exists():
+        logger.info('Using cached content-based features from %s', feature_dir)
+    else:
+        preprocessor = fit_in_batches(preprocessor, x_train, batch_rows)
+        labels = y_train.to_numpy(dtype=np.float32)
+        is_sparse = preprocessor.sparse_output_
+        temp_dir = feature_dir.with_name(f'.{feature_dir.name}.{uuid.uuid4().hex}')
+        temp_dir.mkdir(parents=True)
+        n_batches = 0
+        for start in range(0, len(x_train), batch_rows):
+            batch = preprocessor.transform(x_train.iloc[start:start + batch_rows])
+            if is_sparse:
+                sparse.save_npz(temp_dir / f'features-{n_batches:05d}.npz', batch.tocsr(),
+                                compressed=False)
+            else:
+                np.save(temp_dir / f'features-{n_batches:05d}.npy', batch)
+            np.save(temp_dir / f'labels-{n_batches:05d}.npy', labels[start:start + batch_rows])
+            n_batches += 1
+        with open(temp_dir / 'preprocessor.pkl', 'wb') as file:
+            pickle.dump(preprocessor, file)
+        with open(temp_dir / 'meta.json', 'w', encoding='utf8') as file:
+            json.dump({'n_batches': n_batches, 'batch_rows': batch_rows, 'sparse': is_sparse,
+                       'n_rows': len(x_train)}, file)
+        shutil.rmtree(feature_dir, ignore_errors=True)
+        os.replace(temp_dir, feature_dir)
+        logger.info('Cached %d content-based feature batches in %s', n_batches, feature_dir)
+
+    with open(meta_file, encoding='utf8') as file:
+        meta = json.load(file)
+    with open(feature_dir / 'preprocessor.pkl', 'rb') as file:
+        meta['preprocessor'] = pickle.load(file)
+    meta['feature_dir'] = feature_dir
+    return meta
+
+
+def _load_feature_batch(batches: dict, number: int):
+    """Loads the features and labels of one cached batch."""
+    feature_dir = batches['feature_dir']
+    if batches['sparse']:
+        features = sparse.load_npz(feature_dir / f'features-{number:05d}.npz')
+    else:
+        features = np.load(feature_dir / f'features-{number:05d}.npy')
+    return features, np.load(feature_dir / f'labels-{number:05d}.npy')
+
+
+class _FeatureBatchIter(xgb.DataIter):
+    """Feeds the cached training batches to an external-memory DMatrix."""
+
+    def __init__(self, batches: dict, train_masks: List[np.ndarray], cache_prefix: str):
+        self._batches = batches
+        self._train_masks = train_masks
+        self._position = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data) -> int:  # pylint: disable=arguments-renamed
+        """Passes the next batch to XGBoost; returns 0 once every batch was read."""
+        if self._position == self._batches['n_batches']:
+            return 0
+        features, labels = _load_feature_batch(self._batches, self._position)
+        mask = self._train_masks[self._position]
+        input_data(data=features[mask], label=labels[mask])
+        self._position += 1
+        return 1
+
+    def reset(self):
+        """Restarts the iteration at the first batch."""
+        self._position = 0
+
+
+def _validation_rows(products: np.ndarray, validation_size: float,
+                     random_state: Optional[int]) -> np.ndarray:
+    """Picks the early-stopping rows, holding out whole products.
+
+    The user split gives every reviewer of a product a near-duplicate row,
+    so a random row split would validate on copies of training rows.
+    """
+    codes, uniques = pd.factorize(products)
+    valid_rows = np.zeros(len(codes), dtype=bool)
+    if validation_size > 0 and len(uniques) > 1:
+        splitter = GroupShuffleSplit(n_splits=1, test_size=validation_size,
+                                     random_state=random_state)
+        _, valid = next(splitter.split(codes, groups=codes))
+        valid_rows[valid] = True
+    return valid_rows
+
+
+def _training_matrices(batches: dict, valid_rows: np.ndarray, cache_dir: Path,
+                       external_memory: bool) -> Tuple[xgb.DMatrix, Optional[xgb.DMatrix]]:
+    """Builds the training DMatrix and the early-stopping DMatrix, None without validation rows.
+
+    With ``external_memory`` the training rows are streamed from the cached
+    batches and only the validation rows are loaded.
+    """
+    train_masks = [~valid_rows[start:start + batches['batch_rows']]
+                   for start in range(0, batches['n_rows'], batches['batch_rows'])]
+    stack = sparse.vstack if batches['sparse'] else np.vstack
+    valid_parts, valid_labels = [], []
+    if external_memory:
+        if valid_rows.any():
+            for number, mask in enumerate(train_masks):
+                features, labels = _load_feature_batch(batches, number)
+                valid_parts.append(features[~mask])
+                valid_labels.append(labels[~mask])
+        dtrain = xgb.DMatrix(_FeatureBatchIter(batches, train_masks,
+                                               str(cache_dir / 'xgb_cache')))
+    else:
+        loaded = [_load_feature_batch(batches, number) for number in range(batches['n_batches'])]
+        features = stack([part for part, _ in loaded])
+        labels = np.concatenate([part for _, part in loaded])
+        if batches['sparse']:
+            features = features.tocsr()
+        dtrain = xgb.DMatrix(features[~valid_rows], label=labels[~valid_rows])
+        valid_parts, valid_labels = [features[valid_rows]], [labels[valid_rows]]
+
+    if not valid_rows.any():
+        return dtrain, None
+    return dtrain, xgb.DMatrix(stack(valid_parts), label=np.concatenate(valid_labels))
+
+
+def _train_booster(batches: dict, training: dict, cache_dir: Path,
+                   products: np.ndarray) -> xgb.XGBRegressor:
+    """Trains the XGBoost model on cached batches with early stopping on held-out products."""
+    valid_rows = _validation_rows(products, training['validation_size'],
+                                  training['random_state'])
+    dtrain, dvalid = _training_matrices(batches, valid_rows, cache_dir,
+                                        training['external_memory'])
+    n_jobs = training['n_jobs']
+    params = {
+        'objective': 'reg:squarederror',
+        'tree_method': training['tree_method'],
+        'nthread': os.cpu_count() if n_jobs == -1 else n_jobs,
+        'eta': training['learning_rate'],
+        'max_depth': training['max_depth'],
+        'max_bin': training['max_bin'],
+        'seed': training['random_state'],
+    }
+    evals = [] if dvalid is None else [(dvalid, 'validation')]
+    booster = xgb.train(params, dtrain, num_boost_round=training['n_estimators'],
+                        evals=evals,
+                        early_stopping_rounds=training['early_stopping_rounds'] if evals else None,
+                        verbose_eval=False)
+    if evals:
+        logger.info('XGBoost stopped at iteration %s with validation RMSE %.4f',
+                    booster.attr('best_iteration'), float(booster.attr('best_score')))
+
+    # Wrap the booster so the pipeline keeps the scikit-learn interface
+    regressor = xgb.XGBRegressor(n_jobs=n_jobs)
+    regressor.load_model(booster.save_raw('ubj'))
+    return regressor
 
 
 def content_base_filtering(numeric_features: List[str],
                            text_feature: Union[str,List[str]],
-                           train_data):
+                           train_data,
+                           *,
+                           training: Optional[dict] = None,
+                           feature_dir: Optional[Path] = None,
+                           text_features: Optional[dict] = None):
     """Train a content-based filtering model using XGBoost.
 
+    Without ``training`` a default XGBRegressor is fitted on the full pipeline.
+    With it, the TF-IDF features are computed once and cached in batches,
+    XGBoost uses the configured tree method and threads, stops early on the
+    rows of a held-out share of the products of ``train_data`` and, with ``external_memory``, streams
+    the batches from disk instead of holding them in a DMatrix in RAM.
+
     Args:
         numeric_features (List[str]): List of column names for numeric features.
         text_feature (Union[str, List[str]]): Column name(s) for text feature(s).
         train_data (pd.DataFrame): DataFrame containing training data.
+        training (Optional[dict]): The 'training' section of the CBF config.
+        feature_dir (Optional[Path]): Directory caching the transformed features;
+            a temporary directory is used when not given.
+        text_features (Optional[dict]): The 'text_features' section of the CBF config.
 
     Returns:
         Pipeline: Trained content-based filtering model pipeline.
@@ -100,26 +869,32 @@ def content_base_filtering(numeric_features: List[str],
         ('scaler', StandardScaler())
     ])
 
-    text_transformer = Pipeline(steps=[
-        ('tfidf', TfidfVectorizer())
-    ])
-
     # Combine preprocessing pipelines into one ColumnTransformer
     preprocessor = ColumnTransformer(
         transformers=[
             ('num', numeric_transformer, numeric_features),
-            ('text', text_transformer, text_feature)
+            ('text', text_transformer(text_features), text_feature)
         ])
 
+    x_train = train_data.drop(columns=['rating'])
+    y_train = train_data['rating']
+
+    if training is not None:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            batches = cbf_feature_batches(preprocessor, x_train, y_train,
+                                          feature_dir or Path(temp_dir) / 'features',
+                                          training['batch_rows'])
+            xgb_model = _train_booster(batches, training, Path(temp_dir),
+                                       train_data['product_id'].to_numpy())
+        return Pipeline(steps=[('preprocessor', batches['preprocessor']),
+                               ('xgb_model', xgb_model)])
+
     # Append XGBoost regressor to the preprocessing pipeline
     xgb_model = xgb.XGBRegressor()
 
     # Create the full pipeline
     pipeline = Pipeline(steps=[('preprocessor', preprocessor), ('xgb_model', xgb_model)])
 
-    x_train = train_data.drop(columns=['rating'])
-    y_train = train_data['rating']
-
     # Train the model
     pipeline.fit(x_train, y_train)
 
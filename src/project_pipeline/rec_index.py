@@ -0,0 +1,160 @@
+""" Module to precompute and serve top-N recommendations for known users"""
+import logging
+from pathlib import Path
+from typing import Optional
+import numpy as np
+import pandas as pd
+from src.project_pipeline import cbf_features, cf_scoring, save_artifacts
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILES = ("users", "offsets", "items", "scores", "products")
+
+
+def save_index(users: np.ndarray, offsets: np.ndarray, items: np.ndarray,
+               scores: np.ndarray, products: np.ndarray, *, index_dir: Path):
+    """Writes a top-N index as one .npy file per array so it can be memory-mapped.
+
+    Row ``i`` of ``users`` owns ``items[offsets[i]:offsets[i + 1]]`` and the
+    matching slice of ``scores``; item entries are positions in ``products``.
+
+    Args:
+        users (np.ndarray): Raw user ids, one per index row.
+        offsets (np.ndarray): Start of each user's slice, with a final end offset.
+        items (np.ndarray): Packed product positions of every user's top-N.
+        scores (np.ndarray): Packed predicted ratings aligned with ``items``.
+        products (np.ndarray): Raw product ids referenced by ``items``.
+        index_dir (Path): Directory where the index is written.
+    """
+    index_dir.mkdir(exist_ok=True, parents=True)
+    arrays = {
+        "users": np.asarray(users, dtype=str),
+        "offsets": np.asarray(offsets, dtype=np.int64),
+        "items": np.asarray(items, dtype=np.int32),
+        "scores": np.asarray(scores, dtype=np.float32),
+        "products": np.asarray(products, dtype=str),
+    }
+    for name, array in arrays.items():
+        save_artifacts.save_array(array, index_dir / f"{name}.npy")
+    logger.info("Saved top-N index for %d users to path %s successfully!",
+                len(arrays["users"]), index_dir)
+
+
+def _pack(users, product_ids, score_batches, top_n: int, index_dir: Path):
+    """Packs per-batch score matrices into a top-N index and saves it."""
+    offsets = [0]
+    items, scores = [], []
+    for batch_scores in score_batches:
+        indices, values = cf_scoring.top_k(batch_scores, top_n)
+        for row_indices, row_values in zip(indices, values):
+            valid = np.isfinite(row_values)
+            items.append(row_indices[valid])
+            scores.append(row_values[valid])
+            offsets.append(offsets[-1] + int(valid.sum()))
+    save_index(users,
+               np.asarray(offsets),
+               np.concatenate(items) if items else np.empty(0),
+               np.concatenate(scores) if scores else np.empty(0),
+               product_ids, index_dir=index_dir)
+
+
+def build_cf_index(model, df_with_one_hot: pd.DataFrame, top_n: int,
+                   batch_size: int, index_dir: Path):
+    """Computes the collaborative filtering top-N of every user known to the model.
+
+    Args:
+        model (SVD): Trained surprise SVD model.
+        df_with_one_hot (pd.DataFrame): Encoded data holding the product catalog.
+        top_n (int): Number of recommendations kept per user.
+        batch_size (int): Number of users scored per matrix product.
+        index_dir (Path): Directory where the index is written.
+    """
+    factors = cf_scoring.extract_svd_factors(model, df_with_one_hot["product_id"].unique())
+    users = factors["user_ids"]
+
+    def score_batches():
+        for start in range(0, len(users), batch_size):
+            yield cf_scoring.score_users(factors, users[start:start + batch_size])
+
+    _pack(users, factors["product_ids"], score_batches(), top_n, index_dir)
+
+
+def build_cbf_index(pipeline, df_with_one_hot: pd.DataFrame, top_n: int,
+                    batch_size: int, index_dir: Path, *,
+                    user_interactions: Optional[dict] = None):
+    """Computes the content-based top-N of every user, excluding rated products.
+
+    Args:
+        pipeline: The trained content-based filtering pipeline.
+        df_with_one_hot (pd.DataFrame): Encoded data holding the product catalog.
+        top_n (int): Number of recommendations kept per user.
+        batch_size (int): Number of users masked per batch.
+        index_dir (Path): Directory where the index is written.
+        user_interactions (Optional[dict]): Integer-coded interactions of the data.
+    """
+    store = cbf_features.build_feature_store(pipeline, df_with_one_hot, user_interactions)
+    users = cbf_features.store_users(store)
+
+    def score_batches():
+        for start in range(0, len(users), batch_size):
+            batch_users = users[start:start + batch_size]
+            batch = np.tile(store["product_scores"], (len(batch_users), 1))
+            for row, user_id in enumerate(batch_users):
+                batch[row, cbf_features.rated_positions(store, user_id)] = -np.inf
+            yield batch
+
+    _pack(users, store["product_ids"], score_batches(), top_n, index_dir)
+
+
+def load_index(index_dir: Path) -> Optional[dict]:
+    """Memory-maps a top-N index and builds its user lookup table.
+
+    Args:
+        index_dir (Path): Directory holding the index files.
+
+    Returns:
+        dict: The index arrays, plus a user id to row mapping when the users
+        are not sorted, or None when the index has not been built.
+    """
+    if not all((index_dir / f"{name}.npy").exists() for name in INDEX_FILES):
+        return None
+    index = {name: np.load(index_dir / f"{name}.npy", mmap_mode="r") for name in INDEX_FILES}
+    users = index["users"]
+    if len(users) > 1 and not np.all(users[:-1] <= users[1:]):
+        # Sorted users are found by binary search in the mapped file; others need a dict
+        index["user_rows"] = {user_id: row for row, user_id in enumerate(users.tolist())}
+    return index
+
+
+def _user_row(index: dict, user_id: str) -> Optional[int]:
+    """Returns the index row of a user, or None when the user is not in the index."""
+    if "user_rows" in index:
+        return index["user_rows"].get(user_id)
+    users = index["users"]
+    row = int(np.searchsorted(users, user_id))
+    if row < len(users) and users[row] == user_id:
+        return row
+    return None
+
+
+def lookup(index: Optional[dict], user_id: str, num_recs: int = 10) -> Optional[pd.DataFrame]:
+    """Returns the precomputed recommendations of a known user.
+
+    Args:
+        index (dict): Output of ``load_index``.
+        user_id (str): The ID of the user for whom recommendations are requested.
+        num_recs (int): Number of recommendations to return.
+
+    Returns:
+        pd.DataFrame: Columns "product_id" and "predicted_rating", best first,
+        or None when the user is not in the index.
+    """
+    if index is None:
+        return None
+    row = _user_row(index, user_id)
+    if row is None:
+        return None
+    start = int(index["offsets"][row])
+    stop = min(int(index["offsets"][row + 1]), start + num_recs)
+    return pd.DataFrame({"product_id": index["products"][index["items"][start:stop]],
+                         "predicted_rating": np.asarray(index["scores"][start:stop])})
@@ -1,15 +1,77 @@
 """ Module to save data and models"""
+import contextlib
+import json
 import logging
+import os
 from pathlib import Path
 import pickle
+import shutil
+import uuid
+from typing import Iterator
+import numpy as np
 import pandas as pd
 
 logger = logging.getLogger(__name__)
 
+def _temp_path(path: Path) -> Path:
+    """Returns a unique hidden sibling of ``path`` to write before an atomic rename."""
+    return path.with_name(f".{path.name}.{uuid.uuid4().hex}.part")
+
+
+def save_array(array: np.ndarray, array_file: Path):
+    """
+    Saves an array as .npy and renames it into place.
+
+    The rename gives the file a new inode, so readers that memory-mapped the
+    previous version keep a valid mapping while a new version is published.
+
+    Parameters:
+        array (np.ndarray): The array to be saved.
+        array_file (Path): The path of the .npy file.
+    """
+    temp_file = _temp_path(array_file)
+    with open(temp_file, "wb") as file:
+        np.save(file, array)
+    os.replace(temp_file, array_file)
+
+
+def save_text(text: str, text_file: Path):
+    """
+    Saves text to a temporary file and renames it into place.
+
+    Readers such as a metrics scraper or the model registry never see a
+    partially written file.
+
+    Parameters:
+        text (str): The text to be saved.
+        text_file (Path): The path of the file.
+    """
+    text_file.parent.mkdir(exist_ok=True, parents=True)
+    temp_file = _temp_path(text_file)
+    with open(temp_file, "w", encoding="utf8") as file:
+        file.write(text)
+    os.replace(temp_file, text_file)
+
+
+def save_json(obj, json_file: Path, sort_keys: bool = False):
+    """
+    Saves a JSON-serializable object as indented JSON, atomically like ``save_text``.
+
+    Parameters:
+        obj: The object to be saved.
+        json_file (Path): The path of the .json file.
+        sort_keys (bool): Sort the keys of every dictionary.
+    """
+    save_text(json.dumps(obj, indent=2, sort_keys=sort_keys), json_file)
+
+
 def save_model(best_model, model_filename: Path):
     """
     Saves the best model to the specified path using pickle.
 
+    The model is written to a temporary file and renamed into place, so a
+    running app never loads a partially written model.
+
     Parameters:
         best_model: The model to be saved.
         model_filename (Path): The path (including filename) where the model should be saved.
@@ -19,9 +81,11 @@ def save_model(best_model, model_filename: Path):
     model_filename.parent.mkdir(exist_ok=True, parents=True)
 
     # Save the best model
-    with open(model_filename, 'wb') as file:
+    temp_file = _temp_path(model_filename)
+    with open(temp_file, "wb") as file:
         pickle.dump(best_model, file)
-        logger.info("Saved the model artifact to path %s successfully!", model_filename)
+    os.replace(temp_file, model_filename)
+    logger.info("Saved the model artifact to path %s successfully!", model_filename)
 
 
 
@@ -39,3 +103,108 @@ def save_data(data: pd.DataFrame, data_file: Path):
     # Save the best model
     data.to_pickle(data_file)
     logger.info("Save the artifacts %s to path %s successfully!", data, data_file)
+
+
+def save_columns(data: pd.DataFrame, data_dir: Path):
+    """
+    Saves the data as a directory of .npy columns that can be memory-mapped.
+
+    Numeric and boolean columns are stored as-is. Categorical columns keep
+    their codes and categories, and object/string columns are dictionary
+    encoded the same way, so readers can project and map single columns.
+    Files are replaced one at a time; ``publish_columns`` replaces a directory
+    that readers may be loading.
+
+    Parameters:
+        data: data to be saved.
+        data_dir (Path): The directory where the columns should be saved.
+    """
+    data_dir.mkdir(exist_ok=True, parents=True)
+    schema = {"n_rows": len(data), "index": None, "columns": []}
+
+    if not isinstance(data.index, pd.RangeIndex) and pd.api.types.is_integer_dtype(data.index):
+        save_array(data.index.to_numpy(), data_dir / "index.npy")
+        schema["index"] = "index.npy"
+
+    for position, column in enumerate(data.columns):
+        series = data[column]
+        entry = {"name": column, "file": f"col_{position:03d}.npy", "dtype": str(series.dtype)}
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            entry["kind"] = "category"
+            entry["ordered"] = bool(series.cat.ordered)
+            codes = series.cat.codes.to_numpy()
+            categories = series.cat.categories.to_numpy()
+        elif isinstance(series.dtype, np.dtype) and series.dtype.kind in "biuf":
+            entry["kind"] = "numeric"
+            save_array(series.to_numpy(), data_dir / entry["file"])
+            schema["columns"].append(entry)
+            continue
+        else:
+            entry["kind"] = "dictionary"
+            codes, categories = pd.factorize(series)
+            categories = np.asarray(categories)
+        entry["categories"] = f"col_{position:03d}.categories.npy"
+        save_array(codes.astype(np.int32), data_dir / entry["file"])
+        save_array(np.asarray(categories, dtype=str), data_dir / entry["categories"])
+        schema["columns"].append(entry)
+
+    save_json(schema, data_dir / "schema.json")
+    logger.info("Saved %d columns to path %s successfully!", len(data.columns), data_dir)
+
+
+def publish_columns(data: pd.DataFrame, data_dir: Path):
+    """
+    Saves the data as a new column directory that replaces ``data_dir`` whole.
+
+    Unlike ``save_columns``, nothing of the previous directory is kept: the
+    ``part-*`` chunks and the ``.stage_key`` marker of a streamed run go with
+    it, so a later streamed run cannot mistake them for its current output.
+    Readers that memory-mapped the previous files keep valid mappings.
+
+    Parameters:
+        data: data to be saved.
+        data_dir (Path): The directory where the columns should be saved.
+    """
+    with staged_dir(data_dir) as temp_dir:
+        save_columns(data, temp_dir)
+
+
+def replace_dir(temp_dir: Path, target_dir: Path):
+    """
+    Moves a fully written directory into place, removing the previous one.
+
+    Each step is a single rename, so readers see either the previous or the
+    new directory, never a mix of both.
+
+    Parameters:
+        temp_dir (Path): The directory that was written, usually from ``_temp_path``.
+        target_dir (Path): The directory to replace.
+    """
+    if target_dir.exists():
+        old_dir = _temp_path(target_dir)
+        os.replace(target_dir, old_dir)
+        os.replace(temp_dir, target_dir)
+        shutil.rmtree(old_dir)
+    else:
+        os.replace(temp_dir, target_dir)
+
+
+@contextlib.contextmanager
+def staged_dir(target_dir: Path) -> Iterator[Path]:
+    """
+    Yields a new directory next to ``target_dir`` that replaces it on success.
+
+    If the block raises, the new directory is removed and ``target_dir`` is
+    left as it was.
+
+    Parameters:
+        target_dir (Path): The directory to replace.
+    """
+    temp_dir = _temp_path(target_dir)
+    temp_dir.mkdir(parents=True)
+    try:
+        yield temp_dir
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    replace_dir(temp_dir, target_dir)
@@ -0,0 +1,406 @@
+""" Module to serve batch recommendations over HTTP/JSON"""
+import json
+import logging
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from src.project_pipeline import (ann_index, batching, cbf_features, cf_scoring, data_loader,
+                                  metrics, interactions, model_export, model_registry,
+                                  shared_artifacts)
+
+logger = logging.getLogger(__name__)
+
+MODELS = ("cf", "cbf")
+# Written last by the pipeline and by --update, once every artifact is published
+VERSION_FILE = "model_version.json"
+
+
+def load_recommenders(artifacts: Path, cbf_columns: List[str],
+                      ann_config: Optional[dict] = None,
+                      shared_config: Optional[dict] = None) -> dict:
+    """Loads both models and builds their scoring structures once.
+
+    Args:
+        artifacts (Path): Directory containing the pipeline artifacts.
+        cbf_columns (List[str]): Feature columns read by the content-based model.
+        ann_config (Optional[dict]): The 'ann_index' section of the config; when
+            enabled, CF requests search the ANN index saved with the model.
+        shared_config (Optional[dict]): The 'shared_artifacts' section of the config;
+            when enabled, the scoring arrays are mapped from the copy published by
+            the first serving process, see ``load_shared_recommenders``.
+
+    Returns:
+        dict: CF factor arrays under "cf", the CBF feature store under "cbf"
+        and, if enabled and built, the ANN index under "cf_ann".
+    """
+    if shared_config is not None and shared_config.get("enabled"):
+        with metrics.track_stage("service_attach_scorers"):
+            recommenders = load_shared_recommenders(artifacts, cbf_columns, shared_config)
+    else:
+        with metrics.track_stage("service_load_data"):
+            data = data_loader.read_frame(artifacts / "Data" / "final_df",
+                                          ["user_id", "product_id", *cbf_columns],
+                                          as_category=True)
+        with metrics.track_stage("service_load_models"):
+            cf_model = model_export.load_model_artifact(_cf_model_path(artifacts))
+            cbf_pipeline = model_export.load_model_artifact(_cbf_model_path(artifacts))
+        with metrics.track_stage("service_build_scorers"):
+            recommenders = {
+                "cf": cf_scoring.extract_svd_factors(cf_model, data["product_id"].unique()),
+                "cbf": cbf_features.build_feature_store(
+                    cbf_pipeline, data,
+                    interactions.load_interactions(artifacts / "Data" / "interactions")),
+            }
+    if ann_config is not None and ann_config["enabled"]:
+        recommenders["cf_ann"] = ann_index.load_ann_index(
+            artifacts / "Collaborative_Filtering" / "ann_index")
+        recommenders["nprobe"] = ann_config["nprobe"]
+    logger.info("Loaded recommenders from %s", artifacts)
+    return recommenders
+
+
+def _cf_model_path(artifacts: Path) -> Path:
+    """Returns the exported SVD model, or its pickle for older artifacts."""
+    return model_export.preferred_artifact(
+        artifacts / "Collaborative_Filtering" / "best_cf.npz",
+        artifacts / "Collaborative_Filtering" / "best_cf.pkl")
+
+
+def _cbf_model_path(artifacts: Path) -> Path:
+    """Returns the exported content-based model, or its pickle for older artifacts."""
+    return model_export.preferred_artifact(
+        artifacts / "Content_Based_Filtering" / "best_cbf",
+        artifacts / "Content_Based_Filtering" / "best_cbf.pkl")
+
+
+def _shared_versions(artifacts: Path) -> dict:
+    """Returns the versions of the shared CF factors and CBF feature store.
+
+    They are the artifact versions the app tracks: the model and the data
+    for both, plus the interaction index for the CBF store.
+    """
+    data_path = artifacts / "Data" / "final_df"
+    data_file = data_path if data_path.exists() else data_path.with_suffix(".pkl")
+    data_version = model_registry.artifact_version(data_file)
+    return {
+        "cf": (model_registry.artifact_version(_cf_model_path(artifacts)), data_version),
+        "cbf": ((model_registry.artifact_version(_cbf_model_path(artifacts)), data_version),
+                model_registry.artifact_version(artifacts / "Data" / "interactions")),
+    }
+
+
+def load_shared_recommenders(artifacts: Path, cbf_columns: List[str],
+                             shared_config: dict) -> dict:
+    """Maps the scoring arrays shared by every serving process on the host.
+
+    The CF factors and the CBF feature store are published once per version
+    of their artifacts by ``shared_artifacts.attach_or_publish``: only the
+    first process loads the models and the data, and every process maps the
+    published arrays read-only. The versions are those of the app, so the
+    service and the Streamlit workers share one copy. The user interactions
+    are memory-mapped by ``interactions.load_interactions`` already and are
+    not republished.
+
+    Args:
+        artifacts (Path): Directory containing the pipeline artifacts.
+        cbf_columns (List[str]): Feature columns read by the content-based model.
+        shared_config (dict): The 'shared_artifacts' section of the config, with
+            "root" (None for ``shared_artifacts.default_root()``) and "wait_seconds".
+
+    Returns:
+        dict: CF factor arrays under "cf" and the CBF feature store under "cbf".
+    """
+    data_path = artifacts / "Data" / "final_df"
+    interactions_dir = artifacts / "Data" / "interactions"
+    user_interactions = interactions.load_interactions(interactions_dir)
+    loaded = {}
+
+    def read_data():
+        # Only the publishing process reads the data, at most once
+        if "data" not in loaded:
+            loaded["data"] = data_loader.read_frame(data_path,
+                                                    ["user_id", "product_id", *cbf_columns],
+                                                    as_category=True)
+        return loaded["data"]
+
+    def build_cf() -> dict:
+        return cf_scoring.extract_svd_factors(
+            model_export.load_model_artifact(_cf_model_path(artifacts)),
+            read_data()["product_id"].unique())
+
+    def build_cbf() -> dict:
+        store = cbf_features.build_feature_store(
+            model_export.load_model_artifact(_cbf_model_path(artifacts)), read_data(),
+            user_interactions)
+        return {key: value for key, value in store.items() if key != "interactions"}
+
+    root, wait_seconds = shared_config.get("root"), shared_config["wait_seconds"]
+    versions = _shared_versions(artifacts)
+    recommenders = {"cf": shared_artifacts.attach_or_publish("cf_factors", versions["cf"],
+                                                             build_cf, root, wait_seconds)}
+    if user_interactions is None:
+        # Without the interaction index the store holds a dict of rated products per user
+        logger.warning("Interactions not built: the CBF feature store is not shared")
+        recommenders["cbf"] = cbf_features.build_feature_store(
+            model_export.load_model_artifact(_cbf_model_path(artifacts)), read_data(), None)
+    else:
+        recommenders["cbf"] = shared_artifacts.attach_or_publish(
+            "cbf_store", versions["cbf"], build_cbf, root, wait_seconds)
+        recommenders["cbf"]["interactions"] = user_interactions
+    return recommenders
+
+
+def recommend_batch(recommenders: dict, model: str, user_ids: List[str],
+                    num_recs: int) -> Dict[str, list]:
+    """Scores a batch of users with one model.
+
+    Args:
+        recommenders (dict): Output of ``load_recommenders``.
+        model (str): "cf" or "cbf".
+        user_ids (List[str]): The IDs of the users to recommend for.
+        num_recs (int): Number of recommendations per user.
+
+    Returns:
+        Dict[str, list]: Recommendation dictionaries keyed by user id.
+    """
+    with metrics.timed(f"service_{model}_scoring_seconds"):
+        if model == "cf" and recommenders.get("cf_ann") is not None:
+            results = ann_index.recommend_batch(recommenders["cf"], recommenders["cf_ann"],
+                                                user_ids, num_recs, recommenders["nprobe"])
+        elif model == "cf":
+            results = cf_scoring.recommend_batch(recommenders["cf"], user_ids, num_recs)
+        else:
+            results = cbf_features.recommend_batch(recommenders["cbf"], user_ids, num_recs)
+    return dict(zip(user_ids, results))
+
+
+def make_batchers(recommenders: dict, batching_config: Optional[dict] = None) -> dict:
+    """Builds one micro-batcher per model, merging concurrent requests with the same k.
+
+    Args:
+        recommenders (dict): Output of ``load_recommenders``.
+        batching_config (Optional[dict]): The 'batching' section of the config.
+
+    Returns:
+        dict: A ``batching.MicroBatcher`` per model.
+    """
+    def scorer(model: str):
+        def score(num_recs: int, user_ids: List[str]) -> list:
+            results = recommend_batch(recommenders, model, user_ids, num_recs)
+            return [results[user_id] for user_id in user_ids]
+        return score
+
+    return {model: batching.from_config(scorer(model), batching_config, f"service_{model}")
+            for model in MODELS}
+
+
+def watch_recommenders(load: Callable[[], dict], version_file: Path,
+                       batching_config: Optional[dict] = None,
+                       check_interval: float = 2.0) -> Callable[[], Optional[dict]]:
+    """Follows the published version of the artifacts and reloads the recommenders.
+
+    The pipeline and ``--update`` write ``version_file`` once every other
+    artifact is in place, so it versions the artifacts as a whole. A
+    ``model_registry.ModelRegistry`` stats it at most once per
+    ``check_interval`` and loads a new version in the background while
+    requests are served by the current one.
+
+    Args:
+        load (Callable[[], dict]): Loads the recommenders, e.g. ``load_recommenders``
+            with its arguments bound.
+        version_file (Path): The model version file of the artifacts.
+        batching_config (Optional[dict]): The 'batching' section of the config.
+        check_interval (float): Minimum seconds between two checks of the version.
+
+    Returns:
+        Callable[[], Optional[dict]]: Returns the batchers of the latest loaded
+        version (see ``make_batchers``), or None until a version is published and loaded.
+    """
+    registry = model_registry.ModelRegistry(check_interval, max_workers=1)
+    lock = threading.Lock()
+    current = {}
+
+    def batchers() -> Optional[dict]:
+        try:
+            version, recommenders = registry.get(version_file, lambda _: load())
+        except Exception as error:  # pylint: disable=broad-except
+            # A version that fails to load is retried once a new one is published
+            logger.error("No recommenders loaded from %s: %s", version_file, error)
+            return None
+        if recommenders is None:
+            return None
+        with lock:
+            if current.get("version") != version:
+                current["version"] = version
+                current["batchers"] = make_batchers(recommenders, batching_config)
+            return current["batchers"]
+    return batchers
+
+
+def parse_request(body: bytes, service_config: dict) -> Tuple[str, List[str], int]:
+    """Validates the JSON body of a /recommend request.
+
+    Args:
+        body (bytes): The request body; empty means every default.
+        service_config (dict): The 'service' section of the config.
+
+    Returns:
+        Tuple[str, List[str], int]: The model, the user ids and the number of
+        recommendations per user.
+
+    Raises:
+        ValueError: If the body is not a valid request; the message explains why.
+    """
+    request = json.loads(body or b"{}")
+    if not isinstance(request, dict):
+        raise ValueError("The request must be a JSON object")
+    model = request.get("model", "cf")
+    if model not in MODELS:
+        raise ValueError(f"Unknown model {model}")
+    if not isinstance(request.get("user_ids", []), list):
+        raise ValueError("user_ids must be a list")
+    user_ids = [str(user_id) for user_id in request.get("user_ids", [])]
+    if len(user_ids) > service_config["max_batch"]:
+        raise ValueError(f"At most {service_config['max_batch']} users")
+    try:
+        num_recs = int(request.get("k", service_config["default_k"]))
+    except TypeError as error:
+        raise ValueError(f"Invalid k: {error}") from error
+    if not 0 < num_recs <= service_config["max_k"]:
+        raise ValueError(f"k must be in 1..{service_config['max_k']}")
+    return model, user_ids, num_recs
+
+
+class RecommendationHandler(BaseHTTPRequestHandler):
+    """Serves GET /health, GET /metrics and POST /recommend.
+
+    ``make_handler`` binds a subclass to the recommenders and the config.
+    """
+
+    # Returns the batchers of the current recommenders, or None while none are loaded
+    batchers: Callable[[], Optional[dict]]
+    service_config: dict
+
+    def _send_body(self, status: int, content_type: str, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: dict):
+        self._send_body(status, "application/json", json.dumps(payload).encode("utf8"))
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Reports whether the service is ready, or exports its metrics."""
+        if self.path == "/health":
+            if self.batchers() is None:
+                self._send_json(503, {"status": "loading", "models": []})
+            else:
+                self._send_json(200, {"status": "ok", "models": list(MODELS)})
+        elif self.path == "/metrics":
+            self._send_body(200, "text/plain; version=0.0.4",
+                            metrics.to_prometheus().encode("utf8"))
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Returns the top-k recommendations of every requested user."""
+        if self.path != "/recommend":
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            model, user_ids, num_recs = parse_request(self.rfile.read(length),
+                                                      self.service_config)
+        except ValueError as error:
+            self._send_json(400, {"error": f"Invalid request: {error}"})
+            return
+        current = self.batchers()
+        if current is None:
+            self._send_json(503, {"error": "The models are not published yet"})
+            return
+        with metrics.timed("service_request_seconds"):
+            try:
+                results = current[model].submit(user_ids, num_recs)
+            except Exception as error:  # pylint: disable=broad-except
+                logger.exception("Scoring %d users with %s failed", len(user_ids), model)
+                self._send_json(500, {"error": f"Scoring failed: {error}"})
+                return
+            self._send_json(200, {"model": model, "k": num_recs,
+                                  "recommendations": dict(zip(user_ids, results))})
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def make_handler(batchers: Callable[[], Optional[dict]], service_config: dict):
+    """Builds the request handler class bound to the latest loaded recommenders.
+
+    Args:
+        batchers (Callable[[], Optional[dict]]): Returns the batchers of the current
+            recommenders, or None while none are loaded; see ``watch_recommenders``.
+        service_config (dict): The 'service' section of the config.
+
+    Returns:
+        type: A ``RecommendationHandler`` subclass.
+    """
+    return type("BoundRecommendationHandler", (RecommendationHandler,),
+                {"batchers": staticmethod(batchers), "service_config": service_config})
+
+
+def serve(batchers: Callable[[], Optional[dict]], service_config: dict,
+          check_interval: float = 2.0):
+    """Runs the HTTP service until interrupted.
+
+    The service starts before any model is published, e.g. while the first
+    pipeline run of a fresh container trains, and answers 503 until the
+    recommenders are loaded. A background thread checks for a new version
+    every ``check_interval`` seconds, so versions load without waiting for
+    a request.
+
+    Args:
+        batchers (Callable[[], Optional[dict]]): Output of ``watch_recommenders``.
+        service_config (dict): The 'service' section of the config.
+        check_interval (float): Seconds between two checks for a new version.
+    """
+    def refresh():
+        waiting = False
+        while True:
+            loaded = batchers() is not None
+            if not loaded and not waiting:
+                logger.info("Waiting for the pipeline to publish the models")
+            waiting = not loaded
+            time.sleep(check_interval)
+
+    threading.Thread(target=refresh, name="artifact-watcher", daemon=True).start()
+    server = ThreadingHTTPServer((service_config["host"], service_config["port"]),
+                                 make_handler(batchers, service_config))
+    logger.info("Serving recommendations on %s:%d", service_config["host"],
+                service_config["port"])
+    with server:
+        server.serve_forever()
+
+
+def request_recommendations(url: str, model: str, user_ids: List[str], num_recs: int,
+                            timeout: float = 10.0) -> Dict[str, list]:
+    """Client for the service: fetches recommendations for a batch of users.
+
+    Args:
+        url (str): Base URL of the service, e.g. http://localhost:8000.
+        model (str): "cf" or "cbf".
+        user_ids (List[str]): The IDs of the users to recommend for.
+        num_recs (int): Number of recommendations per user.
+        timeout (float): Request timeout in seconds.
+
+    Returns:
+        Dict[str, list]: Recommendation dictionaries keyed by user id.
+    """
+    body = json.dumps({"model": model, "user_ids": list(user_ids), "k": num_recs})
+    request = urllib.request.Request(f"{url.rstrip('/')}/recommend", data=body.encode("utf8"),
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())["recommendations"]
@@ -0,0 +1,247 @@
+""" Module to publish scoring arrays once and map them read-only into every serving process"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import weakref
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+LEASES_DIR = "leases"
+
+
+class SharedArrays(dict):
+    """Arrays of one published version, mapped read-only.
+
+    The process holds a lease on the version while the dictionary is alive,
+    so the version is not retired under it.
+    """
+
+
+def default_root() -> Path:
+    """Returns /dev/shm, so the arrays live in shared memory, or the temp dir without it."""
+    shm = Path("/dev/shm")
+    base = shm if shm.is_dir() and os.access(shm, os.W_OK) else Path(tempfile.gettempdir())
+    return base / "amazon-recommender"
+
+
+def version_digest(version: Any) -> str:
+    """Names a version, e.g. a tuple of artifact versions, identically in every process."""
+    return hashlib.sha1(repr(version).encode("utf8")).hexdigest()[:16]
+
+
+def _alive(pid: Optional[int]) -> bool:
+    """Tells whether a process exists; unknown pids are assumed alive."""
+    if pid is None:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_pid(path: Path) -> Optional[int]:
+    """Reads the pid written in a lock file, or None while it is being written."""
+    try:
+        return int(path.read_text(encoding="utf8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _acquire(lock: Path) -> bool:
+    """Takes the publishing lock of a version, breaking the lock of a dead publisher."""
+    try:
+        descriptor = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        if not _alive(_read_pid(lock)):
+            logger.warning("Removing the stale lock %s", lock)
+            lock.unlink(missing_ok=True)
+        return False
+    with os.fdopen(descriptor, "w", encoding="utf8") as file:
+        file.write(str(os.getpid()))
+    return True
+
+
+def _write(directory: Path, contents: Dict[str, Any]):
+    """Writes arrays, sparse matrices and JSON values, then renames the directory into place."""
+    temp_dir = directory.with_name(f".{directory.name}.{os.getpid()}.part")
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    temp_dir.mkdir(parents=True)
+    layout = {}
+    for key, value in contents.items():
+        if sparse.issparse(value):
+            matrix = value.tocsr()
+            files = {}
+            for part in ("data", "indices", "indptr"):
+                files[part] = f"{key}.{part}.npy"
+                np.save(temp_dir / files[part], getattr(matrix, part))
+            layout[key] = {"kind": "csr", "files": files, "shape": list(matrix.shape)}
+        elif isinstance(value, np.ndarray):
+            # Object arrays of ids cannot be mapped: they are stored as fixed-width strings
+            array = value.astype(str) if value.dtype == object else value
+            np.save(temp_dir / f"{key}.npy", np.ascontiguousarray(array))
+            layout[key] = {"kind": "array", "file": f"{key}.npy"}
+        elif value is None or isinstance(value, (bool, int, float, str, tuple, list)):
+            layout[key] = {"kind": "value", "value": value}
+        elif isinstance(value, np.generic):
+            layout[key] = {"kind": "value", "value": value.item()}
+        else:
+            raise TypeError(f"{key} of type {type(value).__name__} cannot be shared")
+    with open(temp_dir / MANIFEST_FILE, "w", encoding="utf8") as file:
+        json.dump(layout, file)
+    os.replace(temp_dir, directory)
+
+
+def _attach(directory: Path) -> SharedArrays:
+    """Maps every array of a published version read-only."""
+    with open(directory / MANIFEST_FILE, encoding="utf8") as file:
+        layout = json.load(file)
+    arrays = SharedArrays()
+    for key, entry in layout.items():
+        if entry["kind"] == "csr":
+            parts = {part: np.load(directory / name, mmap_mode="r")
+                     for part, name in entry["files"].items()}
+            arrays[key] = sparse.csr_matrix((parts["data"], parts["indices"], parts["indptr"]),
+                                            shape=tuple(entry["shape"]), copy=False)
+        elif entry["kind"] == "array":
+            arrays[key] = np.load(directory / entry["file"], mmap_mode="r")
+        else:
+            arrays[key] = entry["value"]
+    return arrays
+
+
+def _lease_holders(leases: Path, digest: str) -> list:
+    """Returns the live processes holding a version, removing the leases of dead ones."""
+    holders = []
+    for lease in leases.glob(f"{digest}.*"):
+        pid = int(lease.suffix[1:])
+        if _alive(pid):
+            holders.append(pid)
+        else:
+            lease.unlink(missing_ok=True)
+    return holders
+
+
+def retire(name: str, root: Optional[Path] = None):
+    """Deletes the versions of ``name`` no live process holds, except the newest.
+
+    Leftovers of publishers that died while writing are removed too.
+    Processes that mapped a deleted version keep reading it until they
+    unmap it, as the memory is only freed then.
+
+    Args:
+        name (str): Name of the shared arrays, e.g. "cf_factors".
+        root (Optional[Path]): Directory of the shared arrays; defaults to ``default_root()``.
+    """
+    base = (Path(root) if root else default_root()) / name
+    if not base.is_dir():
+        return
+    for temp_dir in base.glob(".*.part"):
+        if not _alive(int(temp_dir.name.split(".")[-2])):
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    versions = [directory for directory in base.iterdir()
+                if directory.is_dir() and (directory / MANIFEST_FILE).exists()]
+    if not versions:
+        return
+    newest = max(versions, key=lambda directory: (directory / MANIFEST_FILE).stat().st_mtime_ns)
+    for directory in versions:
+        if directory != newest and not _lease_holders(base / LEASES_DIR, directory.name):
+            shutil.rmtree(directory, ignore_errors=True)
+            logger.info("Retired shared %s version %s", name, directory.name)
+
+
+def _release(lease: Path, name: str, root: Path):
+    """Drops the lease of this process on a version and retires unused versions."""
+    lease.unlink(missing_ok=True)
+    try:
+        retire(name, root)
+    except OSError as error:
+        logger.warning("Could not retire shared %s versions: %s", name, error)
+
+
+def _publish(directory: Path, lock: Path, build: Callable[[], Dict[str, Any]],
+             name: str) -> bool:
+    """Builds and writes a version under its lock, unless another process holds the lock.
+
+    Returns:
+        bool: False when another process is publishing the version.
+    """
+    if not _acquire(lock):
+        return False
+    try:
+        # Another publisher may have finished between the check and the lock
+        if not (directory / MANIFEST_FILE).exists():
+            start = time.perf_counter()
+            _write(directory, build())
+            logger.info("Published shared %s version %s in %.2fs", name, directory.name,
+                        time.perf_counter() - start)
+    finally:
+        lock.unlink(missing_ok=True)
+    return True
+
+
+def attach_or_publish(name: str, version: Any, build: Callable[[], Dict[str, Any]],
+                      root: Optional[Path] = None, wait_seconds: float = 300.0) -> SharedArrays:
+    """Maps the shared arrays of a version, building and publishing them if needed.
+
+    The first process to ask for a version takes a lock, calls ``build`` and
+    publishes its arrays as .npy files. Every process, including the
+    publisher, then memory-maps them read-only, so the pages are shared and
+    never copied. Under /dev/shm they live in shared memory; elsewhere they
+    are shared through the page cache. Other processes asking for the
+    version meanwhile wait for the publisher, for up to ``wait_seconds``.
+
+    A lease marks the version as used by this process until the returned
+    dictionary is garbage collected or the process exits. Versions that are
+    no longer leased are then deleted once a newer one is published; see
+    ``retire``.
+
+    Args:
+        name (str): Name of the shared arrays, e.g. "cf_factors".
+        version (Any): Hashable, repr-stable version of the inputs of ``build``,
+            e.g. the artifact versions of the model registry.
+        build (Callable[[], Dict[str, Any]]): Returns the arrays, sparse
+            matrices and JSON values to share.
+        root (Optional[Path]): Directory of the shared arrays; defaults to ``default_root()``.
+        wait_seconds (float): Longest wait for another publisher.
+
+    Returns:
+        SharedArrays: The mapped arrays and the shared values.
+    """
+    root = Path(root) if root else default_root()
+    digest = version_digest(version)
+    base = root / name
+    directory = base / digest
+    (base / LEASES_DIR).mkdir(parents=True, exist_ok=True)
+    lease = base / LEASES_DIR / f"{digest}.{os.getpid()}"
+    deadline = time.monotonic() + wait_seconds
+
+    while True:
+        if (not (directory / MANIFEST_FILE).exists()
+                and not _publish(directory, base / f".{digest}.lock", build, name)):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Timed out waiting for shared {name} version {digest}")
+            time.sleep(0.05)
+            continue
+        # Lease before mapping so the version cannot be retired in between
+        lease.touch()
+        try:
+            arrays = _attach(directory)
+            break
+        except FileNotFoundError:
+            lease.unlink(missing_ok=True)
+    logger.info("Attached shared %s version %s", name, digest)
+    weakref.finalize(arrays, _release, lease, name, root)
+    retire(name, root)
+    return arrays
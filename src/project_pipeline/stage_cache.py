@@ -0,0 +1,107 @@
+""" Module to cache pipeline stage outputs by the hash of their inputs"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+
+def hash_file(file_path: Path) -> str:
+    """Hashes the content of a file.
+
+    Args:
+        file_path (Path): File to hash.
+
+    Returns:
+        str: Hex SHA-256 digest of the file.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stage_key(stage: str, inputs: Iterable[str], config_slice: Any = None) -> str:
+    """Builds the cache key of a stage.
+
+    Args:
+        stage (str): Name of the stage.
+        inputs (Iterable[str]): Keys of the upstream stages or hashes of input files.
+        config_slice (Any): The part of the config the stage depends on.
+
+    Returns:
+        str: Hex SHA-256 digest identifying the stage output.
+    """
+    payload = json.dumps({"stage": stage, "inputs": list(inputs), "config": config_slice},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf8")).hexdigest()
+
+
+def run_stage(stage: str, key: str, compute: Callable[[], Any], cache_dir: Path,
+              *, force: bool = False, keep: int = 3) -> Any:
+    """Returns the cached output of a stage, computing and storing it on a miss.
+
+    Args:
+        stage (str): Name of the stage.
+        key (str): Cache key from ``stage_key``.
+        compute (Callable[[], Any]): Function producing the stage output.
+        cache_dir (Path): Root directory of the stage cache.
+        force (bool): Recompute even when a cached output exists.
+        keep (int): Number of cached outputs kept per stage.
+
+    Returns:
+        Any: The stage output.
+    """
+    output_dir = cache_dir / stage
+    cache_file = output_dir / f"{key}.pkl"
+    if cache_file.exists() and not force:
+        logger.info("Stage %s: using cached output %s", stage, key[:12])
+        with open(cache_file, "rb") as file:
+            return pickle.load(file)
+
+    output = compute()
+
+    output_dir.mkdir(exist_ok=True, parents=True)
+    temp_file = output_dir / f".{key}.{uuid.uuid4().hex}.part"
+    with open(temp_file, "wb") as file:
+        pickle.dump(output, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_file, cache_file)
+    logger.info("Stage %s: cached output %s", stage, key[:12])
+
+    cached = sorted(output_dir.glob("*.pkl"), key=lambda path: path.stat().st_mtime, reverse=True)
+    for stale_file in cached[keep:]:
+        stale_file.unlink(missing_ok=True)
+    return output
+
+
+def stage_dir(stage: str, key: str, cache_dir: Path, keep: int = 3) -> Path:
+    """Returns the cache directory of a stage whose output is a directory.
+
+    The stage writes the directory itself; the least recently used
+    directories beyond ``keep`` are removed.
+
+    Args:
+        stage (str): Name of the stage.
+        key (str): Cache key from ``stage_key``.
+        cache_dir (Path): Root directory of the stage cache.
+        keep (int): Number of cached directories kept per stage, including this one.
+
+    Returns:
+        Path: The directory for ``key``, which may not exist yet.
+    """
+    output_dir = cache_dir / stage / key
+    if output_dir.exists():
+        os.utime(output_dir)
+    cached = sorted((path for path in (cache_dir / stage).glob("*")
+                     if path.is_dir() and path != output_dir and not path.name.startswith(".")),
+                    key=lambda path: path.stat().st_mtime, reverse=True)
+    for stale_dir in cached[keep - 1:]:
+        shutil.rmtree(stale_dir, ignore_errors=True)
+    return output_dir
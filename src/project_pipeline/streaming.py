@@ -0,0 +1,58 @@
+""" Module to preprocess and encode raw data out of core, one chunk at a time"""
+import logging
+import shutil
+from pathlib import Path
+from typing import Optional
+from src.project_pipeline import data_loader, eda, save_artifacts
+
+logger = logging.getLogger(__name__)
+
+
+def _reset_dir(directory: Path):
+    """Removes the parts of a previous run before writing new ones."""
+    if directory.exists():
+        shutil.rmtree(directory)
+    directory.mkdir(parents=True)
+
+
+def stream_preprocess(loader_config: dict, user_split_dir: Path, final_dir: Path,
+                      text_config: Optional[dict] = None) -> int:
+    """Streams the raw CSV through preprocessing and one-hot encoding.
+
+    The first pass preprocesses each chunk, writes it as a ``part-*`` column
+    directory of the user split data and collects the first categories. The
+    second pass encodes the saved parts one at a time against the full
+    category list, so every part of the final data has the same columns.
+    Peak memory is bounded by the chunk size rather than the file size.
+
+    Args:
+        loader_config (dict): The 'data_loader' section of the config.
+        user_split_dir (Path): Directory receiving the preprocessed parts.
+        final_dir (Path): Directory receiving the encoded parts.
+        text_config (Optional[dict]): The 'text_processing' section of the config.
+
+    Returns:
+        int: Number of encoded rows written.
+    """
+    chunks = data_loader.read_data_chunks(loader_config['path'],
+                                          loader_config['chunksize'],
+                                          loader_config.get('usecols'),
+                                          loader_config.get('dtype'))
+
+    _reset_dir(user_split_dir)
+    categories = set()
+    n_parts = 0
+    for n_parts, chunk in enumerate(eda.preprocess_chunks(chunks, **(text_config or {})), start=1):
+        categories.update(chunk['First_category'].unique())
+        save_artifacts.save_columns(chunk, user_split_dir / f'part-{n_parts - 1:05d}')
+    logger.info('Preprocessed %d chunks with %d first categories', n_parts, len(categories))
+
+    _reset_dir(final_dir)
+    n_rows = 0
+    for part in sorted(user_split_dir.glob('part-*')):
+        chunk = data_loader.read_columns(part, mmap=False)
+        encoded = eda.one_hot_encoding(chunk, sorted(categories))
+        save_artifacts.save_columns(encoded, final_dir / part.name)
+        n_rows += len(encoded)
+    logger.info('Encoded %d rows into %s', n_rows, final_dir)
+    return n_rows
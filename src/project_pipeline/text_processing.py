@@ -0,0 +1,158 @@
+""" Module to normalize review text and hash it into term counts, sharded across processes"""
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+# Runs of characters that are neither word characters nor whitespace
+PUNCTUATION = re.compile(r"[^\w\s]+")
+
+# Hashed (indices, counts) of every distinct text seen by this process, per number of features
+_hashed_rows: Dict[int, Dict[str, tuple]] = {}
+_hashed_lock = threading.Lock()
+
+
+def _patterns(keep: str) -> re.Pattern:
+    """Returns the punctuation pattern, sparing the characters in ``keep``."""
+    if not keep:
+        return PUNCTUATION
+    return re.compile(rf"[^\w\s{re.escape(keep)}]+")
+
+
+def normalize_texts(texts: Iterable, keep: str = "") -> List:
+    """Lowercases texts and strips their punctuation in one pass over each text.
+
+    Args:
+        texts (Iterable): Texts to normalize; missing values are kept as they are.
+        keep (str): Punctuation characters to keep, e.g. a separator split on later.
+
+    Returns:
+        List: The normalized texts.
+    """
+    pattern = _patterns(keep)
+    return [pattern.sub("", text.lower()) if isinstance(text, str) else text for text in texts]
+
+
+def _normalize_shard(shard: dict) -> dict:
+    """Normalizes the columns of one shard of rows."""
+    return {column: normalize_texts(values, keep)
+            for column, (values, keep) in shard.items()}
+
+
+def _shards(n_rows: int, shard_rows: int) -> List[slice]:
+    """Splits ``n_rows`` rows into slices of at most ``shard_rows`` rows."""
+    return [slice(start, start + shard_rows) for start in range(0, n_rows, shard_rows)]
+
+
+def _workers(n_jobs: int, n_shards: int) -> int:
+    """Returns the number of processes used for ``n_shards`` shards."""
+    return min(os.cpu_count() if n_jobs == -1 else n_jobs, n_shards)
+
+
+def normalize_columns(data: pd.DataFrame, columns: Dict[str, str], n_jobs: int = 1,
+                      shard_rows: int = 50000) -> pd.DataFrame:
+    """Normalizes text columns in place, sharding the rows across a process pool.
+
+    Frames of a single shard are normalized in this process, so small
+    chunks do not pay for starting workers.
+
+    Args:
+        data (pd.DataFrame): Frame holding the text columns.
+        columns (Dict[str, str]): Column names and the punctuation each one keeps.
+        n_jobs (int): Number of processes, -1 for one per CPU.
+        shard_rows (int): Number of rows per shard.
+
+    Returns:
+        pd.DataFrame: The frame, with the columns normalized.
+    """
+    shards = _shards(len(data), shard_rows)
+    tasks = [{column: (data[column].iloc[rows].tolist(), keep)
+              for column, keep in columns.items()} for rows in shards]
+    workers = _workers(n_jobs, len(tasks))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_normalize_shard, tasks))
+    else:
+        results = [_normalize_shard(task) for task in tasks]
+    for column in columns:
+        data[column] = pd.Series([text for result in results for text in result[column]],
+                                 index=data.index, dtype=data[column].dtype)
+    return data
+
+
+def _hash_shard(task: tuple) -> sparse.csr_matrix:
+    """Hashes one shard of distinct texts into term counts."""
+    from sklearn.feature_extraction.text import HashingVectorizer  # pylint: disable=import-outside-toplevel
+
+    texts, n_features = task
+    vectorizer = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None)
+    return vectorizer.transform(texts).astype(np.float64).tocsr()
+
+
+def _hash_texts(texts: List[str], n_features: int, n_jobs: int, shard_rows: int) -> dict:
+    """Hashes distinct texts in shards and returns the (indices, counts) row of each text."""
+    tasks = [(texts[rows], n_features) for rows in _shards(len(texts), shard_rows)]
+    workers = _workers(n_jobs, len(tasks))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            hashed = sparse.vstack(list(executor.map(_hash_shard, tasks)), format="csr")
+    else:
+        hashed = sparse.vstack([_hash_shard(task) for task in tasks], format="csr")
+    return {text: (hashed.indices[hashed.indptr[row]:hashed.indptr[row + 1]],
+                   hashed.data[hashed.indptr[row]:hashed.indptr[row + 1]])
+            for row, text in enumerate(texts)}
+
+
+def hashed_counts(texts: Iterable, n_features: int, n_jobs: int = 1,
+                  shard_rows: int = 50000, max_cached: Optional[int] = 1000000
+                  ) -> sparse.csr_matrix:
+    """Hashes texts into term counts, tokenizing each distinct text once per process.
+
+    Counts match ``HashingVectorizer(alternate_sign=False, norm=None)``.
+    Distinct texts already hashed by this process are reused, so training,
+    evaluation and index building in one pipeline run, and every request
+    of a server, tokenize a review title only the first time they see it.
+    New texts are hashed in shards across a process pool.
+
+    Args:
+        texts (Iterable): Texts to hash.
+        n_features (int): Number of hashed features.
+        n_jobs (int): Number of processes, -1 for one per CPU.
+        shard_rows (int): Number of distinct texts per shard.
+        max_cached (Optional[int]): Distinct texts kept per number of features;
+            the cache is cleared when it would grow past this size.
+
+    Returns:
+        sparse.csr_matrix: Matrix of shape (n_texts, n_features).
+    """
+    codes, uniques = pd.factorize(pd.Series(list(texts), dtype=object).fillna(""))
+    uniques = [str(text) for text in uniques]
+    with _hashed_lock:
+        cache = _hashed_rows.setdefault(n_features, {})
+        found = {text: cache[text] for text in uniques if text in cache}
+    missing = [text for text in uniques if text not in found]
+
+    if missing:
+        new_rows = _hash_texts(missing, n_features, n_jobs, shard_rows)
+        found.update(new_rows)
+        with _hashed_lock:
+            if max_cached is not None and len(cache) + len(new_rows) > max_cached:
+                cache.clear()
+            cache.update(new_rows)
+        logger.info("Hashed %d new distinct texts of %d", len(missing), len(uniques))
+
+    rows = [found[text] for text in uniques]
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(indices) for indices, _ in rows], out=indptr[1:])
+    matrix = sparse.csr_matrix(
+        (np.concatenate([data for _, data in rows]) if rows else np.empty(0),
+         np.concatenate([indices for indices, _ in rows]) if rows else np.empty(0, np.int32),
+         indptr), shape=(len(rows), n_features))
+    return matrix[codes]
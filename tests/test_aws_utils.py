@@ -0,0 +1,150 @@
+""" Tests of the incremental S3 sync against a moto stand-in for S3"""
+import os
+from pathlib import Path
+import boto3
+import pytest
+from moto import mock_aws
+from src.project_pipeline import aws_utils
+
+BUCKET = "test-bucket"
+PREFIX = "artifacts"
+# 5MB parts, the S3 minimum, so an 11MB file is uploaded in three parts
+TRANSFER = {"multipart_threshold_mb": 5, "multipart_chunksize_mb": 5,
+            "max_concurrency": 2, "max_workers": 2}
+DOWNLOAD_PREFIXES = [f"{PREFIX}_Data", f"{PREFIX}_Collaborative_Filtering"]
+
+
+@pytest.fixture(name="s3_client")
+def fixture_s3_client(monkeypatch):
+    """S3 client of a mocked account holding an empty bucket."""
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture(name="artifacts")
+def fixture_artifacts(tmp_path) -> Path:
+    """Artifacts with a top-level file, nested files and a multipart-sized model."""
+    artifacts = tmp_path / "artifacts"
+    (artifacts / "Data" / "final_df").mkdir(parents=True)
+    (artifacts / "Collaborative_Filtering").mkdir()
+    (artifacts / "Data" / "final_df" / "schema.json").write_text('{"columns": []}')
+    (artifacts / "Data" / "final_df" / "col_000.npy").write_bytes(os.urandom(1000))
+    (artifacts / "Collaborative_Filtering" / "best_cf.npz").write_bytes(
+        os.urandom(11 * aws_utils.MEGABYTE))
+    return artifacts
+
+
+def test_sync_upload_skips_unchanged_files(s3_client, artifacts):
+    uploaded = aws_utils.sync_upload(s3_client, artifacts, BUCKET, PREFIX, TRANSFER)
+    assert sorted(uploaded) == [
+        f"s3://{BUCKET}/{PREFIX}_Collaborative_Filtering/best_cf.npz",
+        f"s3://{BUCKET}/{PREFIX}_Data/final_df/col_000.npy",
+        f"s3://{BUCKET}/{PREFIX}_Data/final_df/schema.json",
+    ]
+
+    # The local multipart ETag matches the one S3 assigned, so nothing is re-uploaded
+    remote = aws_utils.list_objects(s3_client, BUCKET, [f"{PREFIX}_"])
+    assert remote[f"{PREFIX}_Collaborative_Filtering/best_cf.npz"]["etag"].endswith("-3")
+    assert not aws_utils.sync_upload(s3_client, artifacts, BUCKET, PREFIX, TRANSFER)
+
+
+def test_sync_upload_reuploads_changed_file(s3_client, artifacts):
+    aws_utils.sync_upload(s3_client, artifacts, BUCKET, PREFIX, TRANSFER)
+    (artifacts / "Data" / "final_df" / "schema.json").write_text('{"columns": [1]}')
+
+    uploaded = aws_utils.sync_upload(s3_client, artifacts, BUCKET, PREFIX, TRANSFER)
+
+    assert uploaded == [f"s3://{BUCKET}/{PREFIX}_Data/final_df/schema.json"]
+    body = s3_client.get_object(Bucket=BUCKET, Key=f"{PREFIX}_Data/final_df/schema.json")
+    assert body["Body"].read() == b'{"columns": [1]}'
+
+
+def test_sync_upload_prunes_deleted_files_from_manifest(s3_client, artifacts):
+    aws_utils.sync_upload(s3_client, artifacts, BUCKET, PREFIX, TRANSFER)
+    (artifacts / "Data" / "final_df" / "col_000.npy").unlink()
+
+    assert not aws_utils.sync_upload(s3_client, artifacts, BUCKET, PREFIX, TRANSFER)
+    assert sorted(aws_utils.read_manifest(artifacts)) == [
+        "Collaborative_Filtering/best_cf.npz", "Data/final_df/schema.json"]
+
+
+def test_sync_download_skips_unchanged_files(s3_client, artifacts, tmp_path):
+    aws_utils.sync_upload(s3_client, artifacts, BUCKET, PREFIX, TRANSFER)
+    target = tmp_path / "s3_artifacts"
+
+    downloaded = aws_utils.sync_download(s3_client, BUCKET, DOWNLOAD_PREFIXES, target,
+                                         TRANSFER)
+
+    assert sorted(path.relative_to(target).as_posix() for path in downloaded) == [
+        "Collaborative_Filtering/best_cf.npz", "Data/final_df/col_000.npy",
+        "Data/final_df/schema.json"]
+    for path in downloaded:
+        assert path.read_bytes() == (artifacts / path.relative_to(target)).read_bytes()
+    assert not aws_utils.sync_download(s3_client, BUCKET, DOWNLOAD_PREFIXES, target, TRANSFER)
+
+
+def test_sync_download_removes_partial_file_on_failure(s3_client, artifacts, tmp_path,
+                                                       monkeypatch):
+    aws_utils.sync_upload(s3_client, artifacts, BUCKET, PREFIX, TRANSFER)
+    target = tmp_path / "s3_artifacts"
+
+    def failing_download(bucket, key, filename, **kwargs):  # pylint: disable=unused-argument
+        Path(filename).write_bytes(b"partial")
+        raise OSError("connection reset")
+    monkeypatch.setattr(s3_client, "download_file", failing_download)
+
+    with pytest.raises(OSError, match="connection reset"):
+        aws_utils.sync_download(s3_client, BUCKET, DOWNLOAD_PREFIXES, target, TRANSFER)
+
+    files = [path for path in target.rglob("*") if path.is_file()]
+    assert not [path for path in files if path.name.endswith(".part")]
+    assert not (target / "Collaborative_Filtering" / "best_cf.npz").exists()
+    assert not (target / aws_utils.MANIFEST_NAME).exists()
+
+
+def test_sync_download_mirrors_remote_deletions(s3_client, artifacts, tmp_path):
+    aws_utils.sync_upload(s3_client, artifacts, BUCKET, PREFIX, TRANSFER)
+    target = tmp_path / "s3_artifacts"
+    aws_utils.sync_download(s3_client, BUCKET, DOWNLOAD_PREFIXES, target, TRANSFER)
+    model_inode = (target / "Collaborative_Filtering" / "best_cf.npz").stat().st_ino
+    s3_client.delete_object(Bucket=BUCKET, Key=f"{PREFIX}_Data/final_df/col_000.npy")
+    s3_client.put_object(Bucket=BUCKET, Key=f"{PREFIX}_Data/final_df/schema.json",
+                         Body=b'{"columns": [1]}')
+
+    downloaded = aws_utils.sync_download(s3_client, BUCKET, DOWNLOAD_PREFIXES, target,
+                                         TRANSFER)
+
+    assert downloaded == [target / "Data" / "final_df" / "schema.json"]
+    assert not (target / "Data" / "final_df" / "col_000.npy").exists()
+    assert (target / "Data" / "final_df" / "schema.json").read_bytes() == b'{"columns": [1]}'
+    assert (target / "Collaborative_Filtering" / "best_cf.npz").stat().st_ino == model_inode
+    assert sorted(aws_utils.read_manifest(target)) == [
+        "Collaborative_Filtering/best_cf.npz", "Data/final_df/schema.json"]
+    assert not [path for path in target.iterdir() if path.name.endswith(".part")]
+
+
+def test_sync_download_keeps_previous_version_on_failure(s3_client, artifacts, tmp_path,
+                                                         monkeypatch):
+    aws_utils.sync_upload(s3_client, artifacts, BUCKET, PREFIX, TRANSFER)
+    target = tmp_path / "s3_artifacts"
+    aws_utils.sync_download(s3_client, BUCKET, DOWNLOAD_PREFIXES, target, TRANSFER)
+    s3_client.put_object(Bucket=BUCKET, Key=f"{PREFIX}_Data/final_df/schema.json",
+                         Body=b'{"columns": [1]}')
+
+    def failing_download(bucket, key, filename, **kwargs):  # pylint: disable=unused-argument
+        raise OSError("connection reset")
+    monkeypatch.setattr(s3_client, "download_file", failing_download)
+
+    with pytest.raises(OSError, match="connection reset"):
+        aws_utils.sync_download(s3_client, BUCKET, DOWNLOAD_PREFIXES, target, TRANSFER)
+
+    assert sorted(path.relative_to(target).as_posix() for path in target.rglob("*")
+                  if path.is_file() and path.name != aws_utils.MANIFEST_NAME) == [
+        "Collaborative_Filtering/best_cf.npz", "Data/final_df/col_000.npy",
+        "Data/final_df/schema.json"]
+    assert (target / "Data" / "final_df" / "schema.json").read_bytes() == b'{"columns": []}'
@@ -0,0 +1,69 @@
+""" Equivalence tests of the NumPy collaborative filtering scoring against surprise"""
+import numpy as np
+import pandas as pd
+import pytest
+from surprise import SVD, Dataset, Reader
+from src.project_pipeline import ann_index, cf_scoring, model_export
+
+# The catalog and the users include ids the model never saw during training
+CATALOG = [f"P{number}" for number in range(45)]
+USERS = [f"U{number}" for number in range(65)]
+
+
+@pytest.fixture(name="trainset")
+def fixture_trainset():
+    """Ratings of 60 users on 40 products."""
+    rng = np.random.default_rng(0)
+    ratings = pd.DataFrame({
+        "user_id": [f"U{number}" for number in rng.integers(0, 60, 400)],
+        "product_id": [f"P{number}" for number in rng.integers(0, 40, 400)],
+        "rating": rng.integers(1, 6, 400).astype(float),
+    }).drop_duplicates(["user_id", "product_id"])
+    return Dataset.load_from_df(ratings, Reader(rating_scale=(1, 5))).build_full_trainset()
+
+
+@pytest.mark.parametrize("biased", [True, False])
+@pytest.mark.parametrize("exported", [False, True])
+def test_score_users_matches_svd_predict(trainset, tmp_path, biased, exported):
+    model = SVD(n_factors=4, n_epochs=30, biased=biased, random_state=0).fit(trainset)
+    source = model
+    if exported:
+        model_export.export_svd(model, tmp_path / "best_cf.npz")
+        source = model_export.load_svd(tmp_path / "best_cf.npz")
+    expected = np.array([[model.predict(user_id, product_id).est for product_id in CATALOG]
+                         for user_id in USERS])
+
+    scores = cf_scoring.score_users(cf_scoring.extract_svd_factors(source, CATALOG), USERS)
+
+    np.testing.assert_allclose(scores, expected, rtol=0, atol=1e-15)
+
+
+def test_ann_recall_against_exact_scoring():
+    rng = np.random.default_rng(0)
+    n_users, n_items, n_factors = 100, 3000, 16
+    arrays = {
+        "pu": rng.normal(size=(n_users, n_factors)),
+        "qi": rng.normal(scale=0.3, size=(n_items, n_factors)),
+        "bu": rng.normal(scale=0.1, size=n_users),
+        "bi": rng.normal(scale=0.3, size=n_items),
+        "user_ids": np.array([f"U{number}" for number in range(n_users)], dtype=object),
+        "item_ids": np.array([f"P{number}" for number in range(n_items)], dtype=object),
+        "global_mean": 3.5,
+        # No clipping, so the exact top 10 has no ties at the bounds
+        "rating_scale": (-np.inf, np.inf),
+        "biased": True,
+    }
+    factors = cf_scoring.extract_svd_factors(arrays, arrays["item_ids"])
+    ann = ann_index.build_ann_index(factors, n_lists=50, random_state=0)
+    user_ids = list(arrays["user_ids"])
+    exact = cf_scoring.recommend_batch(factors, user_ids, 10)
+
+    def recall(nprobe):
+        approx = ann_index.recommend_batch(factors, ann, user_ids, 10, nprobe)
+        return np.mean([len({rec["product_id"] for rec in found}
+                            & {rec["product_id"] for rec in truth}) / 10
+                        for found, truth in zip(approx, exact)])
+
+    assert recall(16) >= 0.85
+    # Probing every list scores every item
+    assert recall(50) == 1.0
@@ -0,0 +1,50 @@
+""" Equivalence tests of the column-wise preprocessing against the row-wise functions"""
+import pandas as pd
+import pytest
+from src.project_pipeline import eda
+
+
+@pytest.fixture(name="reviews")
+def fixture_reviews() -> pd.DataFrame:
+    """Reviews with user lists of equal and unequal lengths and odd categories."""
+    return pd.DataFrame({
+        "product_id": ["P1", "P2", "P3", "P4"],
+        "category": ["Computers|Accessories|Cables", "", "Home", "Toys||Games"],
+        "rating": [4.2, 3.9, 5.0, 4.0],
+        "rating_count": [10, 3, 1, 7],
+        "user_id": ["U1,U2,U3", "U4,U5", "U6", "U7,U8,U9"],
+        "user_name": ["a,b,c", "d", "e", "f,g"],
+        "review_title": ["good,bad,ok", "fine,great,poor", "nice", "x,y,z"],
+    }, index=[10, 11, 12, 13])
+
+
+def split_users_rowwise(data: pd.DataFrame) -> pd.DataFrame:
+    """The original row-by-row split of the pipeline."""
+    return pd.concat([eda.split_users(row) for _, row in data.iterrows()], ignore_index=True)
+
+
+def test_split_users_frame_matches_split_users(reviews):
+    expected = split_users_rowwise(reviews)
+    result = eda.split_users_frame(reviews)
+
+    # Like zip, only as many users as the shortest list are kept per row
+    assert result["user_id"].tolist() == ["U1", "U2", "U3", "U4", "U6", "U7", "U8"]
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_split_users_frame_keeps_dtypes(reviews):
+    result = eda.split_users_frame(reviews)
+
+    pd.testing.assert_series_equal(result.dtypes, reviews.dtypes)
+    assert isinstance(result.index, pd.RangeIndex)
+
+
+def test_extract_categories_matches_extract_first_last(reviews):
+    expected = reviews.copy()
+    expected[["First_category", "Last_category"]] = expected["category"].apply(
+        lambda category: pd.Series(eda.extract_first_last(category)))
+    result = eda.extract_categories(reviews.copy())
+
+    assert result["First_category"].tolist() == ["Computers", "", "Home", "Toys"]
+    assert result["Last_category"].tolist() == ["Cables", "", "Home", "Games"]
+    pd.testing.assert_frame_equal(result, expected)
@@ -0,0 +1,53 @@
+""" Equivalence tests of the exported content-based model against the sklearn pipeline"""
+import numpy as np
+import pandas as pd
+import pytest
+from src.project_pipeline import model_export, model_training
+
+NUMERIC_FEATURES = ["discounted_price", "rating_count"]
+TEXT_FEATURE = "about_product"
+
+
+@pytest.fixture(name="train_data")
+def fixture_train_data() -> pd.DataFrame:
+    """Products with prices, counts, short descriptions and ratings."""
+    rng = np.random.default_rng(0)
+    words = np.array(["cable", "fast", "usb", "charger", "phone", "steel", "home", "led"])
+    return pd.DataFrame({
+        "discounted_price": rng.uniform(100, 5000, 200),
+        "rating_count": rng.integers(1, 1000, 200).astype(float),
+        "about_product": [" ".join(rng.choice(words, 5)) for _ in range(200)],
+        "rating": rng.uniform(1, 5, 200),
+    })
+
+
+@pytest.mark.parametrize("text_features", [None, {"vectorizer": "hashing", "n_features": 64}])
+def test_cbf_predict_matches_pipeline_predict(train_data, tmp_path, text_features):
+    pipeline = model_training.content_base_filtering(NUMERIC_FEATURES, TEXT_FEATURE, train_data,
+                                                     text_features=text_features)
+    model_export.export_cbf(pipeline, tmp_path / "best_cbf")
+    model = model_export.load_cbf(tmp_path / "best_cbf")
+    rows = train_data.drop(columns=["rating"])
+
+    predictions = model_export.cbf_predict(model, model_export.cbf_transform(model, rows))
+
+    np.testing.assert_array_equal(predictions, pipeline.predict(rows))
+
+
+def test_save_cbf_booster_keeps_preprocessing(train_data, tmp_path):
+    model_dir = tmp_path / "best_cbf"
+    first = model_training.content_base_filtering(NUMERIC_FEATURES, TEXT_FEATURE, train_data)
+    second = model_training.content_base_filtering(NUMERIC_FEATURES, TEXT_FEATURE,
+                                                   train_data.iloc[::-1])
+    model_export.export_cbf(first, model_dir)
+    preprocessor = (model_dir / model_export.CBF_PREPROCESSOR_FILE).read_bytes()
+
+    model_export.save_cbf_booster(second.named_steps["xgb_model"].get_booster(), model_dir)
+
+    assert (model_dir / model_export.CBF_PREPROCESSOR_FILE).read_bytes() == preprocessor
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["best_cbf"]
+    rows = train_data.drop(columns=["rating"])
+    model = model_export.load_cbf(model_dir)
+    np.testing.assert_array_equal(
+        model_export.cbf_predict(model, model_export.cbf_transform(model, rows)),
+        second.named_steps["xgb_model"].predict(first.named_steps["preprocessor"].transform(rows)))